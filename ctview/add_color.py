@@ -6,10 +6,17 @@ from typing import Dict, List
 from osgeo import gdal, gdalconst
 
 import ctview.gen_LUT_X_cycle as gen_LUT_X_cycle
+from ctview import raster_writer
 
 
 def color_raster_dtm_hillshade_with_LUT(
-    input_initial_basename: str, input_raster: str, output_dir: str, list_c: List[int], output_dir_LUT: str
+    input_initial_basename: str,
+    input_raster: str,
+    output_dir: str,
+    list_c: List[int],
+    output_dir_LUT: str,
+    raster_driver: str = "GTiff",
+    creation_options: Dict[str, str] = {},
 ):
     """Color a raster according to:
     - the color palette defined in a LUT file
@@ -23,6 +30,8 @@ def color_raster_dtm_hillshade_with_LUT(
         list_c (List[int]): the number of cycles that determines how th use the LUT.
         One colored raster will be created for each of the numbers of cycles in the list
         output_dir_LUT (str): output path for the LUT corresponding to each output raster
+        raster_driver (str, optional): One of GDAL raster drivers formats. Defaults to "GTiff".
+        creation_options (Dict[str, str], optional): creation options of the output rasters. Defaults to {}.
     """
     log.info("Build DTM hillshade color")
 
@@ -40,6 +49,8 @@ def color_raster_dtm_hillshade_with_LUT(
             output_dir_LUT=output_dir_LUT,
             raster_DTM_file=input_raster,
             nb_cycle=cycle,
+            raster_driver=raster_driver,
+            creation_options=creation_options,
         )
 
         cpt += 1
@@ -48,7 +59,13 @@ def color_raster_dtm_hillshade_with_LUT(
 
 
 def color_DTM_with_cycles(
-    las_input_file: str, output_dir_raster: str, output_dir_LUT: str, raster_DTM_file: str, nb_cycle: int
+    las_input_file: str,
+    output_dir_raster: str,
+    output_dir_LUT: str,
+    raster_DTM_file: str,
+    nb_cycle: int,
+    raster_driver: str = "GTiff",
+    creation_options: Dict[str, str] = {},
 ):
     """Color a raster with a LUT created depending of a choice of cycles
 
@@ -56,6 +73,8 @@ def color_DTM_with_cycles(
         file_las : str : points cloud
         file_DTM : str : DTM corresponding to the points cloud
         nb_cycle : int : the number of cycle that determine the LUT
+        raster_driver : str : GDAL raster driver of the output raster
+        creation_options : Dict[str, str] : creation options of the output raster
     """
     log.info("Generate DTM colorised :")
     log.info("(1/2) Generate LUT.")
@@ -79,10 +98,12 @@ def color_DTM_with_cycles(
         input_raster=raster_DTM_file,
         output_raster=raster_DTM_color_file,
         LUT=LUT,
+        raster_driver=raster_driver,
+        creation_options=creation_options,
     )
 
 
-def color_raster_with_LUT(input_raster, output_raster, LUT):
+def color_raster_with_LUT(input_raster, output_raster, LUT, raster_driver="GTiff", creation_options={}):
     """
     Deprecated (used only for cycle DTM generation, which is not in use anymore)
     Color raster with a LUT
@@ -90,19 +111,29 @@ def color_raster_with_LUT(input_raster, output_raster, LUT):
     output_raster : path of raster colorised
     dim : dimension to color
     LUT : dictionnary of color
+    raster_driver : GDAL raster driver of the output raster
+    creation_options : creation options of the output raster
     """
 
     gdal.DEMProcessing(
         destName=output_raster,
         srcDS=input_raster,
         processing="color-relief",
+        format=raster_driver,
+        creationOptions=[f"{key}={value}" for key, value in creation_options.items()],
         computeEdges=True,
         colorFilename=LUT,
         colorSelection="linear_interpolation",
     )
 
 
-def color_raster_with_interpolation(input_raster: str, output_raster: str, colormap: List[Dict]):
+def color_raster_with_interpolation(
+    input_raster: str,
+    output_raster: str,
+    colormap: List[Dict],
+    raster_driver: str = "GTiff",
+    creation_options: Dict[str, str] = {},
+):
     """Color raster with a color map. To be used for non-categorical data
     (eg. floating point data such as density values)
 
@@ -113,8 +144,12 @@ def color_raster_with_interpolation(input_raster: str, output_raster: str, color
         Example: [{value: 1, color: [255, 255, 255]},
                   {value: 100, color: [0, 0, 0]}]
         Colors are interpolated between the points in colormap.
+        raster_driver (str, optional): One of GDAL raster drivers formats. Defaults to "GTiff".
+        creation_options (Dict[str, str], optional): creation options of the output raster
+        (cf. utils_raster.get_creation_options). Defaults to {}.
     """
 
+    raster_writer.wait_for(input_raster)
     colormap_lines = [f"{row['value']} {row['color'][0]} {row['color'][1]} {row['color'][2]}" for row in colormap]
 
     with tempfile.NamedTemporaryFile(suffix="colormap.txt", delete=True, dir="./") as colormap_file:
@@ -125,6 +160,8 @@ def color_raster_with_interpolation(input_raster: str, output_raster: str, color
             destName=output_raster,
             srcDS=input_raster,
             processing="color-relief",
+            format=raster_driver,
+            creationOptions=[f"{key}={value}" for key, value in creation_options.items()],
             computeEdges=True,
             colorFilename=colormap_file.name,
             colorSelection="linear_interpolation",
@@ -190,6 +227,7 @@ def convert_raster_with_color_metadata_to_rgb(input_raster: str, output_raster:
         input_raster (str): Path to a single band raster with colormap metadata
         output_raster (str): Path to the output 3 bands (rgb) raster
     """
+    raster_writer.wait_for(input_raster)
     ds = gdal.Open(input_raster)
     ds = gdal.Translate(output_raster, ds, rgbExpand="rgb")  # Use colors in metadata
     ds = None  # close file
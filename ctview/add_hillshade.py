@@ -1,5 +1,7 @@
 from osgeo import gdal
 
+from ctview import raster_writer
+
 
 def add_hillshade_one_raster(input_raster: str, output_raster: str):
     """Add hillshade to raster
@@ -7,4 +9,5 @@ def add_hillshade_one_raster(input_raster: str, output_raster: str):
         input_raster : input file with complete path
         output_raster : output file with complete path
     """
+    raster_writer.wait_for(input_raster)
     gdal.DEMProcessing(destName=output_raster, srcDS=input_raster, processing="hillshade", computeEdges=True)
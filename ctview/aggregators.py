@@ -0,0 +1,252 @@
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+# Registry of the per-pixel aggregators: name -> {"dimensions": [...], "fn": callable, "fill_value": ..., ...}
+AGGREGATORS = {}
+
+# Number of layers of the return number histogram (returns 1 to RETURN_NUMBER_MAX, higher returns are counted
+# in the last layer)
+RETURN_NUMBER_MAX = 7
+
+
+def register_aggregator(name: str, dimensions: List[str] = [], fill_value: float = 0, nb_layers: int = 1):
+    """Decorator to register a per-pixel aggregator under `name`.
+
+    The decorated function is called with:
+    - values (Dict[str, np.array]): the values of the requested `dimensions` for the points of the grid,
+      sorted by pixel
+    - starts (np.array): index of the first point of each non-empty pixel in the sorted values
+    - pixel_size (float): pixel size of the grid
+    and must return the aggregated value of each non-empty pixel, as an array with shape (len(starts),)
+    (or (nb_layers, len(starts)) for aggregators that generate several layers).
+    Use grouped reductions (eg. np.add.reduceat(values["z"], starts)) to keep it vectorized.
+
+    Args:
+        name (str): name of the aggregator (used in generate_raster_raw `fn` argument)
+        dimensions (List[str], optional): point dimensions needed by the aggregator (laspy names, eg. "z",
+        "intensity", "return_number"). Defaults to [].
+        fill_value (float, optional): value of the empty pixels (use np.nan for no data). Defaults to 0.
+        nb_layers (int, optional): number of layers generated by the aggregator. Defaults to 1.
+    """
+
+    def decorator(fn: Callable):
+        AGGREGATORS[name] = {"dimensions": dimensions, "fn": fn, "fill_value": fill_value, "nb_layers": nb_layers}
+        return fn
+
+    return decorator
+
+
+def get_aggregator(name: str) -> Dict:
+    if name not in AGGREGATORS:
+        raise ValueError(f"Unknown aggregator {name}, available aggregators are {list(AGGREGATORS)}")
+
+    return AGGREGATORS[name]
+
+
+def count_points_by_group(starts: np.array, nb_points: int) -> np.array:
+    """Number of points in each group, from the index of the first point of each group"""
+    return np.diff(np.append(starts, nb_points))
+
+
+@register_aggregator("count")
+def aggregate_count(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return count_points_by_group(starts, len(values["pixel_id"]))
+
+
+@register_aggregator("density")
+def aggregate_density(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return count_points_by_group(starts, len(values["pixel_id"])) / pixel_size**2
+
+
+@register_aggregator("presence")
+def aggregate_presence(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return np.ones(len(starts), dtype=np.uint8)
+
+
+@register_aggregator("z_min", dimensions=["z"], fill_value=np.nan)
+def aggregate_z_min(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return np.minimum.reduceat(values["z"], starts)
+
+
+@register_aggregator("z_max", dimensions=["z"], fill_value=np.nan)
+def aggregate_z_max(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return np.maximum.reduceat(values["z"], starts)
+
+
+@register_aggregator("z_mean", dimensions=["z"], fill_value=np.nan)
+def aggregate_z_mean(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return np.add.reduceat(values["z"], starts) / count_points_by_group(starts, len(values["z"]))
+
+
+@register_aggregator("z_std", dimensions=["z"], fill_value=np.nan)
+def aggregate_z_std(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    counts = count_points_by_group(starts, len(values["z"]))
+    mean = np.add.reduceat(values["z"], starts) / counts
+    # Use the deviation to the mean of each pixel to avoid precision issues with large z values
+    deviation = values["z"] - np.repeat(mean, counts)
+
+    return np.sqrt(np.add.reduceat(deviation**2, starts) / counts)
+
+
+@register_aggregator("intensity_mean", dimensions=["intensity"], fill_value=np.nan)
+def aggregate_intensity_mean(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    intensity = values["intensity"].astype(np.float64)
+
+    return np.add.reduceat(intensity, starts) / count_points_by_group(starts, len(intensity))
+
+
+@register_aggregator("return_number_histogram", dimensions=["return_number"], nb_layers=RETURN_NUMBER_MAX)
+def aggregate_return_number_histogram(values: Dict[str, np.array], starts: np.array, pixel_size: float) -> np.array:
+    return_number = np.clip(values["return_number"], 1, RETURN_NUMBER_MAX)
+
+    return np.array(
+        [np.add.reduceat((return_number == ii).astype(np.uint32), starts) for ii in range(1, RETURN_NUMBER_MAX + 1)]
+    )
+
+
+def get_grid_edges(origin: Tuple[float, float], tile_width: int, pixel_size: float) -> Tuple[np.array, np.array]:
+    """Pixels edges of the grid (same as in map_density.compute_count)
+
+    Returns:
+        Tuple[np.array, np.array]: edges along x (increasing), edges along y (increasing)
+    """
+    bins_x = np.arange(origin[0], origin[0] + tile_width + pixel_size, pixel_size)
+    bins_y = np.arange(origin[1] - tile_width, origin[1] + pixel_size, pixel_size)
+
+    return bins_x, bins_y
+
+
+def compute_pixel_index(points: np.array, bins_x: np.array, bins_y: np.array) -> np.array:
+    """Index of the pixel (row * nb_cols + col, rows from top to bottom) that contains each point, -1 for the points
+    outside of the grid.
+    As in np.histogram2d, pixels include their left/bottom edges, and the last column/first row also include their
+    right/top edges.
+    """
+    nb_cols = len(bins_x) - 1
+    nb_rows = len(bins_y) - 1
+    cols = np.searchsorted(bins_x, points[:, 0], side="right") - 1
+    cols[points[:, 0] == bins_x[-1]] = nb_cols - 1
+    rows = np.searchsorted(bins_y, points[:, 1], side="right") - 1
+    rows[points[:, 1] == bins_y[-1]] = nb_rows - 1
+    rows = nb_rows - 1 - rows  # rows from top to bottom
+
+    is_in_grid = (cols >= 0) & (cols < nb_cols) & (rows >= 0) & (rows < nb_rows)
+
+    return np.where(is_in_grid, rows * nb_cols + cols, -1)
+
+
+def split_range(length: int, nb_parts: int) -> List[Tuple[int, int]]:
+    """Split range(length) into at most `nb_parts` contiguous (start, stop) ranges of similar sizes"""
+    nb_parts = max(min(nb_parts, length), 1)
+    bounds = np.linspace(0, length, nb_parts + 1).astype(int)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def check_workers(workers: int):
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError(f"workers should be a positive integer, got {workers} instead")
+
+
+def compute_aggregated_layers(
+    input_points: np.array,
+    input_classifs: np.array,
+    layers: List[Tuple[str, List[int]]],
+    origin: Tuple[float, float],
+    tile_width: int,
+    pixel_size: float,
+    input_dimensions: Dict[str, np.array] = {},
+    workers: int = 1,
+) -> np.array:
+    """Compute several per-pixel aggregations on the same grid with a single sort of the points by pixel.
+
+    With workers > 1, the pixel index is computed on chunks of points, and the grid is split into horizontal
+    stripes that are sorted and aggregated in a thread pool (numpy releases the GIL in searchsorted and argsort).
+    The points of a pixel are always aggregated in their input order, so that the result is identical
+    to the single-threaded computation.
+
+    Args:
+        input_points (np.array): numpy array with the input points (x, y, z)
+        input_classifs (np.array): numpy array with classifications of the input points
+        layers (List[Tuple[str, List[int]]]): list of (aggregator name, classes) to compute. The aggregator is
+        computed on the points with the given classes only (all points if classes is empty).
+        Eg. [("count", []), ("z_max", [3, 4, 5])]
+        origin (Tuple[float, float]): origin of the raster (top left corner of the upper left pixel)
+        tile_width (int): tile width (in meters)
+        pixel_size (float): pixel size of the grid
+        input_dimensions (Dict[str, np.array], optional): additional point dimensions needed by the aggregators
+        (eg. {"intensity": ..., "return_number": ...}). "x", "y", "z" and "classification" are taken from
+        input_points and input_classifs. Defaults to {}.
+        workers (int, optional): number of threads used for the computation. Defaults to 1.
+
+    Raises:
+        ValueError: if an aggregator is unknown, if a dimension needed by an aggregator is missing, or if workers
+        is not a positive integer
+
+    Returns:
+        np.array: aggregated layers, with shape (nb_layers, nb_rows, nb_cols) (aggregators that generate several
+        layers contribute all their layers, in order)
+    """
+    check_workers(workers)
+    dimensions = {
+        "x": input_points[:, 0],
+        "y": input_points[:, 1],
+        "z": input_points[:, 2],
+        "classification": input_classifs,
+        **input_dimensions,
+    }
+    aggregators = [get_aggregator(name) for name, _ in layers]
+    missing_dimensions = {dim for agg in aggregators for dim in agg["dimensions"]} - set(dimensions)
+    if missing_dimensions:
+        raise ValueError(f"Dimensions {missing_dimensions} are needed by the aggregators but are not provided")
+
+    bins_x, bins_y = get_grid_edges(origin, tile_width, pixel_size)
+    nb_rows, nb_cols = len(bins_y) - 1, len(bins_x) - 1
+    grids = [
+        np.full((agg["nb_layers"], nb_rows * nb_cols), agg["fill_value"], dtype=np.float64) for agg in aggregators
+    ]
+
+    def aggregate_pixel_range(pixel_range: Tuple[int, int]):
+        # Sorted pixel index shared by all the layers (for the pixels of pixel_range)
+        first_pixel, last_pixel = pixel_range
+        selected = np.flatnonzero((pixel_index >= first_pixel) & (pixel_index < last_pixel))
+        order = selected[np.argsort(pixel_index[selected], kind="stable")]
+        sorted_values = {"pixel_id": pixel_index[order]}
+        sorted_classifs = np.asarray(input_classifs)[order]
+
+        def get_sorted_values(dim: str) -> np.array:
+            if dim not in sorted_values:
+                sorted_values[dim] = np.asarray(dimensions[dim])[order]
+            return sorted_values[dim]
+
+        for (name, classes), aggregator, grid in zip(layers, aggregators, grids):
+            values = {dim: get_sorted_values(dim) for dim in ["pixel_id"] + aggregator["dimensions"]}
+            if classes:
+                # Filtering keeps the points sorted by pixel: no need to sort again
+                is_kept = np.isin(sorted_classifs, classes)
+                values = {dim: value[is_kept] for dim, value in values.items()}
+
+            pixel_id = values["pixel_id"]
+            starts = np.flatnonzero(np.diff(pixel_id, prepend=-1))
+            if len(pixel_id):
+                # Each pixel range writes to its own pixels only
+                grid[:, pixel_id[starts]] = aggregator["fn"](values, starts, pixel_size)
+
+    def compute_chunk_pixel_index(chunk: Tuple[int, int]) -> np.array:
+        start, stop = chunk
+        return compute_pixel_index(input_points[start:stop], bins_x, bins_y)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pixel_index = np.concatenate(
+            list(executor.map(compute_chunk_pixel_index, split_range(len(input_points), workers)))
+        )
+        # Split the grid into stripes of whole rows
+        pixel_ranges = [(start * nb_cols, stop * nb_cols) for start, stop in split_range(nb_rows, workers)]
+        list(executor.map(aggregate_pixel_range, pixel_ranges))
+
+    log.debug(f"Computed {len(layers)} aggregation(s) on a grid of {nb_rows}x{nb_cols} pixels ({workers} worker(s))")
+
+    return np.concatenate([grid.reshape(-1, nb_rows, nb_cols) for grid in grids], axis=0)
@@ -0,0 +1,464 @@
+import copy
+import logging as log
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import laspy
+import numpy as np
+from omegaconf import DictConfig
+from pdaltools.las_info import parse_filename
+
+from ctview import aggregators, spatial_index, utils_las
+from ctview.shared_points import SharedPoints
+from ctview.strip_cache import StripCache, get_strip_mask
+
+# Orders in which the blocks can be processed (cf. order_blocks)
+BLOCK_ORDERS = ["hilbert", "serpentine", "lexicographic"]
+
+# Memory used by each point of a block in addition to its las record: coordinates as float64 and classification
+POINT_ARRAYS_SIZE = 3 * 8 + 1
+
+
+@dataclass
+class BlockPoints:
+    """Points of a block of tiles and of its buffer ring, each file being decoded only once.
+
+    records: las points of each file (only in the block bounds), kept to write the buffered las files of the tiles
+    points: coordinates (x, y, z) of all the points
+    classifs: classification of all the points
+    nb_decoded_files: number of files that have been decoded (the others come from a StripCache)
+    nb_decoded_bytes: size of the files that have been decoded
+    shared: container of points and classifs when they are shared with other processes (cf. read_block_points)
+    """
+
+    records: Dict[str, laspy.LasData] = field(default_factory=dict)
+    points: np.array = None
+    classifs: np.array = None
+    nb_decoded_files: int = 0
+    nb_decoded_bytes: int = 0
+    shared: SharedPoints = None
+
+
+def get_tiles_by_index(filenames: List[str], tile_width: int, tile_coord_scale: int) -> Dict[Tuple[int, int], str]:
+    """Index the tiles by their position (column, row) in the tile grid, parsed from their filenames
+    (cf. pdaltools.las_info.parse_filename). Rows increase to the north.
+    When several files have the same position, the last one in the alphabetical order is kept (eg. the most recent
+    year, as in pdaltools)"""
+    offset = tile_width // tile_coord_scale
+    tiles_by_index = {}
+    for filename in sorted(filenames):
+        _, coord_x, coord_y, _ = parse_filename(filename)
+        tile_index = (coord_x // offset, coord_y // offset)
+        if tile_index in tiles_by_index:
+            log.warning(f"Several tiles at position {tile_index}: {tiles_by_index[tile_index]} replaced by {filename}")
+        tiles_by_index[tile_index] = filename
+
+    return tiles_by_index
+
+
+def get_tile_index_of(
+    tile_filename: str, tiles_by_index: Dict[Tuple[int, int], str], tile_width: int, tile_coord_scale: int
+) -> Tuple[int, int]:
+    """Position of a tile in the tile grid (cf. get_tiles_by_index)
+
+    Raises:
+        ValueError: if the tile is not in tiles_by_index (file missing from the input directory, filename that does
+        not match the tile grid, or file replaced by another one at the same position)
+    """
+    tile_index = next((index for index, filename in tiles_by_index.items() if filename == tile_filename), None)
+    if tile_index is None:
+        raise ValueError(
+            f"Tile {tile_filename} not found in the tile grid of the input directory (with tile_width={tile_width} "
+            f"and tile_coord_scale={tile_coord_scale}): check that the file is in io.input_dir and that its "
+            "coordinates match io.tile_geometry"
+        )
+
+    return tile_index
+
+
+def group_tiles_by_block(tile_indices: List[Tuple[int, int]], block_size: int) -> List[List[Tuple[int, int]]]:
+    """Group tiles in blocks of block_size x block_size adjacent tiles of the tile grid (blocks on the edges of the
+    area may be incomplete). Blocks are sorted by position, and the tiles of each block as well."""
+    blocks = {}
+    for column, row in sorted(tile_indices):
+        blocks.setdefault((column // block_size, row // block_size), []).append((column, row))
+
+    return [blocks[key] for key in sorted(blocks)]
+
+
+def get_hilbert_index(x: int, y: int, nb_cells: int) -> int:
+    """Position of the cell (x, y) along the Hilbert curve that covers a nb_cells x nb_cells grid (nb_cells must be
+    a power of 2)"""
+    index = 0
+    step = nb_cells // 2
+    while step > 0:
+        rx = int(x & step > 0)
+        ry = int(y & step > 0)
+        index += step * step * ((3 * rx) ^ ry)
+        # rotate the quadrant so that the curve is continuous
+        if ry == 0:
+            if rx == 1:
+                x, y = nb_cells - 1 - x, nb_cells - 1 - y
+            x, y = y, x
+        step //= 2
+
+    return index
+
+
+def order_blocks(
+    blocks: List[List[Tuple[int, int]]], block_size: int, order: str = "hilbert"
+) -> List[List[Tuple[int, int]]]:
+    """Sort the blocks (cf. group_tiles_by_block) so that consecutive blocks are adjacent as often as possible, which
+    lets the caches (StripCache, OS page cache) serve the neighbor tiles:
+    - "hilbert": along a Hilbert curve over the block grid
+    - "serpentine": row by row, alternating the direction of the rows
+    - "lexicographic": by column, then row
+
+    Raises:
+        ValueError: if order is not in BLOCK_ORDERS
+    """
+    if order not in BLOCK_ORDERS:
+        raise ValueError(f"block.order should be one of {BLOCK_ORDERS}, got {order} instead")
+
+    if not blocks or order == "lexicographic":
+        return sorted(blocks)
+
+    # all the tiles of a block have the same block position
+    positions = np.array([(tiles[0][0] // block_size, tiles[0][1] // block_size) for tiles in blocks])
+    positions -= positions.min(axis=0)
+    if order == "serpentine":
+        keys = [(row, column if row % 2 == 0 else -column) for column, row in positions]
+    else:
+        nb_cells = 1 << int(np.ceil(np.log2(positions.max() + 1)))
+        keys = [get_hilbert_index(column, row, nb_cells) for column, row in positions]
+
+    return [blocks[ii] for ii in sorted(range(len(blocks)), key=lambda ii: keys[ii])]
+
+
+def get_neighbor_indices(block: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Positions of the tiles that are adjacent to the block (its buffer ring)"""
+    neighbors = {
+        (column + d_col, row + d_row) for column, row in block for d_col in (-1, 0, 1) for d_row in (-1, 0, 1)
+    }
+
+    return sorted(neighbors.difference(block))
+
+
+def get_tile_bounds(tile_index: Tuple[int, int], tile_width: int, buffer_size: float = 0) -> Tuple[float, ...]:
+    """Bounds (xmin, ymin, xmax, ymax) of a tile with a buffer"""
+    column, row = tile_index
+    xmin, ymax = column * tile_width, row * tile_width
+
+    return (xmin - buffer_size, ymax - tile_width - buffer_size, xmin + tile_width + buffer_size, ymax + buffer_size)
+
+
+def get_block_bounds(block: List[Tuple[int, int]], tile_width: int, buffer_size: float) -> Tuple[float, ...]:
+    """Bounds (xmin, ymin, xmax, ymax) of a block of tiles with a buffer"""
+    tiles_bounds = np.array([get_tile_bounds(tile_index, tile_width, buffer_size) for tile_index in block])
+
+    return (*tiles_bounds[:, :2].min(axis=0), *tiles_bounds[:, 2:].max(axis=0))
+
+
+def is_in_bounds(points: np.array, bounds: Tuple[float, ...]) -> np.array:
+    """Mask of the points in bounds (xmin, ymin, xmax, ymax), edges included (as the pdal crop filter)"""
+    xmin, ymin, xmax, ymax = bounds
+
+    return (points[:, 0] >= xmin) & (points[:, 0] <= xmax) & (points[:, 1] >= ymin) & (points[:, 1] <= ymax)
+
+
+def are_bounds_intersecting(bounds_1: Tuple[float, ...], bounds_2: Tuple[float, ...]) -> bool:
+    """Check if two bounds (xmin, ymin, xmax, ymax) intersect, edges included"""
+    return (
+        bounds_1[0] <= bounds_2[2]
+        and bounds_2[0] <= bounds_1[2]
+        and bounds_1[1] <= bounds_2[3]
+        and bounds_2[1] <= bounds_1[3]
+    )
+
+
+def get_block_size(
+    tiles_metadata: List[Dict], block_size: int, memory_budget: float | None, tile_width: int, buffer_size: float
+) -> int:
+    """Largest block size lower than or equal to `block_size` for which the points of a block with its buffer ring
+    fit in `memory_budget` (in MB), estimated from the mean number of points per tile (read in the las headers).
+
+    Args:
+        tiles_metadata (List[Dict]): metadata of the las files of the tiles (cf. utils_pdal.get_las_metadata)
+        block_size (int): requested number of tiles on each side of a block
+        memory_budget (float | None): memory available for the points of a block (in MB), None for no limit
+        tile_width (int): tile width (in meters)
+        buffer_size (float): buffer size (in meters)
+
+    Returns:
+        int: block size (at least 1)
+    """
+    if not memory_budget or not tiles_metadata:
+        return block_size
+
+    bytes_per_tile = np.mean([metadata["point_count"] for metadata in tiles_metadata]) * (
+        np.mean([metadata["point_size"] for metadata in tiles_metadata]) + POINT_ARRAYS_SIZE
+    )
+
+    def estimate_memory(size: int) -> float:
+        # points of the block with its buffer ring, plus the buffered las file of one tile
+        block_area = (size * tile_width + 2 * buffer_size) ** 2 + (tile_width + 2 * buffer_size) ** 2
+        return block_area / tile_width**2 * bytes_per_tile / 1024**2
+
+    size = block_size
+    while size > 1 and estimate_memory(size) > memory_budget:
+        size -= 1
+    if estimate_memory(size) > memory_budget:
+        log.warning(f"A single tile needs about {estimate_memory(size):.0f} MB (memory budget: {memory_budget} MB)")
+    log.info(f"Block size: {size} (estimated memory per block: {estimate_memory(size):.0f} MB)")
+
+    return size
+
+
+def read_tile_points(
+    las_file: str, bounds: Tuple[float, ...] = None, copc_resolution: float = None
+) -> Tuple[laspy.LasData, float]:
+    """Decode the points of a las file. If bounds are given, only the parts of the file that can contain points in
+    bounds are decoded (the points are not cropped to bounds):
+    - for a COPC file: the nodes of the octree that intersect bounds (cf. spatial_index.read_copc), with only the
+    levels needed for copc_resolution if it is set
+    - for a file with an up-to-date sidecar index (cf. spatial_index.build_index): the chunks listed for bounds
+    Otherwise, the whole file is read (memory-mapped if it is not compressed, cf. utils_las.read_las).
+
+    Returns:
+        Tuple[laspy.LasData, float]: points, and share of the points of the file that have been decoded
+    """
+    if spatial_index.is_copc(las_file):
+        las, point_count = spatial_index.read_copc(las_file, bounds, copc_resolution)
+        return las, len(las.points) / max(point_count, 1)
+
+    index = spatial_index.load_index(las_file) if bounds is not None else None
+    if index is None:
+        return utils_las.read_las(las_file), 1
+
+    las = spatial_index.read_chunks_in_bounds(las_file, bounds, index)
+
+    return las, len(las.points) / max(index["point_count"], 1)
+
+
+def read_block_points(
+    block: List[Tuple[int, int]],
+    tiles_by_index: Dict[Tuple[int, int], str],
+    input_dir: str,
+    tile_width: int,
+    buffer_size: float,
+    strip_cache: StripCache = None,
+    decode_workers: int = 1,
+    copc_resolution: float = None,
+    tiles_metadata: Dict[str, Dict] = None,
+    shared: bool = False,
+    shared_memory_dir: str = None,
+) -> BlockPoints:
+    """Read the points of a block of tiles and of its buffer ring (the adjacent tiles, cropped to the block bounds
+    with the buffer), each file being decoded only once.
+    If a strip_cache is given, the points of the adjacent tiles are taken from the cache when possible, and the
+    edge strips of the decoded files are added to the cache for the next blocks.
+    The files are decoded concurrently by `decode_workers` threads (laspy also uses the parallel lazrs backend
+    when it is available, to decode the chunks of each laz file concurrently). Only the useful parts of the adjacent
+    tiles that are COPC files or that have a sidecar index are decoded (cf. read_tile_points): their strips are not
+    added to the cache.
+
+    Args:
+        block (List[Tuple[int, int]]): positions of the tiles of the block
+        tiles_by_index (Dict[Tuple[int, int], str]): filename of each tile (cf. get_tiles_by_index)
+        input_dir (str): directory of the las files
+        tile_width (int): tile width (in meters)
+        buffer_size (float): buffer size (in meters)
+        strip_cache (StripCache, optional): cache of the edge strips of the tiles. Defaults to None.
+        decode_workers (int, optional): number of files decoded at the same time. Defaults to 1.
+        copc_resolution (float, optional): point spacing (in meters) at which the COPC files are read, for low
+        resolution previews (cf. read_tile_points). Defaults to None (all the points).
+        tiles_metadata (Dict[str, Dict], optional): metadata of the las files by filename
+        (cf. utils_pdal.get_tile_index), used to skip the adjacent tiles whose bounds do not intersect the block
+        bounds without decoding them. Defaults to None.
+        shared (bool, optional): fill the points and classifs arrays in a shared_points.SharedPoints container
+        (block_points.shared, to be closed by the caller) so that they can be read by other processes without being
+        copied. Defaults to False.
+        shared_memory_dir (str, optional): preferred directory of the shared arrays (cf.
+        shared_points.get_shared_memory_dir). Defaults to None (shared_points.SHARED_MEMORY_DIR).
+
+    Returns:
+        BlockPoints: points of the block
+    """
+    bounds = get_block_bounds(block, tile_width, buffer_size)
+    block_points = BlockPoints()
+    tile_indices = [tile_index for tile_index in block + get_neighbor_indices(block) if tile_index in tiles_by_index]
+    if tiles_metadata:
+        # the header bounds are supposed to contain all the points of the files (cf. utils_pdal.get_las_metadata)
+        for tile_index in [t for t in tile_indices if t not in block]:
+            tile_bounds = tiles_metadata[tiles_by_index[tile_index]]["bounds"]
+            if not are_bounds_intersecting(tile_bounds, bounds):
+                log.debug(f"File {tiles_by_index[tile_index]} skipped: header bounds {tile_bounds} out of {bounds}")
+                tile_indices.remove(tile_index)
+    las_files = {tile_index: os.path.join(input_dir, tiles_by_index[tile_index]) for tile_index in tile_indices}
+
+    # the cache is used by this thread only, the files that are not in the cache are decoded by the pool
+    las_by_index = {}
+    # the cached strips have all the points: they are not used for low resolution previews
+    if strip_cache and copc_resolution is None:
+        for tile_index in tile_indices:
+            if tile_index not in block:
+                las_by_index[tile_index] = strip_cache.get(las_files[tile_index], buffer_size)
+    to_decode = [tile_index for tile_index in tile_indices if las_by_index.get(tile_index) is None]
+    with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+        decoded = dict(
+            zip(
+                to_decode,
+                executor.map(
+                    read_tile_points,
+                    [las_files[t] for t in to_decode],
+                    [None if t in block else bounds for t in to_decode],
+                    repeat(copc_resolution),
+                ),
+            )
+        )
+
+    for tile_index in tile_indices:
+        las_file = las_files[tile_index]
+        if tile_index in decoded:
+            las, decoded_share = decoded.pop(tile_index)
+            block_points.nb_decoded_files += 1
+            block_points.nb_decoded_bytes += round(decoded_share * os.path.getsize(las_file))
+            if strip_cache and decoded_share == 1:
+                is_in_strip = get_strip_mask(
+                    np.vstack((las.x, las.y)).transpose(), get_tile_bounds(tile_index, tile_width), buffer_size
+                )
+                strip_cache.put(
+                    las_file, buffer_size, laspy.LasData(copy.deepcopy(las.header), las.points[is_in_strip])
+                )
+        else:
+            las = las_by_index[tile_index]
+        is_kept = is_in_bounds(np.vstack((las.x, las.y)).transpose(), bounds)
+        if not np.any(is_kept) and tile_index not in block:
+            log.debug(f"File {tiles_by_index[tile_index]} ignored: no points in the block bounds")
+            continue
+        # new LasData: the cached strips must not be modified (the records of the files that are entirely in the
+        # block bounds are not copied, eg. to keep the memory-mapped records of the uncompressed files)
+        block_points.records[tiles_by_index[tile_index]] = laspy.LasData(
+            copy.deepcopy(las.header), las.points if np.all(is_kept) else las.points[is_kept]
+        )
+
+    # fill the arrays of the block in place, without intermediate arrays per file
+    records = list(block_points.records.values())
+    nb_points = sum(len(las.points) for las in records)
+    if shared:
+        block_points.shared = SharedPoints(base_dir=shared_memory_dir, nbytes=nb_points * POINT_ARRAYS_SIZE)
+        block_points.points = block_points.shared.allocate("points", (nb_points, 3), np.float64)
+        block_points.classifs = block_points.shared.allocate("classifs", (nb_points,), np.uint8)
+    else:
+        block_points.points = np.empty((nb_points, 3), dtype=np.float64)
+        block_points.classifs = np.empty(nb_points, dtype=np.uint8)
+    start = 0
+    for las in records:
+        stop = start + len(las.points)
+        for ii, dimension in enumerate(["x", "y", "z"]):
+            block_points.points[start:stop, ii] = las[dimension]
+        block_points.classifs[start:stop] = las.classification
+        start = stop
+    log.info(
+        f"Read {len(records)} files ({block_points.nb_decoded_files} decoded) for a block of {len(block)} tiles "
+        f"({len(block_points.points)} points)"
+    )
+
+    return block_points
+
+
+def iter_block_points(
+    blocks: List[List[Tuple[int, int]]], read_block: Callable[[List[Tuple[int, int]]], BlockPoints], prefetch: int = 0
+) -> Iterator[Tuple[List[Tuple[int, int]], BlockPoints]]:
+    """Read the points of the blocks in their order with read_block (eg. read_block_points with its other arguments
+    set), the next `prefetch` blocks being read in a background thread while the current block is processed.
+    The blocks are read one at a time and in order, so that a StripCache used by read_block works as without
+    prefetch.
+
+    Args:
+        blocks (List[List[Tuple[int, int]]]): blocks of tiles (cf. group_tiles_by_block)
+        read_block (Callable[[List[Tuple[int, int]]], BlockPoints]): function that reads the points of a block
+        prefetch (int, optional): number of blocks read in advance. Defaults to 0 (no background thread).
+
+    Yields:
+        Tuple[List[Tuple[int, int]], BlockPoints]: tiles and points of each block
+    """
+    if prefetch == 0:
+        for tiles in blocks:
+            yield tiles, read_block(tiles)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        for tiles in blocks:
+            pending.append((tiles, executor.submit(read_block, tiles)))
+            if len(pending) > prefetch:
+                next_tiles, future = pending.popleft()
+                yield next_tiles, future.result()
+        while pending:
+            next_tiles, future = pending.popleft()
+            yield next_tiles, future.result()
+
+
+def write_tile_with_buffer(
+    block_points: BlockPoints, tile_filename: str, bounds: Tuple[float, ...], output_filename: str
+):
+    """Write the points of a block in `bounds` to a las file, with the header of the tile `tile_filename` (as
+    pdaltools.las_add_buffer.create_las_with_buffer does from the neighbor files). The dimensions that are not in the
+    point format of the tile are dropped.
+
+    Args:
+        block_points (BlockPoints): points of the block (tile_filename must be one of its files)
+        tile_filename (str): filename of the tile
+        bounds (Tuple[float, ...]): bounds (xmin, ymin, xmax, ymax) of the tile with its buffer
+        output_filename (str): path to the output las file
+    """
+    tile_las = block_points.records[tile_filename]
+    crops = []
+    for las in block_points.records.values():
+        is_kept = is_in_bounds(np.vstack((las.x, las.y)).transpose(), bounds)
+        if np.any(is_kept):
+            crops.append(las.points[is_kept])
+
+    output_las = laspy.LasData(copy.deepcopy(tile_las.header))
+    output_las.points = laspy.ScaleAwarePointRecord.zeros(sum(len(crop) for crop in crops), header=output_las.header)
+    dimensions = [d for d in output_las.point_format.dimension_names if d not in ("X", "Y", "Z")]
+    start = 0
+    for crop in crops:
+        stop = start + len(crop)
+        for dimension in ["x", "y", "z"]:
+            output_las[dimension][start:stop] = crop[dimension]
+        for dimension in dimensions:
+            if dimension in crop.point_format.dimension_names:
+                output_las[dimension][start:stop] = crop[dimension]
+        start = stop
+
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    output_las.write(output_filename)
+
+
+def check_config_block(config_block: DictConfig):
+    """Check the block mode configuration (cf. configs/config_control.yaml)
+
+    Raises:
+        ValueError: if config_block.size, config_block.workers, config_block.decode_workers or
+        config_block.tile_workers is not a positive integer, if config_block.prefetch is negative, if
+        config_block.memory_budget is not positive, or if config_block.order is unknown
+    """
+    if isinstance(config_block.size, bool) or not isinstance(config_block.size, int) or config_block.size < 1:
+        raise ValueError(f"block.size should be a positive integer, got {config_block.size} instead")
+    aggregators.check_workers(config_block.get("workers", 1))
+    aggregators.check_workers(config_block.get("decode_workers", 1))
+    aggregators.check_workers(config_block.get("tile_workers", 1))
+    prefetch = config_block.get("prefetch", 0)
+    if isinstance(prefetch, bool) or not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError(f"block.prefetch should be a non-negative integer, got {prefetch} instead")
+    if config_block.get("order", "hilbert") not in BLOCK_ORDERS:
+        raise ValueError(f"block.order should be one of {BLOCK_ORDERS}, got {config_block.order} instead")
+    memory_budget = config_block.get("memory_budget", None)
+    if memory_budget is not None and memory_budget <= 0:
+        raise ValueError(f"block.memory_budget should be positive or null, got {memory_budget} instead")
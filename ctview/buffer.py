@@ -0,0 +1,78 @@
+import logging as log
+from typing import List
+
+from omegaconf import DictConfig
+
+from ctview import count_cube
+
+# Value of config.buffer.size to compute the smallest buffer needed by the enabled stages (cf. get_buffer_size)
+AUTO_BUFFER_SIZE = "auto"
+
+# Number of DSM pixels around the tile that are used to interpolate the DSM on the tile edges. The DSM is
+# interpolated from a Delaunay triangulation (las_digital_models, without any interpolation parameter): a triangle
+# on the tile edges is the same as with all the neighbor points as long as its circumcircle, which contains no
+# point, is in the buffer. This margin supposes that the gaps between the DSM points (cf. class_map.dxm_filter) on
+# the tile edges are less than DXM_INTERPOLATION_MARGIN DSM pixels wide (about one point per DSM pixel, without
+# large holes such as water): otherwise, "auto" changes the DSM hillshade on the tile edges
+DXM_INTERPOLATION_MARGIN = 8
+
+# Number of DSM pixels around the tile needed by the hillshade (3x3 kernel)
+HILLSHADE_MARGIN = 1
+
+
+def get_binning_pixel_sizes(config: DictConfig) -> List[float]:
+    """Pixel sizes of all the rasters that are computed by binning the points (density maps, class maps and
+    class count cubes)"""
+    return sorted(set(count_cube.get_density_pixel_sizes(config) + count_cube.get_class_pixel_sizes(config)))
+
+
+def needs_dxm(config: DictConfig) -> bool:
+    """Whether a Digital Model is interpolated from the points (DSM hillshade of the pretty class map). It is the
+    only stage that uses the points of the neighbor tiles beyond the rasters extent."""
+    return bool(count_cube.get_class_pixel_sizes(config) and config.class_map.output_class_pretty_subdir)
+
+
+def get_binning_margin(config: DictConfig) -> float:
+    """Margin needed around the tile to bin the points: the rasters are centered on the tile grid so they extend
+    half a pixel beyond the tile on its left and top edges (cf. utils_raster.is_in_raster_extent)"""
+    pixel_sizes = get_binning_pixel_sizes(config)
+
+    return max(pixel_sizes) / 2 if pixel_sizes else 0
+
+
+def get_dxm_margin(config: DictConfig) -> float:
+    """Margin needed around the tile to compute the DSM hillshades of the pretty class maps (one DSM per class
+    pixel size): interpolation and hillshade margins, in DSM pixels"""
+    if not needs_dxm(config):
+        return 0
+
+    return max(count_cube.get_class_pixel_sizes(config)) * (DXM_INTERPOLATION_MARGIN + HILLSHADE_MARGIN)
+
+
+def get_buffer_size(config: DictConfig) -> float:
+    """Size of the buffer to add to the tile from its neighbors:
+    - if config.buffer.size is "auto": the smallest buffer needed by the enabled stages (cf. get_binning_margin and
+    get_dxm_margin)
+    - otherwise: config.buffer.size (at least the margin needed to bin the points)
+
+    Raises:
+        ValueError: if config.buffer.size is neither a positive number nor "auto"
+    """
+    size = config.buffer.size
+    binning_margin = get_binning_margin(config)
+    if size == AUTO_BUFFER_SIZE:
+        dxm_margin = get_dxm_margin(config)
+        buffer_size = max(binning_margin, dxm_margin)
+        log.info(f"Buffer size: {buffer_size}m (computed from the enabled stages)")
+        if dxm_margin:
+            log.info(f"The DSM points gaps on the tile edges are supposed to be less than {dxm_margin}m wide")
+    elif isinstance(size, bool) or not isinstance(size, (int, float)) or size < 0:
+        raise ValueError(f"buffer.size should be a positive number or '{AUTO_BUFFER_SIZE}', got {size} instead")
+    elif size < binning_margin:
+        buffer_size = binning_margin
+        log.warning(f"buffer.size ({size}m) replaced by {buffer_size}m: margin needed to bin the points")
+    else:
+        buffer_size = size
+        log.info(f"Buffer size: {buffer_size}m")
+
+    return buffer_size
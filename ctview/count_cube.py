@@ -0,0 +1,242 @@
+import logging as log
+import os
+import tempfile
+from typing import List, Tuple
+
+import numpy as np
+import rasterio
+from omegaconf import DictConfig
+
+from ctview import map_density, multi_resolution, raster_writer, utils_raster
+from ctview.map_class import raster_generation as map_class
+
+# Creation options of the count cubes: tiled and compressed so that they stay small and can be read by window
+COUNT_CUBE_CREATION_OPTIONS = {
+    "TILED": "YES",
+    "BLOCKXSIZE": 256,
+    "BLOCKYSIZE": 256,
+    "COMPRESS": "DEFLATE",
+    "PREDICTOR": 2,
+}
+
+
+def get_count_cube_dir(config: DictConfig, pixel_size: float) -> str:
+    """Directory of the count cubes (and cached hillshades) at a given pixel size"""
+    return os.path.join(
+        config.io.output_dir, config.count_cube.output_subdir, multi_resolution.get_pixel_size_subdir(pixel_size)
+    )
+
+
+def get_count_cube_path(config: DictConfig, pixel_size: float, tilename: str) -> str:
+    return os.path.join(get_count_cube_dir(config, pixel_size), f"{tilename}_counts.tif")
+
+
+def get_hillshade_path(config: DictConfig, pixel_size: float, tilename: str) -> str:
+    return os.path.join(get_count_cube_dir(config, pixel_size), f"{tilename}_dsm_hillshade{config.io.extension}")
+
+
+def get_density_pixel_sizes(config: DictConfig) -> List[float]:
+    """Pixel sizes at which the density map is generated (empty if the density map is disabled)"""
+    if not config.density.output_subdir:
+        return []
+    return list(config.multi_resolution.density_pixel_sizes or [config.density.pixel_size])
+
+
+def get_class_pixel_sizes(config: DictConfig) -> List[float]:
+    """Pixel sizes at which the class maps are generated (empty if the class maps are disabled)"""
+    if not (config.class_map.output_class_subdir or config.class_map.output_class_pretty_subdir):
+        return []
+    return list(config.multi_resolution.class_pixel_sizes or [config.class_map.pixel_size])
+
+
+def get_product_subdir(config: DictConfig, pixel_size: float, is_multi_resolution: bool) -> str:
+    """Output subdirectory for a product at a given pixel size (cf. multi_resolution mode)"""
+    return multi_resolution.get_pixel_size_subdir(pixel_size) if is_multi_resolution else ""
+
+
+def write_count_cube(
+    counts: np.array,
+    classes: List[int],
+    output_tif: str,
+    raster_origin: Tuple[float, float],
+    pixel_size: float,
+    epsg: int | str,
+):
+    """Write a class count cube (number of points of each class in each pixel) to a tiled and compressed
+    multiband GeoTiff, with one uint32 band per class (the class value is stored in the band description)
+
+    Args:
+        counts (np.array): points count with shape (len(classes), nb_rows, nb_cols)
+        classes (List[int]): class of each layer of counts
+        output_tif (str): path to the output file
+        raster_origin (Tuple[float, float]): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the raster
+        epsg (int | str): spatial reference of the output file
+    """
+    os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+
+    def write():
+        with rasterio.open(
+            output_tif,
+            "w",
+            driver="GTiff",
+            height=counts.shape[1],
+            width=counts.shape[2],
+            count=max(len(classes), 1),
+            dtype=rasterio.uint32,
+            crs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
+            transform=rasterio.transform.from_origin(raster_origin[0], raster_origin[1], pixel_size, pixel_size),
+            **COUNT_CUBE_CREATION_OPTIONS,
+        ) as out_file:
+            if len(classes):
+                out_file.write(counts.astype(np.uint32))
+                out_file.descriptions = tuple(str(c) for c in classes)
+            else:
+                out_file.write(np.zeros((1,) + counts.shape[1:], dtype=np.uint32))
+
+        log.debug(f"Saved class count cube to {output_tif}")
+
+    raster_writer.write(output_tif, write)
+
+
+def read_count_cube(input_tif: str) -> Tuple[np.array, List[int], Tuple[float, float], float]:
+    """Read a class count cube written by write_count_cube
+
+    Returns:
+        Tuple[np.array, List[int], Tuple[float, float], float]: points count with shape
+        (len(classes), nb_rows, nb_cols), classes, raster origin, pixel size
+    """
+    raster_writer.wait_for(input_tif)
+    with rasterio.open(input_tif) as cube:
+        classes = [int(description) for description in cube.descriptions if description is not None]
+        counts = cube.read()[: len(classes)]
+        raster_origin = (cube.transform.c, cube.transform.f)
+        pixel_size = cube.transform.a
+
+    return counts, classes, raster_origin, pixel_size
+
+
+def create_count_cubes_from_config(
+    input_points: np.array,
+    input_classifs: np.array,
+    tile_origin: Tuple[int, int],
+    tilename: str,
+    config: DictConfig,
+):
+    """Count the points of each class present in the input points, at each pixel size used by the density
+    and class maps, and save them as class count cubes in config.count_cube.output_subdir so that these products
+    can be re-rendered with rerender_from_count_cubes without reading the points again.
+
+    Args:
+        input_points (np.array): numpy array with the input points
+        input_classifs (np.array): numpy array with classifications of the input points
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tilename (str): tilename used to generate the output filenames
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+    """
+    classes = sorted(np.unique(input_classifs).tolist())
+    pixel_sizes = sorted(set(get_density_pixel_sizes(config) + get_class_pixel_sizes(config)))
+    for pixel_size in pixel_sizes:
+        raster_origin = utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size)
+        counts = multi_resolution.compute_class_counts(
+            input_points,
+            input_classifs,
+            classes,
+            raster_origin,
+            config.io.tile_geometry.tile_width,
+            pixel_size,
+            workers=config.io.get("workers", 1),
+        )
+        write_count_cube(
+            counts,
+            classes,
+            get_count_cube_path(config, pixel_size, tilename),
+            raster_origin,
+            pixel_size,
+            config.io.spatial_reference,
+        )
+    log.info(f"Saved class count cubes at pixel sizes {pixel_sizes}")
+
+
+def rerender_from_count_cubes(tilename: str, config: DictConfig):
+    """Re-generate the density and class maps of a tile from its class count cubes (cf.
+    create_count_cubes_from_config) with the current configuration (eg. density.keep_classes, colormaps,
+    class_map.mode, CBI_rules, precedence_classes, ignored_classes, post_processing), without reading the points.
+
+    The pretty class map needs the DSM hillshade that is saved next to the count cubes when the class map is
+    generated by main_ctview: it is skipped (with a warning) if this hillshade is missing.
+
+    Args:
+        tilename (str): tilename used to find the count cubes and to generate the output filenames
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+
+    Raises:
+        FileNotFoundError: if a count cube needed by the current configuration is missing
+    """
+    config_io = config.io
+    config_density = config.density
+    config_class = config.class_map
+    out_dir = config_io.output_dir
+    ext = config_io.extension
+
+    def read_cube(pixel_size):
+        cube_path = get_count_cube_path(config, pixel_size, tilename)
+        if not os.path.isfile(cube_path):
+            raise FileNotFoundError(f"Count cube {cube_path} not found: run ctview with count_cube.output_subdir set")
+        return read_count_cube(cube_path)
+
+    is_multi_resolution_density = bool(config.multi_resolution.density_pixel_sizes)
+    density_pixel_sizes = get_density_pixel_sizes(config)
+    if density_pixel_sizes:
+        map_density.check_config_density(config_density)
+    for pixel_size in density_pixel_sizes:
+        log.info(f"\nRe-render density map at {pixel_size}m")
+        counts, classes, raster_origin, _ = read_cube(pixel_size)
+        layers = []
+        for keep_classes in config_density.keep_classes:
+            # an empty list of classes means all the points
+            class_indices = [classes.index(c) for c in keep_classes or classes if c in classes]
+            layers.append(counts[class_indices].sum(axis=0))
+        subdir = get_product_subdir(config, pixel_size, is_multi_resolution_density)
+        output_tif = os.path.join(out_dir, config_density.output_subdir, subdir, f"{tilename}_density{ext}")
+        os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+        multi_resolution.write_density_raster_from_counts(
+            np.array(layers), output_tif, raster_origin, pixel_size, config_density, config_io
+        )
+
+    is_multi_resolution_class = bool(config.multi_resolution.class_pixel_sizes)
+    for pixel_size in get_class_pixel_sizes(config):
+        log.info(f"\nRe-render class map at {pixel_size}m")
+        counts, classes, raster_origin, _ = read_cube(pixel_size)
+        subdir = get_product_subdir(config, pixel_size, is_multi_resolution_class)
+
+        with tempfile.TemporaryDirectory(prefix="tmp_class_map", dir="tmp") as tmpdir:
+            if config_class.output_class_subdir:
+                output_class_dir = os.path.join(out_dir, config_class.output_class_subdir, subdir)
+            else:
+                output_class_dir = tmpdir
+            os.makedirs(output_class_dir, exist_ok=True)
+            class_raster_path = os.path.join(output_class_dir, f"{tilename}_class{ext}")
+            map_class.write_class_raster_from_counts(
+                counts,
+                classes,
+                output_tif=class_raster_path,
+                raster_origin=raster_origin,
+                pixel_size=pixel_size,
+                config_class=config_class,
+                config_io=config_io,
+            )
+
+            if config_class.output_class_pretty_subdir:
+                hillshade_path = get_hillshade_path(config, pixel_size, tilename)
+                if os.path.isfile(hillshade_path):
+                    map_class.generate_pretty_class_raster_with_hillshade(
+                        input_raster=class_raster_path,
+                        hillshade_raster=hillshade_path,
+                        tilename=tilename,
+                        output_dir=os.path.join(out_dir, config_class.output_class_pretty_subdir, subdir),
+                        config_class=config_class,
+                        config_io=config_io,
+                    )
+                else:
+                    log.warning(f"Skip pretty class map at {pixel_size}m: hillshade {hillshade_path} not found")
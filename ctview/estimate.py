@@ -0,0 +1,314 @@
+import logging as log
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+from omegaconf import DictConfig
+
+from ctview import block, buffer, count_cube, utils_pdal
+
+# Memory used by each point of a tile in addition to its las record: coordinates as float64 and classification
+# (cf. block.POINT_ARRAYS_SIZE) and their filtered copies, plus the pixel index and sort order (int64) used by the
+# aggregators
+POINT_WORK_SIZE = 2 * block.POINT_ARRAYS_SIZE + 2 * 8
+# Memory used by pdal for each point of the buffered tile in the DXM stage, relative to the size of its las record
+DXM_POINT_FACTOR = 2
+# Memory used by each pixel of the DXM stage: raw DXM and hillshade (float32), colored and mixed rasters (3 bands)
+DXM_PIXEL_SIZE = 4 + 4 + 3 + 3
+# Memory used by each pixel of a density layer: counts (float64) and converted output
+DENSITY_PIXEL_SIZE = 8 + 8
+# Memory used by each pixel of a class count cube layer (uint32, cf. multi_resolution.compute_class_counts)
+COUNT_PIXEL_SIZE = 4
+# Memory used by each pixel of the count of a single class while it is added to a count cube (int64)
+SINGLE_CLASS_COUNT_PIXEL_SIZE = 8
+# Memory used by each pixel of a class layer: class counts and presence (uint8)
+CLASS_PIXEL_SIZE = COUNT_PIXEL_SIZE + 1
+# Smallest number of points per chunk chosen in stream mode (cf. fit_tile_to_memory_budget)
+MIN_STREAM_CHUNK_SIZE = 10000
+# Size of the count cubes (DEFLATE with predictor, cf. count_cube.COUNT_CUBE_CREATION_OPTIONS) relative to their raw
+# size: most of the class layers are empty
+COUNT_CUBE_COMPRESSION_RATIO = 0.1
+
+# CPU time (in seconds) per point or per pixel of each stage (cf. estimate_tile_cpu_time), overridden by
+# config.estimate.cost_model. These are orders of magnitude, not measured values: the CPU times computed with
+# this default cost model are reported as uncalibrated (cf. main_estimate)
+DEFAULT_COST_MODEL = {
+    "read_per_point": 1e-7,
+    "density_per_point": 1e-7,
+    "class_map_per_point": 2e-7,
+    "count_cube_per_point": 2e-7,
+    "dxm_per_point": 1e-6,
+    "per_pixel": 1e-7,
+    "write_per_byte": 5e-9,
+}
+
+
+def get_nb_pixels(tile_width: int, pixel_size: float) -> int:
+    """Number of pixels of the rasters of a tile (cf. aggregators.get_grid_edges)"""
+    return (int(np.ceil(tile_width / pixel_size)) + 1) ** 2
+
+
+def get_overlap_share(las_bounds: Tuple[float, ...], bounds: Tuple[float, ...]) -> float:
+    """Share of the points of a las file (supposed to be uniformly distributed in its bounds) that are in bounds"""
+    if not block.are_bounds_intersecting(las_bounds, bounds):
+        return 0
+    width = min(las_bounds[2], bounds[2]) - max(las_bounds[0], bounds[0])
+    height = min(las_bounds[3], bounds[3]) - max(las_bounds[1], bounds[1])
+    area = (las_bounds[2] - las_bounds[0]) * (las_bounds[3] - las_bounds[1])
+
+    return width * height / area if area > 0 else 1
+
+
+def get_tile_point_count(
+    tile_index: Tuple[int, int],
+    tiles_by_index: Dict[Tuple[int, int], str],
+    tiles_metadata: Dict[str, Dict],
+    tile_width: int,
+    buffer_size: float,
+) -> Tuple[float, float]:
+    """Number of points of a tile with its buffer, estimated from the las headers (point counts and bounds) of the
+    tile and of its neighbors, without decoding any point
+
+    Args:
+        tile_index (Tuple[int, int]): position of the tile (cf. block.get_tiles_by_index)
+        tiles_by_index (Dict[Tuple[int, int], str]): filename of each tile
+        tiles_metadata (Dict[str, Dict]): metadata of the las files by filename (cf. utils_pdal.get_tile_index)
+        tile_width (int): tile width (in meters)
+        buffer_size (float): buffer size (in meters)
+
+    Returns:
+        Tuple[float, float]: number of points, and mean size of their las records (in bytes)
+    """
+    bounds = block.get_tile_bounds(tile_index, tile_width, buffer_size)
+    point_count, records_size = 0, 0
+    for index in [tile_index] + block.get_neighbor_indices([tile_index]):
+        if index not in tiles_by_index:
+            continue
+        metadata = tiles_metadata[tiles_by_index[index]]
+        share = 1 if index == tile_index else get_overlap_share(metadata["bounds"], bounds)
+        point_count += share * metadata["point_count"]
+        records_size += share * metadata["point_count"] * metadata["point_size"]
+
+    return point_count, records_size / point_count if point_count else 0
+
+
+def read_tile_point_count(tile_filename: str, buffer_size: float, config_io: DictConfig) -> Tuple[float, float]:
+    """Number of points of a tile of config_io.input_dir with its buffer, and mean size of their las records,
+    estimated from the headers of the tile and of its neighbors (cf. get_tile_point_count)
+
+    Raises:
+        ValueError: if the tile is not in the tile grid of config_io.input_dir (cf. block.get_tile_index_of)
+    """
+    tile_width = config_io.tile_geometry.tile_width
+    tile_coord_scale = config_io.tile_geometry.tile_coord_scale
+    tiles_by_index = block.get_tiles_by_index(utils_pdal.list_tiles(config_io.input_dir), tile_width, tile_coord_scale)
+    tile_index = block.get_tile_index_of(tile_filename, tiles_by_index, tile_width, tile_coord_scale)
+    tiles_metadata = {
+        tiles_by_index[index]: utils_pdal.get_las_metadata(os.path.join(config_io.input_dir, tiles_by_index[index]))
+        for index in [tile_index] + block.get_neighbor_indices([tile_index])
+        if index in tiles_by_index
+    }
+
+    return get_tile_point_count(tile_index, tiles_by_index, tiles_metadata, tile_width, buffer_size)
+
+
+def get_nb_classes(config: DictConfig) -> int:
+    """Number of classes expected in the points (the classes of the class map precedence list and ignored classes)"""
+    return max(len(set(config.class_map.precedence_classes) | set(config.class_map.ignored_classes)), 1)
+
+
+def estimate_rasters_memory(config: DictConfig, is_streaming: bool) -> float:
+    """Peak memory (in bytes) of the rasters computed for a tile with the enabled products: the stages are run one
+    after the other, except in stream mode where the class counts of all the pixel sizes are kept until the end (and
+    the count of a single class is added to them for each chunk of points, cf. streaming.accumulate_class_counts)"""
+    tile_width = config.io.tile_geometry.tile_width
+    nb_classes = get_nb_classes(config)
+    density_sizes = count_cube.get_density_pixel_sizes(config)
+    class_sizes = count_cube.get_class_pixel_sizes(config)
+    stages = [
+        len(config.density.keep_classes) * DENSITY_PIXEL_SIZE * get_nb_pixels(tile_width, p) for p in density_sizes
+    ]
+    stages += [
+        (nb_classes * CLASS_PIXEL_SIZE + SINGLE_CLASS_COUNT_PIXEL_SIZE) * get_nb_pixels(tile_width, p)
+        for p in class_sizes
+    ]
+    if buffer.needs_dxm(config):
+        stages += [DXM_PIXEL_SIZE * get_nb_pixels(tile_width, p) for p in class_sizes]
+    pixel_sizes = set(density_sizes + class_sizes)
+    counts = sum(nb_classes * COUNT_PIXEL_SIZE * get_nb_pixels(tile_width, p) for p in pixel_sizes)
+    counts += max((SINGLE_CLASS_COUNT_PIXEL_SIZE * get_nb_pixels(tile_width, p) for p in pixel_sizes), default=0)
+    if is_streaming:
+        return counts + max(stages, default=0)
+    if config.count_cube.output_subdir:
+        stages.append(counts)
+
+    return max(stages, default=0)
+
+
+def estimate_tile_memory(
+    point_count: float, point_size: float, config: DictConfig, is_streaming: bool = False, chunk_size: int = None
+) -> Dict[str, float]:
+    """Peak memory needed to compute the products of a tile, by component (in MB):
+    - points: las records of the buffered tile and arrays used by the aggregators (in stream mode: one chunk of
+    points, cf. io.stream_chunk_size)
+    - rasters: rasters of the enabled products, at each pixel size (cf. estimate_rasters_memory)
+    - dxm: points read by pdal to compute the DSM used to shade the pretty class map
+
+    Args:
+        point_count (float): number of points of the tile with its buffer (cf. get_tile_point_count)
+        point_size (float): size of the las records (in bytes)
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+        is_streaming (bool, optional): estimate for the stream mode (io.points_backend=stream). Defaults to False.
+        chunk_size (int, optional): number of points per chunk in stream mode. Defaults to None
+        (io.stream_chunk_size).
+
+    Returns:
+        Dict[str, float]: memory of each component, and their sum ("total"), in MB
+    """
+    if is_streaming:
+        chunk_size = chunk_size or config.io.get("stream_chunk_size", utils_pdal.STREAM_CHUNK_SIZE)
+        nb_points = min(point_count, chunk_size)
+    else:
+        nb_points = point_count
+    memory = {
+        "points": nb_points * (point_size + POINT_WORK_SIZE) / 1024**2,
+        "rasters": estimate_rasters_memory(config, is_streaming) / 1024**2,
+        "dxm": point_count * point_size * DXM_POINT_FACTOR / 1024**2 if buffer.needs_dxm(config) else 0,
+    }
+    # the points of the tile are still in memory when the DXM is computed
+    memory["total"] = memory["points"] + memory["rasters"] + memory["dxm"]
+
+    return memory
+
+
+def get_tile_plan(point_count: float, point_size: float, config: DictConfig) -> Tuple[str, int, Dict[str, float]]:
+    """Choose how to read the points of a tile so that its products fit in config.io.memory_budget (in MB):
+    - with io.points_backend=auto: the tile is loaded in memory if it fits, otherwise its points are streamed
+    - in stream mode, the number of points per chunk (io.stream_chunk_size) is reduced until the tile fits (but
+    not below MIN_STREAM_CHUNK_SIZE)
+
+    Args:
+        point_count (float): number of points of the tile with its buffer (cf. get_tile_point_count)
+        point_size (float): size of the las records (in bytes)
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+
+    Returns:
+        Tuple[str, int, Dict[str, float]]: points backend ("memory" or "stream"), number of points per chunk in
+        stream mode, and estimated memory (cf. estimate_tile_memory)
+    """
+    memory_budget = config.io.get("memory_budget", None)
+    backend = config.io.get("points_backend", "memory")
+    chunk_size = config.io.get("stream_chunk_size", utils_pdal.STREAM_CHUNK_SIZE)
+    if backend == "auto":
+        memory = estimate_tile_memory(point_count, point_size, config)
+        fits_in_memory = not memory_budget or memory["total"] <= memory_budget
+        backend = "memory" if fits_in_memory else "stream"
+
+    if memory_budget and backend == "stream":
+        # memory that does not depend on the chunk size, and memory per point of a chunk
+        fixed_memory = estimate_tile_memory(point_count, point_size, config, True, 1)["total"]
+        point_memory = (point_size + POINT_WORK_SIZE) / 1024**2
+        fitted_chunk_size = int((memory_budget - fixed_memory) / point_memory)
+        chunk_size = max(min(chunk_size, fitted_chunk_size), MIN_STREAM_CHUNK_SIZE)
+
+    return backend, chunk_size, estimate_tile_memory(point_count, point_size, config, backend == "stream", chunk_size)
+
+
+def fit_tile_to_memory_budget(point_count: float, point_size: float, config: DictConfig) -> Tuple[str, int]:
+    """Choose how to read the points of a tile so that its products fit in config.io.memory_budget (cf.
+    get_tile_plan), and log the estimated memory (with a warning if the tile does not fit in the budget anyway)
+
+    Returns:
+        Tuple[str, int]: points backend ("memory" or "stream"), and number of points per chunk in stream mode
+    """
+    backend, chunk_size, memory = get_tile_plan(point_count, point_size, config)
+    log.info(
+        f"Estimated memory: {memory['total']:.0f} MB ({point_count:.0f} points, backend: {backend}"
+        + (f", {chunk_size} points per chunk)" if backend == "stream" else ")")
+    )
+    memory_budget = config.io.get("memory_budget", None)
+    if memory_budget and memory["total"] > memory_budget:
+        log.warning(f"The tile needs about {memory['total']:.0f} MB (memory budget: {memory_budget} MB)")
+
+    return backend, chunk_size
+
+
+def get_cost_model(config: DictConfig) -> Dict[str, float]:
+    """Coefficients of the cost model (cf. estimate_tile_cpu_time), from config.estimate.cost_model (the missing
+    coefficients come from DEFAULT_COST_MODEL)"""
+    config_estimate = config.get("estimate", None) or {}
+    return {**DEFAULT_COST_MODEL, **(config_estimate.get("cost_model", None) or {})}
+
+
+def get_output_rasters(config: DictConfig) -> List[Tuple[float, float]]:
+    """Final rasters of a tile with the enabled products, as (pixel size, bytes per pixel)"""
+    density_itemsize = np.dtype(config.density.get("output_dtype", "float32")).itemsize
+    density_bytes = len(config.density.keep_classes) * density_itemsize
+    rasters = []
+    for pixel_size in count_cube.get_density_pixel_sizes(config):
+        # the colorized density map is a RGB raster
+        rasters.append((pixel_size, 3 if config.density.colorize else density_bytes))
+        if config.density.colorize and config.density.intermediate_dirs.density_values:
+            rasters.append((pixel_size, density_bytes))
+    for pixel_size in count_cube.get_class_pixel_sizes(config):
+        if config.class_map.output_class_subdir:
+            rasters.append((pixel_size, 1))
+        if config.class_map.output_class_pretty_subdir:
+            rasters.append((pixel_size, 3))
+
+    return rasters
+
+
+def estimate_output_size(config: DictConfig) -> float:
+    """Size of the outputs of a tile (in bytes) with the enabled products, the final rasters being compressed with
+    config.estimate.compression_ratio"""
+    tile_width = config.io.tile_geometry.tile_width
+    config_estimate = config.get("estimate", None) or {}
+    compression_ratio = config_estimate.get("compression_ratio", 1)
+    size = sum(
+        get_nb_pixels(tile_width, pixel_size) * nb_bytes * compression_ratio
+        for pixel_size, nb_bytes in get_output_rasters(config)
+    )
+    if config.count_cube.output_subdir:
+        pixel_sizes = set(count_cube.get_density_pixel_sizes(config) + count_cube.get_class_pixel_sizes(config))
+        size += sum(
+            get_nb_pixels(tile_width, pixel_size) * get_nb_classes(config) * 4 * COUNT_CUBE_COMPRESSION_RATIO
+            for pixel_size in pixel_sizes
+        )
+
+    return size
+
+
+def estimate_tile_cpu_time(read_point_count: float, point_count: float, config: DictConfig) -> Dict[str, float]:
+    """CPU time needed to compute the products of a tile (in seconds), by stage, from the coefficients of
+    config.estimate.cost_model (time per point or per pixel of each stage):
+    - read: decoding of the tile and of its neighbors
+    - density, class_map, count_cube: binning of the points and rendering of the rasters, at each pixel size
+    - dxm: DSM used to shade the pretty class map
+    - write: compression and write of the outputs
+
+    Args:
+        read_point_count (float): number of points of the files that are read (the tile and its neighbors)
+        point_count (float): number of points of the tile with its buffer (cf. get_tile_point_count)
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+
+    Returns:
+        Dict[str, float]: CPU time of each stage (in seconds)
+    """
+    cost = get_cost_model(config)
+    tile_width = config.io.tile_geometry.tile_width
+    density_sizes = count_cube.get_density_pixel_sizes(config)
+    class_sizes = count_cube.get_class_pixel_sizes(config)
+    cube_sizes = set(density_sizes + class_sizes) if config.count_cube.output_subdir else []
+
+    def get_stage_time(pixel_sizes: List[float], per_point: float) -> float:
+        return sum(point_count * per_point + get_nb_pixels(tile_width, p) * cost["per_pixel"] for p in pixel_sizes)
+
+    return {
+        "read": read_point_count * cost["read_per_point"],
+        "density": get_stage_time(density_sizes, cost["density_per_point"]),
+        "class_map": get_stage_time(class_sizes, cost["class_map_per_point"]),
+        "count_cube": get_stage_time(cube_sizes, cost["count_cube_per_point"]),
+        "dxm": get_stage_time(class_sizes, cost["dxm_per_point"]) if buffer.needs_dxm(config) else 0,
+        "write": estimate_output_size(config) * cost["write_per_byte"],
+    }
@@ -0,0 +1,333 @@
+import logging as log
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import hydra
+import numpy as np
+from omegaconf import DictConfig
+from osgeo import gdal
+from pdaltools.las_info import get_tile_origin_using_header_info
+
+from ctview import (
+    aggregators,
+    block,
+    buffer,
+    estimate,
+    shared_points,
+    utils_pdal,
+    utils_raster,
+)
+from ctview.main_ctview import create_products_from_points
+from ctview.strip_cache import StripCache
+
+
+def main_block(config: DictConfig):
+    """Generate the products of all the tiles of config.io.input_dir by blocks of adjacent tiles: the tiles of a
+    block and the adjacent tiles (buffer ring) are decoded once, then the products of each tile of the block are
+    computed from these points, with the same names and grids as main_ctview"""
+    log.basicConfig(level=log.INFO, format="%(message)s")
+
+    in_dir = config.io.input_dir
+    out_dir = config.io.output_dir
+    if in_dir is None or out_dir is None:
+        raise RuntimeError(
+            """In input you have to give an input directory and an output directory.
+            For more info run the same command by adding --help"""
+        )
+    block.check_config_block(config.block)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tile_width = config.io.tile_geometry.tile_width
+    buffer_size = buffer.get_buffer_size(config)
+    tiles_by_index = block.get_tiles_by_index(
+        utils_pdal.list_tiles(in_dir), tile_width, config.io.tile_geometry.tile_coord_scale
+    )
+    # header-only metadata of the tiles, to size the blocks and skip the neighbors that are out of the buffers
+    tiles_metadata = utils_pdal.get_tile_index(in_dir, config.block.get("decode_workers", 1))
+    # the memory budget is shared by the block being processed and the blocks that are read in advance
+    memory_budget = config.block.get("memory_budget", None)
+    block_size = block.get_block_size(
+        [tiles_metadata[f] for f in tiles_by_index.values()],
+        config.block.size,
+        memory_budget / (1 + config.block.get("prefetch", 0)) if memory_budget else None,
+        tile_width,
+        buffer_size,
+    )
+    blocks = block.order_blocks(
+        block.group_tiles_by_block(list(tiles_by_index), block_size), block_size, config.block.get("order", "hilbert")
+    )
+    log.info(f"{len(tiles_by_index)} tiles in {len(blocks)} blocks of up to {block_size}x{block_size} tiles")
+
+    # each worker processes a contiguous run of blocks along the curve, so that its cache serves the neighbor tiles
+    workers = config.block.get("workers", 1)
+    runs = [blocks[start:stop] for start, stop in aggregators.split_range(len(blocks), workers)]
+    if len(runs) > 1:
+        with get_process_pool(len(runs)) as executor:
+            results = list(
+                executor.map(
+                    process_blocks,
+                    runs,
+                    repeat(tiles_by_index),
+                    repeat(tiles_metadata),
+                    repeat(buffer_size),
+                    repeat(config),
+                )
+            )
+    else:
+        results = [process_blocks(runs[0], tiles_by_index, tiles_metadata, buffer_size, config)]
+
+    log_read_report(
+        sum(nb_files for nb_files, _ in results),
+        sum(nb_bytes for _, nb_bytes in results),
+        tiles_by_index,
+        in_dir,
+    )
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Pool of processes started with the "spawn" method: forked processes can deadlock when the main process has
+    already started threads (eg. the thread pool of the lazrs backend of laspy after a laz file has been decoded)"""
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker_process,
+        initargs=(bool(gdal.GetUseExceptions()),),
+    )
+
+
+def init_worker_process(use_gdal_exceptions: bool):
+    """Configure a worker process as the main process (spawned processes do not inherit its state)"""
+    log.basicConfig(level=log.INFO, format="%(message)s")
+    if use_gdal_exceptions:
+        gdal.UseExceptions()
+
+
+def process_blocks(
+    blocks: List[List[Tuple[int, int]]],
+    tiles_by_index: Dict[Tuple[int, int], str],
+    tiles_metadata: Dict[str, Dict],
+    buffer_size: float,
+    config: DictConfig,
+) -> Tuple[int, int]:
+    """Generate the products of the tiles of a run of blocks, in this order, with a strip cache (if
+    config.block.strip_cache_budget is set) shared by these blocks. The next config.block.prefetch blocks are read
+    while the tiles of a block are processed (cf. block.iter_block_points). With config.block.tile_workers > 1, the
+    tiles of a block are processed in parallel by a pool of processes (cf. create_block_products_in_processes)
+
+    Returns:
+        Tuple[int, int]: number and size of the files that have been decoded
+    """
+    log.basicConfig(level=log.INFO, format="%(message)s")
+    tile_width = config.io.tile_geometry.tile_width
+    strip_cache_budget = config.block.get("strip_cache_budget", None)
+    tile_workers = config.block.get("tile_workers", 1)
+    strip_cache = (
+        StripCache(strip_cache_budget, config.block.get("strip_cache_dir", None)) if strip_cache_budget else None
+    )
+
+    read_block = partial(
+        block.read_block_points,
+        tiles_by_index=tiles_by_index,
+        input_dir=config.io.input_dir,
+        tile_width=tile_width,
+        buffer_size=buffer_size,
+        strip_cache=strip_cache,
+        decode_workers=config.block.get("decode_workers", 1),
+        copc_resolution=config.io.get("copc_resolution", None),
+        tiles_metadata=tiles_metadata,
+        # the points of the blocks are read directly in shared arrays for the tile processes
+        shared=tile_workers > 1,
+        shared_memory_dir=config.block.get("shared_memory_dir", None),
+    )
+
+    # the next blocks are read in a background thread while the tiles of the current block are processed
+    nb_decoded_files, nb_decoded_bytes = 0, 0
+    with get_process_pool(tile_workers) if tile_workers > 1 else nullcontext() as tile_executor:
+        blocks_points = block.iter_block_points(blocks, read_block, config.block.get("prefetch", 0))
+        for ii, (tiles, block_points) in enumerate(blocks_points):
+            log.info(f"\nBlock {ii + 1}/{len(blocks)}: {len(tiles)} tiles")
+            nb_decoded_files += block_points.nb_decoded_files
+            nb_decoded_bytes += block_points.nb_decoded_bytes
+            if tile_executor is not None:
+                create_block_products_in_processes(
+                    block_points, tiles, tiles_by_index, tiles_metadata, buffer_size, config, tile_executor
+                )
+            else:
+                for tile_index in tiles:
+                    create_tile_products_from_block(
+                        block_points, tile_index, tiles_by_index[tile_index], buffer_size, config
+                    )
+
+    if strip_cache:
+        strip_cache.log_stats()
+
+    return nb_decoded_files, nb_decoded_bytes
+
+
+def log_read_report(
+    nb_decoded_files: int, nb_decoded_bytes: int, tiles_by_index: Dict[Tuple[int, int], str], input_dir: str
+):
+    """Log how many times the tiles have been decoded, compared to the per-tile mode (where each tile is decoded
+    with each of its existing neighbors), in particular the size of the neighbor files read per tile"""
+    file_sizes = {tile_index: os.path.getsize(os.path.join(input_dir, f)) for tile_index, f in tiles_by_index.items()}
+    nb_tiles = max(len(file_sizes), 1)
+    tiles_bytes = sum(file_sizes.values())
+    neighbors = {tile_index: block.get_neighbor_indices([tile_index]) for tile_index in file_sizes}
+    per_tile_files = sum(1 + sum(n in file_sizes for n in neighbors[t]) for t in file_sizes)
+    per_tile_neighbor_bytes = sum(file_sizes.get(n, 0) for t in file_sizes for n in neighbors[t])
+
+    log.info(
+        f"Decoded {nb_decoded_files} files ({nb_decoded_bytes / 1024**2:.1f} MB): "
+        f"{(nb_decoded_bytes - tiles_bytes) / nb_tiles / 1024**2:.2f} MB of neighbor files read per tile. "
+        f"Per-tile mode: {per_tile_files} files, "
+        f"{per_tile_neighbor_bytes / nb_tiles / 1024**2:.2f} MB of neighbor files read per tile"
+    )
+
+
+def create_tile_products_from_block(
+    block_points: block.BlockPoints, tile_index: tuple, tile_filename: str, buffer_size: float, config: DictConfig
+):
+    """Generate the products of one tile of a block (cf. main_ctview.create_products_from_points) from the points
+    of the block
+
+    Args:
+        block_points (block.BlockPoints): points of the block (cf. block.read_block_points)
+        tile_index (tuple): position of the tile in the tile grid (cf. block.get_tiles_by_index)
+        tile_filename (str): filename of the tile
+        buffer_size (float): buffer size (cf. buffer.get_buffer_size)
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+    """
+    with tempfile.TemporaryDirectory(prefix="tmp_buffer", dir="tmp") as tmpdir_buffer:
+        las_with_buffer = write_tile_las_with_buffer(
+            block_points, tile_index, tile_filename, buffer_size, tmpdir_buffer, config
+        )
+        create_tile_products(block_points.points, block_points.classifs, las_with_buffer, tile_filename, config)
+
+
+def create_block_products_in_processes(
+    block_points: block.BlockPoints,
+    tiles: List[Tuple[int, int]],
+    tiles_by_index: Dict[Tuple[int, int], str],
+    tiles_metadata: Dict[str, Dict],
+    buffer_size: float,
+    config: DictConfig,
+    executor: ProcessPoolExecutor,
+):
+    """Generate the products of the tiles of a block in parallel with a pool of processes: the points of the block
+    have been read in shared arrays (cf. block.read_block_points with shared=True) that the processes read without
+    copy, and the buffered las files of the tiles are written beforehand from the las records of the block.
+    If config.io.memory_budget is set, a tile is started only when the estimated memory of the running tiles and of
+    this tile (cf. estimate.estimate_tile_memory) fits in this budget (a tile is always started when no other tile
+    is running).
+
+    Args:
+        block_points (block.BlockPoints): points of the block, in shared arrays (block_points.shared, closed when
+        the tiles are done)
+        tiles (List[Tuple[int, int]]): positions of the tiles of the block in the tile grid
+        tiles_by_index (Dict[Tuple[int, int], str]): tiles filenames by position (cf. block.get_tiles_by_index)
+        tiles_metadata (Dict[str, Dict]): metadata of the las files by filename (cf. utils_pdal.get_tile_index)
+        buffer_size (float): buffer size (cf. buffer.get_buffer_size)
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+        executor (ProcessPoolExecutor): pool of processes
+    """
+    with (
+        tempfile.TemporaryDirectory(prefix="tmp_buffer", dir="tmp") as tmpdir_buffer,
+        block_points.shared as shared,
+    ):
+        memory_budget = config.io.get("memory_budget", None)
+        tiles_memory = {}
+        for tile_index in tiles:
+            tile_filename = tiles_by_index[tile_index]
+            las_with_buffer = write_tile_las_with_buffer(
+                block_points, tile_index, tile_filename, buffer_size, tmpdir_buffer, config
+            )
+            point_count, point_size = estimate.get_tile_point_count(
+                tile_index, tiles_by_index, tiles_metadata, config.io.tile_geometry.tile_width, buffer_size
+            )
+            tile_memory = estimate.estimate_tile_memory(point_count, point_size, config)["total"]
+            while memory_budget and tiles_memory and sum(tiles_memory.values()) + tile_memory > memory_budget:
+                done, _ = wait(tiles_memory, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tiles_memory.pop(future)
+                    future.result()
+            future = executor.submit(
+                create_tile_products_from_shared_points, shared.name, las_with_buffer, tile_filename, config
+            )
+            tiles_memory[future] = tile_memory
+        # the shared points and the buffered las files are removed once all the tiles are done
+        for future in tiles_memory:
+            future.result()
+
+
+def create_tile_products_from_shared_points(
+    shared_name: str, las_with_buffer: Path, tile_filename: str, config: DictConfig
+):
+    """Generate the products of one tile in a worker process, from the points of its block shared by the main
+    process (cf. create_block_products_in_processes)"""
+    log.basicConfig(level=log.INFO, format="%(message)s")
+    arrays = shared_points.attach(shared_name)
+    create_tile_products(arrays["points"], arrays["classifs"], las_with_buffer, tile_filename, config)
+
+
+def write_tile_las_with_buffer(
+    block_points: block.BlockPoints,
+    tile_index: tuple,
+    tile_filename: str,
+    buffer_size: float,
+    tmpdir_buffer: str,
+    config: DictConfig,
+) -> Path:
+    """Write the las file of a tile with its buffer from the points of its block, if it is needed (by the DXM stage
+    or to be saved in config.buffer.output_subdir)
+
+    Returns:
+        Path: path to the buffered las file (in config.buffer.output_subdir, or in tmpdir_buffer)
+    """
+    if config.buffer.output_subdir:
+        las_with_buffer = Path(config.io.output_dir) / config.buffer.output_subdir / tile_filename
+    else:
+        las_with_buffer = Path(tmpdir_buffer) / tile_filename
+    # the buffered las file is needed only by the DXM stage
+    if buffer.needs_dxm(config) or config.buffer.output_subdir:
+        block.write_tile_with_buffer(
+            block_points,
+            tile_filename,
+            block.get_tile_bounds(tile_index, config.io.tile_geometry.tile_width, buffer_size),
+            str(las_with_buffer),
+        )
+
+    return las_with_buffer
+
+
+def create_tile_products(
+    points: np.array, classifs: np.array, las_with_buffer: Path, tile_filename: str, config: DictConfig
+):
+    """Generate the products of one tile (cf. main_ctview.create_products_from_points) from the points of its
+    block (only the points in the rasters extent of the tile are used)"""
+    tilename = os.path.splitext(tile_filename)[0]
+    tile_width = config.io.tile_geometry.tile_width
+    log.info(f"\nTile {tilename}")
+    tile_origin = get_tile_origin_using_header_info(
+        os.path.join(config.io.input_dir, tile_filename), tile_width=tile_width
+    )
+    is_kept = utils_raster.is_in_raster_extent(
+        points, tile_origin, tile_width, max(buffer.get_binning_pixel_sizes(config), default=0)
+    )
+    create_products_from_points(points[is_kept], classifs[is_kept], las_with_buffer, tile_origin, tilename, config)
+
+
+@hydra.main(config_path="../configs/", config_name="config_control.yaml", version_base="1.2")
+def main(config: DictConfig):
+    main_block(config)
+
+
+if __name__ == "__main__":
+    gdal.UseExceptions()
+    main()
@@ -2,9 +2,9 @@ import logging as log
 import os
 import tempfile
 from pathlib import Path
+from typing import Tuple
 
 import hydra
-import laspy
 import numpy as np
 from omegaconf import DictConfig
 from osgeo import gdal
@@ -13,7 +13,19 @@ from pdaltools.las_info import get_tile_origin_using_header_info
 
 import ctview.map_class.raster_generation as map_class
 import ctview.map_density as map_density
-from ctview import utils_raster
+from ctview import (
+    block,
+    buffer,
+    count_cube,
+    estimate,
+    multi_resolution,
+    raster_writer,
+    spatial_index,
+    streaming,
+    utils_las,
+    utils_pdal,
+    utils_raster,
+)
 
 
 def main_ctview(config: DictConfig):
@@ -37,50 +49,151 @@ def main_ctview(config: DictConfig):
     tilename = os.path.splitext(initial_las_filename)[0]
     initial_las_file = os.path.join(in_dir, initial_las_filename)
 
-    with (
-        tempfile.TemporaryDirectory(prefix="tmp_buffer", dir="tmp") as tmpdir_buffer,
-        tempfile.TemporaryDirectory(prefix="tmp_class_raw", dir="tmp") as tmpdir_class,
-    ):
+    with tempfile.TemporaryDirectory(prefix="tmp_buffer", dir="tmp") as tmpdir_buffer:
         # Get pointcloud origin from the las file metadata
         tile_origin = get_tile_origin_using_header_info(
             initial_las_file, tile_width=config.io.tile_geometry.tile_width
         )
 
-        # Buffer
-        log.info(f"\nStep 1: Create buffered las file with buffer = {config.buffer.size}")
+        # Buffer: the neighbor points are needed only by the DXM stage, the other stages bin the points of the
+        # tile (with a half pixel margin)
+        buffer_size = buffer.get_buffer_size(config)
+        log.info(f"\nStep 1: Create buffered las file with buffer = {buffer_size}")
         if config.buffer.output_subdir:
             las_with_buffer = Path(out_dir) / config.buffer.output_subdir / initial_las_filename
         else:
             las_with_buffer = Path(tmpdir_buffer) / initial_las_filename
         las_with_buffer.parent.mkdir(parents=True, exist_ok=True)
 
-        epsg = config.io.spatial_reference
-        create_las_with_buffer(
-            input_dir=str(in_dir),
-            tile_filename=initial_las_file,
-            output_filename=str(las_with_buffer),
-            buffer_width=config.buffer.size,
-            spatial_ref=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
-            tile_width=config.io.tile_geometry.tile_width,
-            tile_coord_scale=config.io.tile_geometry.tile_coord_scale,
-        )
+        points_backend = streaming.get_points_backend(config.io)
+        stream_chunk_size = None
+        if config.io.get("memory_budget", None) or points_backend == "auto":
+            # fit the tile in the memory budget, from the point counts in the headers of the tile and its neighbors
+            point_count, point_size = estimate.read_tile_point_count(initial_las_filename, buffer_size, config.io)
+            points_backend, stream_chunk_size = estimate.fit_tile_to_memory_budget(point_count, point_size, config)
+        is_streaming = points_backend == "stream"
+        if is_streaming and not (buffer.needs_dxm(config) or config.buffer.output_subdir):
+            log.info("Skip buffered las file: the points are streamed from the input files")
+        elif spatial_index.is_copc(initial_las_file):
+            # COPC tile: the tile and the buffer strips of its neighbors are read with octree queries
+            create_las_with_buffer_from_copc(initial_las_filename, buffer_size, str(las_with_buffer), config)
+        else:
+            epsg = config.io.spatial_reference
+            create_las_with_buffer(
+                input_dir=str(in_dir),
+                tile_filename=initial_las_file,
+                output_filename=str(las_with_buffer),
+                buffer_width=buffer_size,
+                spatial_ref=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
+                tile_width=config.io.tile_geometry.tile_width,
+                tile_coord_scale=config.io.tile_geometry.tile_coord_scale,
+            )
+
+        if is_streaming:
+            log.info("\nSteps 2 to 4: Generate the products from the streamed points")
+            with raster_writer.background_writer(config.io):
+                streaming.create_products_streaming(
+                    initial_las_filename, las_with_buffer, tile_origin, tilename, config, stream_chunk_size
+                )
+            return
 
-        # Read las
-        las = laspy.read(las_with_buffer)
+        # Read las (memory-mapped if it is not compressed), and keep only the points that can be binned in the
+        # rasters
+        las = utils_las.read_las(las_with_buffer)
         points_np = np.vstack((las.x, las.y, las.z)).transpose()
-        classifs = np.copy(las.classification)
+        is_kept = utils_raster.is_in_raster_extent(
+            points_np,
+            tile_origin,
+            config.io.tile_geometry.tile_width,
+            max(buffer.get_binning_pixel_sizes(config), default=0),
+        )
+        points_np = points_np[is_kept]
+        classifs = np.asarray(las.classification)[is_kept]
+
+        create_products_from_points(points_np, classifs, las_with_buffer, tile_origin, tilename, config)
+
+
+def create_las_with_buffer_from_copc(tile_filename: str, buffer_size: float, output_filename: str, config: DictConfig):
+    """Write the las file of a COPC tile with its buffer (as pdaltools.las_add_buffer.create_las_with_buffer), the
+    points of the tile and of its neighbors being read only in the buffered tile bounds (cf. block.read_tile_points)
+
+    Args:
+        tile_filename (str): filename of the tile (in config.io.input_dir)
+        buffer_size (float): buffer size (in meters)
+        output_filename (str): path to the output las file
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+    """
+    tile_width = config.io.tile_geometry.tile_width
+    tile_coord_scale = config.io.tile_geometry.tile_coord_scale
+    tiles_by_index = block.get_tiles_by_index(utils_pdal.list_tiles(config.io.input_dir), tile_width, tile_coord_scale)
+    tile_index = block.get_tile_index_of(tile_filename, tiles_by_index, tile_width, tile_coord_scale)
+    block_points = block.read_block_points(
+        [tile_index],
+        tiles_by_index,
+        config.io.input_dir,
+        tile_width,
+        buffer_size,
+        copc_resolution=config.io.get("copc_resolution", None),
+    )
+    block.write_tile_with_buffer(
+        block_points, tile_filename, block.get_tile_bounds(tile_index, tile_width, buffer_size), output_filename
+    )
+
+
+def create_products_from_points(
+    points_np: np.array,
+    classifs: np.array,
+    las_with_buffer: str,
+    tile_origin: Tuple[int, int],
+    tilename: str,
+    config: DictConfig,
+):
+    """Generate the density maps, class maps and class count cubes of a tile (steps 2 to 4 of main_ctview)
 
-        if config.density.output_subdir:
+    Args:
+        points_np (np.array): numpy array with the points of the tile (at least the ones in the rasters extent,
+        cf. utils_raster.is_in_raster_extent)
+        classifs (np.array): numpy array with classifications of the points
+        las_with_buffer (str): path to the las file of the tile with its buffer (used to compute the DSM for the
+        pretty class map)
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tilename (str): tilename used to generate the output filenames
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+    """
+    out_dir = config.io.output_dir
+    # the final rasters are written in background, and all of them are written when the tile is done
+    with (
+        tempfile.TemporaryDirectory(prefix="tmp_class_raw", dir="tmp") as tmpdir_class,
+        raster_writer.background_writer(config.io),
+    ):
+        save_count_cubes = bool(config.count_cube.output_subdir)
+
+        multi_resolution_density = bool(config.multi_resolution.density_pixel_sizes)
+        multi_resolution_class = bool(config.multi_resolution.class_pixel_sizes)
+        if multi_resolution_density or multi_resolution_class:
+            log.info("\nStep 2 bis: Generate multi-resolution maps")
+            multi_resolution.create_multi_resolution_rasters_from_config(
+                input_points=points_np,
+                input_classifs=classifs,
+                input_las=str(las_with_buffer),
+                tile_origin=tile_origin,
+                tilename=tilename,
+                config=config,
+            )
+
+        if config.density.output_subdir and not multi_resolution_density:
             # Map density
             log.info("\nStep 2: Generate a density map")
-            map_density.create_density_raster_from_config(
-                str(las_with_buffer), tile_origin, tilename, config.density, config.io
+            map_density.create_density_raster_from_points(
+                points_np, classifs, tile_origin, tilename, config.density, config.io
             )
 
         else:
             log.info("\nStep 2: Skip density map")
 
-        if config.class_map.output_class_subdir or config.class_map.output_class_pretty_subdir:
+        if (
+            config.class_map.output_class_subdir or config.class_map.output_class_pretty_subdir
+        ) and not multi_resolution_class:
             # Map classes
             log.info("\nStep 3: Generate a classification map")
 
@@ -116,11 +229,26 @@ def main_ctview(config: DictConfig):
                     output_dir=output_class_pretty_subdir,
                     config_class=config.class_map,
                     config_io=config.io,
+                    output_dxm_hillshade=(
+                        count_cube.get_hillshade_path(config, config.class_map.pixel_size, tilename)
+                        if save_count_cubes
+                        else None
+                    ),
                 )
 
         else:
             log.info("\nStep 3: Skip classification map")
 
+        if save_count_cubes:
+            log.info("\nStep 4: Save class count cubes")
+            count_cube.create_count_cubes_from_config(
+                input_points=points_np,
+                input_classifs=classifs,
+                tile_origin=tile_origin,
+                tilename=tilename,
+                config=config,
+            )
+
 
 @hydra.main(config_path="../configs/", config_name="config_control.yaml", version_base="1.2")
 def main(config: DictConfig):
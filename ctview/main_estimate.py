@@ -0,0 +1,127 @@
+import json
+import logging as log
+import os
+from typing import Dict
+
+import hydra
+import numpy as np
+from omegaconf import DictConfig
+
+from ctview import block, buffer, estimate, utils_pdal
+
+
+def main_estimate(config: DictConfig) -> Dict:
+    """Estimate the cost of generating the products of all the tiles of config.io.input_dir with the current
+    configuration (as ctview.main_ctview tile by tile), from the las headers only (point counts, bounds and point
+    formats): no point is decoded.
+
+    The report gives the CPU time (cf. estimate.estimate_tile_cpu_time), the peak memory per tile (cf.
+    estimate.get_tile_plan), the size of the outputs (cf. estimate.estimate_output_size) and the
+    config.estimate.nb_outliers most expensive tiles. It is logged, and written to config.estimate.output_file
+    (json, with the estimate of each tile) if it is set.
+    The CPU time is only an order of magnitude when it is computed with the default cost model
+    (estimate.DEFAULT_COST_MODEL, not measured): this is flagged in the report ("default_cost_model").
+
+    Returns:
+        Dict: report
+    """
+    log.basicConfig(level=log.INFO, format="%(message)s")
+
+    in_dir = config.io.input_dir
+    if in_dir is None:
+        raise RuntimeError(
+            """In input you have to give an input directory.
+            For more info run the same command by adding --help"""
+        )
+    config_estimate = config.get("estimate", None) or {}
+
+    tile_width = config.io.tile_geometry.tile_width
+    buffer_size = buffer.get_buffer_size(config)
+    tiles_metadata = utils_pdal.get_tile_index(in_dir, config.block.get("decode_workers", 1))
+    tiles_by_index = block.get_tiles_by_index(
+        list(tiles_metadata), tile_width, config.io.tile_geometry.tile_coord_scale
+    )
+    output_size = estimate.estimate_output_size(config)
+
+    tiles = []
+    cpu_time_by_stage = {}
+    for tile_index, filename in sorted(tiles_by_index.items()):
+        point_count, point_size = estimate.get_tile_point_count(
+            tile_index, tiles_by_index, tiles_metadata, tile_width, buffer_size
+        )
+        # each tile is decoded with its neighbors (to build its buffer)
+        read_point_count = sum(
+            tiles_metadata[tiles_by_index[index]]["point_count"]
+            for index in [tile_index] + block.get_neighbor_indices([tile_index])
+            if index in tiles_by_index
+        )
+        backend, _, memory = estimate.get_tile_plan(point_count, point_size, config)
+        cpu_time = estimate.estimate_tile_cpu_time(read_point_count, point_count, config)
+        for stage, stage_time in cpu_time.items():
+            cpu_time_by_stage[stage] = cpu_time_by_stage.get(stage, 0) + stage_time
+        tiles.append(
+            {
+                "filename": filename,
+                "point_count": tiles_metadata[filename]["point_count"],
+                "points_backend": backend,
+                "memory_mb": memory["total"],
+                "cpu_seconds": sum(cpu_time.values()),
+            }
+        )
+
+    cost_model = estimate.get_cost_model(config)
+    memories = [tile["memory_mb"] for tile in tiles]
+    outliers = sorted(tiles, key=lambda tile: (tile["cpu_seconds"], tile["memory_mb"]), reverse=True)
+    report = {
+        "nb_tiles": len(tiles),
+        "point_count": sum(tile["point_count"] for tile in tiles),
+        "cpu_hours": sum(cpu_time_by_stage.values()) / 3600,
+        "cpu_hours_by_stage": {stage: stage_time / 3600 for stage, stage_time in cpu_time_by_stage.items()},
+        "cost_model": cost_model,
+        "default_cost_model": cost_model == estimate.DEFAULT_COST_MODEL,
+        "peak_memory_mb": max(memories, default=0),
+        "median_memory_mb": float(np.median(memories)) if memories else 0,
+        "output_size_gb": len(tiles) * output_size / 1024**3,
+        "outliers": outliers[: config_estimate.get("nb_outliers", 5)],
+    }
+    log_report(report)
+
+    output_file = config_estimate.get("output_file", None)
+    if output_file:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        with open(output_file, "w") as f:
+            json.dump({**report, "tiles": tiles}, f, indent=2)
+        log.info(f"Report written to {output_file}")
+
+    return report
+
+
+def log_report(report: Dict):
+    stages = ", ".join(f"{stage}: {hours:.2f}" for stage, hours in report["cpu_hours_by_stage"].items())
+    log.info(
+        f"{report['nb_tiles']} tiles, {report['point_count']} points\n"
+        f"CPU time: {report['cpu_hours']:.2f} hours ({stages})\n"
+        f"Memory per tile: {report['peak_memory_mb']:.0f} MB at most, {report['median_memory_mb']:.0f} MB median\n"
+        f"Output size: {report['output_size_gb']:.2f} GB"
+    )
+    if report["default_cost_model"]:
+        log.warning(
+            "The CPU time is computed with the default cost model, which is not calibrated: it is only an order of "
+            "magnitude. Set estimate.cost_model with the times measured on the production machines"
+        )
+    if report["outliers"]:
+        log.info("Most expensive tiles:")
+    for tile in report["outliers"]:
+        log.info(
+            f"  {tile['filename']}: {tile['point_count']} points, {tile['cpu_seconds']:.0f} s, "
+            f"{tile['memory_mb']:.0f} MB ({tile['points_backend']})"
+        )
+
+
+@hydra.main(config_path="../configs/", config_name="config_control.yaml", version_base="1.2")
+def main(config: DictConfig):
+    main_estimate(config)
+
+
+if __name__ == "__main__":
+    main()
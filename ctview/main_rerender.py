@@ -0,0 +1,33 @@
+import logging as log
+import os
+
+import hydra
+from omegaconf import DictConfig
+from osgeo import gdal
+
+from ctview.count_cube import rerender_from_count_cubes
+
+
+def main_rerender(config: DictConfig):
+    """Re-generate the density and class maps of the tile config.io.input_filename from the class count cubes
+    saved by a previous ctview run (with count_cube.output_subdir set), without reading the points again"""
+    log.basicConfig(level=log.INFO, format="%(message)s")
+
+    if config.io.input_filename is None or config.io.output_dir is None or config.count_cube.output_subdir is None:
+        raise RuntimeError(
+            """In input you have to give a las filename, an output directory and a count cube subdirectory.
+            For more info run the same command by adding --help"""
+        )
+
+    tilename = os.path.splitext(config.io.input_filename)[0]
+    rerender_from_count_cubes(tilename, config)
+
+
+@hydra.main(config_path="../configs/", config_name="config_control.yaml", version_base="1.2")
+def main(config: DictConfig):
+    main_rerender(config)
+
+
+if __name__ == "__main__":
+    gdal.UseExceptions()
+    main()
@@ -0,0 +1,44 @@
+import logging as log
+import os
+
+import hydra
+from omegaconf import DictConfig
+
+from ctview import spatial_index, utils_pdal
+
+
+def main_spatial_index(config: DictConfig):
+    """Write the sidecar spatial index (cf. spatial_index.build_index) of each las/laz file of config.io.input_dir
+    that has no up-to-date index. If config.spatial_index.sort is True, the files are first copied to
+    config.io.output_dir with their points sorted by cell, and the copies are indexed."""
+    log.basicConfig(level=log.INFO, format="%(message)s")
+
+    in_dir = config.io.input_dir
+    if in_dir is None or (config.spatial_index.sort and config.io.output_dir is None):
+        raise RuntimeError(
+            """In input you have to give an input directory (and an output directory to sort the files).
+            For more info run the same command by adding --help"""
+        )
+    cell_size = config.spatial_index.cell_size
+    if isinstance(cell_size, bool) or not isinstance(cell_size, (int, float)) or cell_size <= 0:
+        raise ValueError(f"spatial_index.cell_size should be a positive number, got {cell_size} instead")
+
+    for filename in utils_pdal.list_tiles(in_dir):
+        las_file = os.path.join(in_dir, filename)
+        if config.spatial_index.sort:
+            sorted_file = os.path.join(config.io.output_dir, filename)
+            # incremental: the sorted copy is written again only if the input file is more recent
+            if not os.path.isfile(sorted_file) or os.stat(sorted_file).st_mtime_ns < os.stat(las_file).st_mtime_ns:
+                log.info(f"Sort {filename}")
+                spatial_index.sort_las_points(las_file, sorted_file, cell_size)
+            las_file = sorted_file
+        spatial_index.build_index(las_file, cell_size, config.spatial_index.chunk_size)
+
+
+@hydra.main(config_path="../configs/", config_name="config_control.yaml", version_base="1.2")
+def main(config: DictConfig):
+    main_spatial_index(config)
+
+
+if __name__ == "__main__":
+    main()
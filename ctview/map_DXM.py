@@ -5,9 +5,10 @@ from typing import List
 
 import las_digital_models.ip_one_tile
 from omegaconf import DictConfig
+from osgeo import gdal
 from osgeo_utils import gdal_calc
 
-from ctview import add_color, add_hillshade
+from ctview import add_color, add_hillshade, utils_raster
 
 
 def create_raw_dxm(
@@ -76,6 +77,7 @@ def add_dxm_hillshade_to_raster(
     output_dxm_hillshade: str,
     hillshade_calc: str,
     config_io: DictConfig,
+    overview_resampling: str = "NEAREST",
 ):
     """Add hillshade to a raster by: computing a Digital Model using the filter defined with
     dxm_filter_dimension/dxm_filter_keep_values,
@@ -105,6 +107,8 @@ def add_dxm_hillshade_to_raster(
         cf. configs/config_control.yaml for an example ("io" subdivision)
         The config will be completed with pixel_size, dxm_filter_dimension and dxm_filter_keep_values
         to match las_digital_models configuration expectations
+        overview_resampling (str, optional): resampling method used to build the internal overviews of
+        output_raster when config_io.raster_driver is "COG". Defaults to "NEAREST".
     """
     os.makedirs(os.path.dirname(output_dxm_raw), exist_ok=True)
     os.makedirs(os.path.dirname(output_dxm_hillshade), exist_ok=True)
@@ -115,16 +119,61 @@ def add_dxm_hillshade_to_raster(
     )
     add_hillshade.add_hillshade_one_raster(input_raster=output_dxm_raw, output_raster=output_dxm_hillshade)
 
-    gdal_calc.Calc(
-        A=input_raster,
-        B=output_dxm_hillshade,
-        calc=hillshade_calc,
-        outfile=output_raster,
-        allBands="A",
-        overwrite=True,
+    mix_raster_with_hillshade(
+        input_raster, output_dxm_hillshade, output_raster, hillshade_calc, config_io, overview_resampling
     )
 
 
+def mix_raster_with_hillshade(
+    input_raster: str,
+    hillshade_raster: str,
+    output_raster: str,
+    hillshade_calc: str,
+    config_io: DictConfig,
+    overview_resampling: str = "NEAREST",
+):
+    """Mix a raster with a hillshade raster (with the same grid) using the hillshade_calc operation in gdal_calc
+
+    Args:
+        input_raster (str): Path to the raster to which we want to add a hillshade
+        hillshade_raster (str): Path to the hillshade raster
+        output_raster (str): Path to the raster output
+        hillshade_calc (str): Formula used by gdalcalc to mix the raster and its hillshade
+        (with A: input_raster, B: hillshade)
+        config_io (DictConfig): io configuration dictionary (the output driver is config_io.raster_driver)
+        overview_resampling (str, optional): resampling method used to build the internal overviews of
+        output_raster when config_io.raster_driver is "COG". Defaults to "NEAREST".
+    """
+    if config_io.raster_driver == "COG":
+        # gdal_calc can only write to drivers that support Create: compute the result in memory
+        # then write the COG output (and its overviews) in a single copy
+        calc_dataset = gdal_calc.Calc(
+            A=input_raster,
+            B=hillshade_raster,
+            calc=hillshade_calc,
+            outfile="",
+            format="MEM",
+            allBands="A",
+        )
+        creation_options = utils_raster.get_creation_options(config_io.raster_driver, overview_resampling)
+        gdal.Translate(
+            output_raster,
+            calc_dataset,
+            format=config_io.raster_driver,
+            creationOptions=[f"{key}={value}" for key, value in creation_options.items()],
+        )
+        calc_dataset = None  # close dataset
+    else:
+        gdal_calc.Calc(
+            A=input_raster,
+            B=hillshade_raster,
+            calc=hillshade_calc,
+            outfile=output_raster,
+            allBands="A",
+            overwrite=True,
+        )
+
+
 def create_colored_dxm_with_hillshade(
     input_las: str,
     tilename: str,
@@ -204,4 +253,6 @@ def create_colored_dxm_with_hillshade(
             output_dir=os.path.join(out_dir, config_dtm["output_subdir"]),
             list_c=config_dtm["color"]["cycles_DTM_colored"],
             output_dir_LUT=output_dir_LUT,
+            raster_driver=config_io.raster_driver,
+            creation_options=utils_raster.get_creation_options(config_io.raster_driver, "AVERAGE"),
         )
@@ -1,7 +1,11 @@
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 
+from ctview import aggregators
+
+CLASS_MAP_MODES = ["precedence", "majority"]
+
 
 def compute_binary_class(points: np.array, origin: Tuple[int, int], tile_width: int, pixel_size: float):
     bins_x = np.arange(origin[0], origin[0] + tile_width + pixel_size, pixel_size)
@@ -113,3 +117,87 @@ def check_and_list_original_classes_to_keep(
                     raise ValueError(f"La classe {r} n'est pas dans les préséances")
 
     return list(class_by_layer)
+
+
+def check_majority_weights(weights: Dict[int, float]):
+    if any(weight <= 0 for weight in weights.values()):
+        raise ValueError(f"Les poids des classes pour le mode majority doivent être strictement positifs : {weights}")
+
+
+def compute_majority_class(
+    points: np.array,
+    classifs: np.array,
+    origin: Tuple[float, float],
+    tile_width: int,
+    pixel_size: float,
+    priorities: List[int],
+    weights: Dict[int, float] = {},
+) -> np.array:
+    """Compute the majority class of each pixel in a single pass over the points: the (pixel, class) pairs are
+    counted by sorting combined keys, then each pixel gets the class with the highest (weighted) number of points.
+    Ties are resolved using the priorities order. Only the classes in `priorities` are counted.
+
+    Args:
+        points (np.array): numpy array with the input points (x, y, z)
+        classifs (np.array): numpy array with classifications of the input points
+        origin (Tuple[float, float]): origin of the raster (top left corner of the upper left pixel)
+        tile_width (int): tile width (in meters)
+        pixel_size (float): pixel size of the grid
+        priorities (List[int]): classes priorities
+        weights (Dict[int, float], optional): weight of the points of each class (1 for the classes that are not
+        in this dict). Defaults to {}.
+
+    Returns:
+        np.array: majority class of each pixel (0 for the pixels without points of the classes in priorities)
+    """
+    check_majority_weights(weights)
+    bins_x, bins_y = aggregators.get_grid_edges(origin, tile_width, pixel_size)
+    nb_rows, nb_cols = len(bins_y) - 1, len(bins_x) - 1
+    majority_class = np.zeros(nb_rows * nb_cols, dtype=np.int64)
+    if not len(priorities) or not len(points):
+        return majority_class.reshape(nb_rows, nb_cols)
+
+    # rank of the class of each point in priorities (-1 for the classes to ignore)
+    lookup = np.full(max(np.max(classifs), max(priorities)) + 1, -1)
+    lookup[priorities] = np.arange(len(priorities))
+    rank = lookup[classifs]
+    pixel_index = aggregators.compute_pixel_index(points, bins_x, bins_y)
+    is_kept = (pixel_index >= 0) & (rank >= 0)
+
+    keys, counts = np.unique(pixel_index[is_kept] * len(priorities) + rank[is_kept], return_counts=True)
+    key_pixel, key_rank = keys // len(priorities), keys % len(priorities)
+    weight_by_rank = np.array([weights.get(c, 1) for c in priorities], dtype=np.float64)
+    scores = counts * weight_by_rank[key_rank]
+
+    # for each pixel: highest score first, then highest priority (lowest rank)
+    order = np.lexsort((key_rank, -scores, key_pixel))
+    best = order[np.flatnonzero(np.diff(key_pixel[order], prepend=-1))]
+    majority_class[key_pixel[best]] = np.array(priorities)[key_rank[best]]
+
+    return majority_class.reshape(nb_rows, nb_cols)
+
+
+def compute_majority_class_from_counts(
+    counts: np.array, classes: List[int], priorities: List[int], weights: Dict[int, float] = {}
+) -> np.array:
+    """Same as compute_majority_class, from the number of points of each class in each pixel
+
+    Args:
+        counts (np.array): points count with shape (len(classes), nb_rows, nb_cols)
+        classes (List[int]): class of each layer of counts
+        priorities (List[int]): classes priorities
+        weights (Dict[int, float], optional): weight of the points of each class. Defaults to {}.
+
+    Returns:
+        np.array: majority class of each pixel (0 for the pixels without points of the classes in priorities)
+    """
+    check_majority_weights(weights)
+    candidates = [c for c in priorities if c in classes]
+    if not candidates:
+        return np.zeros(counts.shape[1:], dtype=np.int64)
+
+    # layers in priority order: argmax returns the first maximum, ie. the class with the highest priority
+    scores = np.array([counts[classes.index(c)] * weights.get(c, 1) for c in candidates])
+    majority_class = np.array(candidates)[np.argmax(scores, axis=0)]
+
+    return np.where(np.any(scores > 0, axis=0), majority_class, 0)
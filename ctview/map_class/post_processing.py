@@ -1,16 +1,49 @@
-from typing import Dict
+import logging as log
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
 
 import numpy as np
 from osgeo import gdal, gdal_array
 
 
-def fill_nodata_in_array(input_array: np.array, max_distance: float = 2.0, smoothing_iterations: int = 0):
-    rows, cols = input_array.shape
-    driver = gdal.GetDriverByName("MEM")
-    dataset = driver.Create("", cols, rows, 1, gdal.GDT_Byte)
+def as_byte_array(input_array: np.array) -> np.array:
+    """Return input_array if it is already a C-contiguous uint8 array, otherwise a copy of it with this layout
+    (values are clipped to [0, 255] as GDAL does when writing to a Byte band)"""
+    if input_array.dtype == np.uint8 and input_array.flags.c_contiguous:
+        return input_array
+
+    return np.ascontiguousarray(np.clip(input_array, 0, 255), dtype=np.uint8)
+
+
+def get_output_byte_array(input_array: np.array, in_place: bool) -> np.array:
+    """Byte array to process: input_array itself if in_place is True and it has the right layout, otherwise a copy"""
+    output_array = as_byte_array(input_array)
+    if output_array is input_array and not in_place:
+        output_array = input_array.copy()
+
+    return output_array
+
+
+def fill_nodata_in_array(
+    input_array: np.array, max_distance: float = 2.0, smoothing_iterations: int = 0, in_place: bool = False
+):
+    """Fill the nodata pixels (value 0) of a class array with gdal.FillNodata (nearest neighbour interpolation).
+    The GDAL dataset wraps the numpy buffer directly (gdal_array.OpenArray), without copy.
+
+    Args:
+        input_array (np.array): raster array to fill
+        max_distance (float, optional): gdal.FillNodata maxSearchDist parameter. Defaults to 2.0.
+        smoothing_iterations (int, optional): gdal.FillNodata smoothingIterations parameter. Defaults to 0.
+        in_place (bool, optional): if True, fill input_array itself when it is a C-contiguous uint8 array
+        (otherwise a copy is filled). Defaults to False.
+    Returns:
+        output_array (np.array): filled raster array (uint8)
+    """
+    output_array = get_output_byte_array(input_array, in_place)
+    dataset = gdal_array.OpenArray(output_array)
     band = dataset.GetRasterBand(1)
     band.SetNoDataValue(0)  # Set no datavalue to 0 as data are stored as bytes. Required to fill no-data values
-    gdal_array.BandWriteArray(band, input_array)
     gdal.FillNodata(
         band,
         None,
@@ -18,7 +51,8 @@ def fill_nodata_in_array(input_array: np.array, max_distance: float = 2.0, smoot
         smoothingIterations=smoothing_iterations,
         options=["INTERPOLATION=nearest"],  # as data are classification values
     )
-    output_array = band.ReadAsArray()
+    band = None
+    dataset = None
 
     return output_array
 
@@ -35,15 +69,18 @@ def smooth_class_array(class_map_array: np.array, nconnectedness: int, threshold
     Returns:
         class_map_array (np.array): raster array smoothed
     """
-    rows, cols = class_map_array.shape
-    driver = gdal.GetDriverByName("MEM")
-    dataset = driver.Create("", cols, rows, 1, gdal.GDT_Byte)
-    band = dataset.GetRasterBand(1)
-    gdal_array.BandWriteArray(band, class_map_array)
-    gdal.SieveFilter(band, None, band, threshold, nconnectedness)
-    class_map_array = band.ReadAsArray()
+    source_array = as_byte_array(class_map_array)
+    smoothed_array = np.empty_like(source_array)
+    # GDAL datasets that wrap the numpy buffers directly
+    source_dataset = gdal_array.OpenArray(source_array)
+    smoothed_dataset = gdal_array.OpenArray(smoothed_array)
+    gdal.SieveFilter(
+        source_dataset.GetRasterBand(1), None, smoothed_dataset.GetRasterBand(1), threshold, nconnectedness
+    )
+    source_dataset = None
+    smoothed_dataset = None
 
-    return class_map_array
+    return smoothed_array
 
 
 def choose_pixel_to_keep(class_map_array_raw: np.array, class_map_array_smoothed: np.array):
@@ -67,7 +104,19 @@ def choose_pixel_to_keep(class_map_array_raw: np.array, class_map_array_smoothed
     return class_map_array_merged
 
 
-def smoothing_with_fusion(class_map_array: np.array, nconnectedness: int, threshold: int):
+def choose_pixel_to_keep_in_place(class_map_array_raw: np.array, class_map_array_smoothed: np.array):
+    """Same merge as choose_pixel_to_keep, written directly into class_map_array_raw
+    (class_map_array_smoothed is modified as well)
+
+    Args:
+        class_map_array_raw (np.array): raster array raw, replaced by the merged raster array
+        class_map_array_smoothed (np.array): raster array smoothed
+    """
+    class_map_array_smoothed[class_map_array_smoothed == 6] = 0
+    np.copyto(class_map_array_raw, class_map_array_smoothed, where=class_map_array_raw <= 1)
+
+
+def smoothing_with_fusion(class_map_array: np.array, nconnectedness: int, threshold: int, in_place: bool = False):
     """This method groups post processing operated on the class map to smooth it
         - Smoothing
         - Merge with condition
@@ -76,21 +125,90 @@ def smoothing_with_fusion(class_map_array: np.array, nconnectedness: int, thresh
         class_map_array (np.array): raster array to post process
         nconnectednass (int): smoothing parameter (option for diagonal pixels)
         threshold (int): smoothing parameter (size of minimum pixel size of polygon)
+        in_place (bool, optional): if True, write the result into class_map_array itself when it is a C-contiguous
+        uint8 array (otherwise into a copy). Defaults to False.
     Returns:
         class_map_array_post_processed (np.array): output raster array
     """
-    class_map_array_smoothed = smooth_class_array(class_map_array, nconnectedness, threshold)
-    class_map_array_post_processed = choose_pixel_to_keep(class_map_array, class_map_array_smoothed)
+    class_map_array_post_processed = get_output_byte_array(class_map_array, in_place)
+    class_map_array_smoothed = smooth_class_array(class_map_array_post_processed, nconnectedness, threshold)
+    choose_pixel_to_keep_in_place(class_map_array_post_processed, class_map_array_smoothed)
+
     return class_map_array_post_processed
 
 
-def post_processing(input_array, pp_config: Dict):
+def get_blocks(shape: Tuple[int, int], block_size: int) -> List[Tuple[int, int, int, int]]:
+    """Split an array with shape `shape` into square blocks of `block_size` pixels (smaller on the right/bottom
+    edges)
+
+    Returns:
+        List[Tuple[int, int, int, int]]: (row_start, row_stop, col_start, col_stop) of each block
+    """
+    rows, cols = shape
+    return [
+        (row, min(row + block_size, rows), col, min(col + block_size, cols))
+        for row in range(0, rows, block_size)
+        for col in range(0, cols, block_size)
+    ]
+
+
+def apply_by_blocks(
+    fn: Callable[[np.array], np.array], input_array: np.array, block_size: int, halo: int, workers: int = 1
+) -> np.array:
+    """Apply a neighbourhood filter `fn` on an array by blocks: each block is extended by `halo` pixels on each side
+    (where the array allows it), filtered in a thread pool (GDAL releases the GIL), and the filtered interior of
+    each block is copied to the output.
+    The result is the same as fn(input_array) as long as the value of each output pixel depends only on the input
+    pixels at a distance lower than `halo`.
+
+    Args:
+        fn (Callable[[np.array], np.array]): filter to apply (it must keep the shape of the array)
+        input_array (np.array): array to filter
+        block_size (int): size of the blocks (in pixels, without the halo)
+        halo (int): number of pixels added on each side of the blocks
+        workers (int, optional): number of threads. Defaults to 1.
+
+    Returns:
+        np.array: filtered array
+    """
+    rows, cols = input_array.shape
+
+    def process_block(block: Tuple[int, int, int, int]) -> np.array:
+        row_start, row_stop, col_start, col_stop = block
+        halo_row_start, halo_col_start = max(row_start - halo, 0), max(col_start - halo, 0)
+        halo_row_stop, halo_col_stop = min(row_stop + halo, rows), min(col_stop + halo, cols)
+        output_block = fn(input_array[halo_row_start:halo_row_stop, halo_col_start:halo_col_stop])
+        interior_row_start, interior_col_start = row_start - halo_row_start, col_start - halo_col_start
+        interior_row_stop = interior_row_start + row_stop - row_start
+        interior_col_stop = interior_col_start + col_stop - col_start
+
+        return output_block[interior_row_start:interior_row_stop, interior_col_start:interior_col_stop]
+
+    blocks = get_blocks(input_array.shape, block_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        output_blocks = list(executor.map(process_block, blocks))
+
+    output_array = np.empty(input_array.shape, dtype=output_blocks[0].dtype)
+    for (row_start, row_stop, col_start, col_stop), output_block in zip(blocks, output_blocks):
+        output_array[row_start:row_stop, col_start:col_stop] = output_block
+
+    return output_array
+
+
+def get_fill_nodata_halo(max_distance: float, smoothing_iterations: int) -> int:
+    """Halo needed to apply fill_nodata_in_array by blocks: filled values come from pixels at a distance lower than
+    max_distance, and each smoothing iteration uses a 3x3 kernel"""
+    return math.ceil(max_distance) + smoothing_iterations + 1
+
+
+def post_processing(input_array, pp_config: Dict, workers: int = 1):
     """Apply post processing to array (expected to be a class array)
     according to a configuration dictionary
 
     - potentially apply gdal FillNoData
     - potentially apply smoothing + fusion with the raw array to keep smoothed buildings
 
+    The input array is not modified: it is copied once as a uint8 array and the steps work in place on this copy.
 
     The config dictionary should be like:
 
@@ -102,25 +220,41 @@ def post_processing(input_array, pp_config: Dict):
       apply: true
       nconnectedness: 4 # indicating that diagonal pixels are considered directly adjacent or not. 4 no, 8 yes
       threshold : 12 # rast
+    block_size: null  # optional: if set, fill nodata is applied by blocks of block_size pixels (with a halo
+                      # computed from max_distance) in a thread pool. Smoothing is always applied on the whole
+                      # array: the polygon a small polygon is merged into depends on the size of its neighbours,
+                      # which can span the whole array
 
 
     Args:
         input_array (_type_): _description_
         pp_config (Dict): _description_
+        workers (int, optional): number of threads used when pp_config["block_size"] is set. Defaults to 1.
     """
+    block_size = pp_config.get("block_size", None)
+    # Once the first step has copied the input array, the next steps can work in place on this copy
+    is_copied = False
 
     if pp_config["fillnodata"]["apply"]:
-        input_array = fill_nodata_in_array(
-            input_array,
-            max_distance=pp_config["fillnodata"]["max_distance"],
-            smoothing_iterations=pp_config["fillnodata"]["smoothing_iterations"],
-        )
+        max_distance = pp_config["fillnodata"]["max_distance"]
+        smoothing_iterations = pp_config["fillnodata"]["smoothing_iterations"]
+
+        def fill_nodata(array):
+            return fill_nodata_in_array(array, max_distance=max_distance, smoothing_iterations=smoothing_iterations)
+
+        if block_size:
+            halo = get_fill_nodata_halo(max_distance, smoothing_iterations)
+            log.debug(f"Fill nodata by blocks of {block_size} pixels with a halo of {halo} pixels")
+            input_array = apply_by_blocks(fill_nodata, input_array, block_size, halo, workers)
+        else:
+            input_array = fill_nodata(input_array)
+        is_copied = True
 
     if pp_config["smoothing"]["apply"]:
+        nconnectedness = pp_config["smoothing"]["nconnectedness"]
+        threshold = pp_config["smoothing"]["threshold"]
         input_array = smoothing_with_fusion(
-            input_array,
-            nconnectedness=pp_config["smoothing"]["nconnectedness"],
-            threshold=pp_config["smoothing"]["threshold"],
+            input_array, nconnectedness=nconnectedness, threshold=threshold, in_place=is_copied
         )
 
     return input_array
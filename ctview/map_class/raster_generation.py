@@ -9,8 +9,10 @@ from omegaconf import DictConfig
 from ctview import map_DXM, utils_raster
 from ctview.add_color import convert_raster_with_color_metadata_to_rgb
 from ctview.map_class.classes_mapping import (
+    CLASS_MAP_MODES,
     check_and_list_original_classes_to_keep,
-    compute_binary_class,
+    compute_majority_class,
+    compute_majority_class_from_counts,
     convert_class_array_to_precedence_array,
 )
 from ctview.map_class.post_processing import post_processing
@@ -27,6 +29,7 @@ def generate_class_raster_raw(
     pixel_size: float = 1,
     no_data_value: int = -9999,
     raster_driver: str = "GTiff",
+    workers: int = 1,
 ):
     """Generate a (multilayer) raster of class for the classes in `class_by_layer`.
 
@@ -49,6 +52,7 @@ def generate_class_raster_raw(
         no_data_value (int, optional): No data value of the output. Defaults to -9999.
         raster_driver (str): raster_driver (str): One of GDAL raster drivers formats
         (cf. https://gdal.org/drivers/raster/index.html#raster-drivers). Defaults to "GTiff"
+        workers (int, optional): number of threads used to compute the class presence. Defaults to 1.
     Returns:
         raster_raw (np.array): binary multilayer raster of class
     """
@@ -70,12 +74,13 @@ def generate_class_raster_raw(
         output_tif=output_tif,
         epsg=epsg,
         raster_origin=raster_origin,
-        fn=compute_binary_class,
+        fn="presence",
         classes_by_layer=class_list_by_layer,
         tile_width=tile_width,
         pixel_size=pixel_size,
         no_data_value=no_data_value,
         raster_driver=raster_driver,
+        workers=workers,
     )
 
     return raster_raw
@@ -125,6 +130,7 @@ def generate_class_raster(
             no_data_value: -9999
             extension: .tif
             raster_driver: "GTiff"
+            workers: 1
             }
             Cf `io` section in `configs/config_metadata.yaml`
 
@@ -142,8 +148,37 @@ def generate_class_raster(
     log.info("\nCreate class map")
     inter_dirs = config_class.intermediate_dirs
     ext = config_io.extension
+    mode = get_class_map_mode(config_class)
 
     classes_in_las = set(input_classifs)
+    raster_class_map = os.path.join(output_dir, f"{tilename}_class{ext}")
+    os.makedirs(os.path.dirname(raster_class_map), exist_ok=True)
+
+    if mode == "majority":
+        # Check the classes (combination rules are not used in this mode)
+        check_and_list_original_classes_to_keep(
+            classes_in_las, [], config_class.precedence_classes, config_class.ignored_classes
+        )
+        class_array = compute_majority_class(
+            input_points,
+            input_classifs,
+            raster_origin,
+            config_geometry.tile_width,
+            config_class.pixel_size,
+            list(config_class.precedence_classes),
+            dict(config_class.get("majority_weights") or {}),
+        )
+        write_class_raster_from_class_array(
+            class_array,
+            output_tif=raster_class_map,
+            raster_origin=raster_origin,
+            pixel_size=config_class.pixel_size,
+            config_class=config_class,
+            config_io=config_io,
+        )
+
+        return raster_class_map
+
     class_by_layer = check_and_list_original_classes_to_keep(
         classes_in_las, config_class.CBI_rules, config_class.precedence_classes, config_class.ignored_classes
     )
@@ -154,10 +189,7 @@ def generate_class_raster(
         else:
             raster_class_map_binary = os.path.join(tmpdir, f"{tilename}_class_raw{ext}")
 
-        raster_class_map = os.path.join(output_dir, f"{tilename}_class{ext}")
-
         os.makedirs(os.path.dirname(raster_class_map_binary), exist_ok=True)
-        os.makedirs(os.path.dirname(raster_class_map), exist_ok=True)
 
         class_raw = generate_class_raster_raw(
             input_points=input_points,
@@ -170,30 +202,152 @@ def generate_class_raster(
             pixel_size=config_class.pixel_size,
             no_data_value=config_io.no_data_value,
             raster_driver=config_io.raster_driver,
+            workers=config_io.get("workers", 1),
         )
 
-        flatten_array = convert_class_array_to_precedence_array(
-            input_array=class_raw,
-            class_by_layer=class_by_layer,
-            rules=config_class.CBI_rules,
-            priorities=config_class.precedence_classes,
-        )
-
-        post_processed_class_map = post_processing(flatten_array, config_class.post_processing)
-
-        utils_raster.write_single_band_raster_to_file(
-            input_array=post_processed_class_map,
-            raster_origin=raster_origin,
+        write_class_raster_from_binary_array(
+            class_raw,
+            class_by_layer,
             output_tif=raster_class_map,
+            raster_origin=raster_origin,
             pixel_size=config_class.pixel_size,
-            epsg=config_io.spatial_reference,
-            raster_driver=config_io.raster_driver,
-            colormap=config_class.colormap,
+            config_class=config_class,
+            config_io=config_io,
         )
 
         return raster_class_map
 
 
+def get_class_map_mode(config_class: DictConfig) -> str:
+    """Class map mode in config_class ("precedence" by default)
+
+    Raises:
+        ValueError: if the mode is not in CLASS_MAP_MODES
+    """
+    mode = config_class.get("mode", "precedence")
+    if mode not in CLASS_MAP_MODES:
+        raise ValueError(f"class_map.mode should be one of {CLASS_MAP_MODES}, got {mode} instead")
+
+    return mode
+
+
+def write_class_raster_from_binary_array(
+    class_raw: np.array,
+    class_by_layer: list,
+    output_tif: str,
+    raster_origin: tuple,
+    pixel_size: float,
+    config_class: DictConfig,
+    config_io: DictConfig,
+):
+    """Flatten a binary multilayer class array (one layer per class in class_by_layer) to a single band
+    classification array using the combination rules and precedence list in `config_class`, post-process it
+    and write it to `output_tif` (with the class colormap as metadata)
+
+    Args:
+        class_raw (np.array): binary multilayer raster of class (cf. generate_class_raster_raw)
+        class_by_layer (list): class represented on each layer of class_raw
+        output_tif (str): path to the output file
+        raster_origin (tuple): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the raster
+        config_class (DictConfig): configuration dict for the classification (cf. generate_class_raster)
+        config_io (DictConfig): hydra configuration with the general io parameters (cf. generate_class_raster)
+    """
+    flatten_array = convert_class_array_to_precedence_array(
+        input_array=class_raw,
+        class_by_layer=list(class_by_layer),  # copy as the combination rules add layers to this list
+        rules=config_class.CBI_rules,
+        priorities=config_class.precedence_classes,
+    )
+
+    write_class_raster_from_class_array(flatten_array, output_tif, raster_origin, pixel_size, config_class, config_io)
+
+
+def write_class_raster_from_class_array(
+    class_array: np.array,
+    output_tif: str,
+    raster_origin: tuple,
+    pixel_size: float,
+    config_class: DictConfig,
+    config_io: DictConfig,
+):
+    """Post-process a single band classification array using the parameters in `config_class` and write it to
+    `output_tif` (with the class colormap as metadata)
+
+    Args:
+        class_array (np.array): single band classification array
+        output_tif (str): path to the output file
+        raster_origin (tuple): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the raster
+        config_class (DictConfig): configuration dict for the classification (cf. generate_class_raster)
+        config_io (DictConfig): hydra configuration with the general io parameters (cf. generate_class_raster)
+    """
+    post_processed_class_map = post_processing(
+        class_array, config_class.post_processing, workers=config_io.get("workers", 1)
+    )
+
+    utils_raster.write_single_band_raster_to_file(
+        input_array=post_processed_class_map,
+        raster_origin=raster_origin,
+        output_tif=output_tif,
+        pixel_size=pixel_size,
+        epsg=config_io.spatial_reference,
+        raster_driver=config_io.raster_driver,
+        colormap=config_class.colormap,
+    )
+
+
+def write_class_raster_from_counts(
+    counts: np.array,
+    classes: list,
+    output_tif: str,
+    raster_origin: tuple,
+    pixel_size: float,
+    config_class: DictConfig,
+    config_io: DictConfig,
+):
+    """Compute a single band classification array from the number of points of each class in each pixel (cf.
+    multi_resolution.compute_class_counts) using the mode in `config_class` ("precedence": combination rules and
+    precedence list on the classes presence, or "majority": most frequent class), post-process it and write it to
+    `output_tif` (with the class colormap as metadata)
+
+    Args:
+        counts (np.array): points count with shape (len(classes), nb_rows, nb_cols)
+        classes (list): class of each layer of counts (all the classes of the input points)
+        output_tif (str): path to the output file
+        raster_origin (tuple): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the raster
+        config_class (DictConfig): configuration dict for the classification (cf. generate_class_raster)
+        config_io (DictConfig): hydra configuration with the general io parameters (cf. generate_class_raster)
+    """
+    if get_class_map_mode(config_class) == "majority":
+        check_and_list_original_classes_to_keep(
+            set(classes), [], config_class.precedence_classes, config_class.ignored_classes
+        )
+        class_array = compute_majority_class_from_counts(
+            counts,
+            list(classes),
+            list(config_class.precedence_classes),
+            dict(config_class.get("majority_weights") or {}),
+        )
+        write_class_raster_from_class_array(
+            class_array, output_tif, raster_origin, pixel_size, config_class, config_io
+        )
+
+    else:
+        class_by_layer = check_and_list_original_classes_to_keep(
+            set(classes), config_class.CBI_rules, config_class.precedence_classes, config_class.ignored_classes
+        )
+        # classes that are not in counts (eg. classes from precedence_classes) have empty layers
+        class_presence = np.zeros((len(class_by_layer),) + counts.shape[1:], dtype=np.uint8)
+        for ii, c in enumerate(class_by_layer):
+            if c in classes:
+                class_presence[ii] = counts[list(classes).index(c)] > 0
+        write_class_raster_from_binary_array(
+            class_presence, class_by_layer, output_tif, raster_origin, pixel_size, config_class, config_io
+        )
+
+
 def generate_pretty_class_raster_from_single_band_raster(
     input_raster: str,
     input_las: str,
@@ -201,6 +355,7 @@ def generate_pretty_class_raster_from_single_band_raster(
     output_dir: str,
     config_class: DictConfig,
     config_io: DictConfig,
+    output_dxm_hillshade: str = None,
 ):
     """Use single band classification raster (with colors in the metadata) and
     las file to generate a classification raster for visualization purpose
@@ -226,12 +381,15 @@ def generate_pretty_class_raster_from_single_band_raster(
           hillshade_calc: "0.95*A*(0.2+0.6*(B/255))"
             }
         config_io (DictConfig): _description_
+        output_dxm_hillshade (str, optional): path where to keep the DSM hillshade (eg. to re-render the class map
+        later with generate_pretty_class_raster_with_hillshade). If None, it is saved to a temporary file.
+        Defaults to None.
     """
     ext = config_io.extension
     with tempfile.TemporaryDirectory(prefix="tmp_class_map", dir="tmp") as tmpdir:
         colored_tmp_file = os.path.join(tmpdir, f"{tilename}_colored{ext}")
         dxm_raw_tmp_file = os.path.join(tmpdir, f"{tilename}_dxm_raw{ext}")
-        dxm_hillshade_tmp_file = os.path.join(tmpdir, f"{tilename}_dxm_hillshade{ext}")
+        dxm_hillshade_tmp_file = output_dxm_hillshade or os.path.join(tmpdir, f"{tilename}_dxm_hillshade{ext}")
 
         convert_raster_with_color_metadata_to_rgb(input_raster, colored_tmp_file)
 
@@ -247,4 +405,41 @@ def generate_pretty_class_raster_from_single_band_raster(
             output_dxm_hillshade=dxm_hillshade_tmp_file,
             hillshade_calc=config_class.hillshade_calc,
             config_io=config_io,
+            overview_resampling="NEAREST",
+        )
+
+
+def generate_pretty_class_raster_with_hillshade(
+    input_raster: str,
+    hillshade_raster: str,
+    tilename: str,
+    output_dir: str,
+    config_class: DictConfig,
+    config_io: DictConfig,
+):
+    """Same as generate_pretty_class_raster_from_single_band_raster, using an existing DSM hillshade raster
+    instead of computing it from the las file
+
+    Args:
+        input_raster (str): path to the input single band classification model
+        hillshade_raster (str): path to the DSM hillshade raster (with the same grid as input_raster)
+        tilename (str): tilename (used to generate the output file name)
+        output_dir (str): path to the output directory
+        config_class (DictConfig): configuration dict for the class map (cf.
+        generate_pretty_class_raster_from_single_band_raster)
+        config_io (DictConfig): hydra configuration with the general io parameters
+    """
+    ext = config_io.extension
+    with tempfile.TemporaryDirectory(prefix="tmp_class_map", dir="tmp") as tmpdir:
+        colored_tmp_file = os.path.join(tmpdir, f"{tilename}_colored{ext}")
+        convert_raster_with_color_metadata_to_rgb(input_raster, colored_tmp_file)
+
+        os.makedirs(output_dir, exist_ok=True)
+        map_DXM.mix_raster_with_hillshade(
+            input_raster=colored_tmp_file,
+            hillshade_raster=hillshade_raster,
+            output_raster=os.path.join(output_dir, f"{tilename}{ext}"),
+            hillshade_calc=config_class.hillshade_calc,
+            config_io=config_io,
+            overview_resampling="NEAREST",
         )
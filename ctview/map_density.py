@@ -4,11 +4,12 @@ import tempfile
 from collections.abc import Iterable
 from typing import Tuple
 
-import laspy
 import numpy as np
 from omegaconf import DictConfig
 
-from ctview import add_color, utils_raster
+from ctview import add_color, utils_las, utils_raster
+
+DENSITY_OUTPUT_DTYPES = ["uint8", "uint16", "uint32", "float32"]
 
 
 def generate_raster_of_density(
@@ -22,6 +23,8 @@ def generate_raster_of_density(
     pixel_size: float = 1,
     no_data_value: int = -9999,
     raster_driver: str = "GTiff",
+    output_dtype: str = "float32",
+    workers: int = 1,
 ):
     """Generate a (multilayer) raster of density for the classes in `class_by_layer`.
 
@@ -45,33 +48,94 @@ def generate_raster_of_density(
         no_data_value (int, optional): No data value of the output. Defaults to -9999.
         raster_driver (str): raster_driver (str): One of GDAL raster drivers formats
         (cf. https://gdal.org/drivers/raster/index.html#raster-drivers). Defaults to "GTiff"
+        output_dtype (str, optional): data type of the output raster. For integer types, the raster stores
+        point counts (saturated to the type range) with a scale factor of 1 / pixel_size**2 in its metadata,
+        so that density values are read by software that applies GDAL scale/offset. Defaults to "float32".
+        workers (int, optional): number of threads used to compute the density. Defaults to 1.
     """
+    if np.issubdtype(np.dtype(output_dtype), np.integer):
+        fn = "count"
+        scale = 1 / pixel_size**2
+    else:
+        fn = "density"
+        scale = 1
+
     utils_raster.generate_raster_raw(
         input_points=input_points,
         input_classifs=input_classifs,
         output_tif=output_tif,
         epsg=epsg,
         raster_origin=raster_origin,
-        fn=compute_density,
+        fn=fn,
         classes_by_layer=classes_by_layer,
         tile_width=tile_width,
         pixel_size=pixel_size,
         no_data_value=no_data_value,
         raster_driver=raster_driver,
+        overview_resampling="AVERAGE",
+        output_dtype=output_dtype,
+        scale=scale,
+        workers=workers,
     )
 
 
-def compute_density(points: np.array, origin: Tuple[int, int], tile_width: int, pixel_size: float):
+def compute_count(points: np.array, origin: Tuple[int, int], tile_width: int, pixel_size: float):
     # Compute number of points per bin
     bins_x = np.arange(origin[0], origin[0] + tile_width + pixel_size, pixel_size)
     bins_y = np.arange(origin[1] - tile_width, origin[1] + pixel_size, pixel_size)
     bins, _, _ = np.histogram2d(points[:, 1], points[:, 0], bins=[bins_y, bins_x])
-    density = bins / (pixel_size**2)
-    density = np.flipud(density)
+    count = np.flipud(bins)
+
+    return count
+
+
+def compute_density(points: np.array, origin: Tuple[int, int], tile_width: int, pixel_size: float):
+    density = compute_count(points, origin, tile_width, pixel_size) / (pixel_size**2)
 
     return density
 
 
+def check_config_density(config_density: DictConfig | dict):
+    """Check the consistency of the density configuration (cf. create_density_raster_from_config)
+
+    Raises:
+        TypeError: if config_density.keep_classes does not have the correct type
+        ValueError: if config_density.output_dtype is not supported, or is an integer type with colorize=True,
+        or if config_density.keep_classes describes several bands with colorize=True
+    """
+    if not isinstance(config_density.keep_classes, Iterable):
+        raise TypeError(
+            "In create_colored_density_raster, "
+            "config_density.keep_classes is expected to be a list, "
+            f"got {type(config_density.keep_classes)} instead)"
+        )
+    if not np.all([isinstance(item, Iterable) for item in config_density["keep_classes"]]):
+        raise TypeError(
+            "In create_colored_density_raster, "
+            "config_density.keep_classes is expected to be a list of lists "
+            "(with the classes to keep on each band of the output raster), "
+            f"got {config_density['keep_classes']} instead)"
+        )
+    if config_density["colorize"] and (len(config_density["keep_classes"]) != 1):
+        raise ValueError(
+            "In create_colored_density_raster, config_density['keep_classes'] should describe only 1 band"
+            "if colorize = True,  "
+            f"got {config_density['keep_classes']} instead)"
+        )
+    output_dtype = config_density.get("output_dtype", "float32")
+    if output_dtype not in DENSITY_OUTPUT_DTYPES:
+        raise ValueError(
+            "In create_colored_density_raster, config_density['output_dtype'] should be one of "
+            f"{DENSITY_OUTPUT_DTYPES}, got {output_dtype} instead)"
+        )
+    if config_density["colorize"] and output_dtype != "float32":
+        raise ValueError(
+            "In create_colored_density_raster, config_density['output_dtype'] should be float32 "
+            "if colorize = True (the colormap is applied to density values), "
+            f"got {output_dtype} instead)"
+        )
+
+
 def create_density_raster_from_config(
     input_las: str,
     tile_origin: Tuple[int, int],
@@ -91,6 +155,7 @@ def create_density_raster_from_config(
         eg.  {
             pixel_size: 5
             keep_classes: [2, 66]
+            output_dtype: float32  # optional, one of uint8, uint16, uint32, float32
             dxm_filter:  # Filter used to generate dtm
                 dimension: Classification
                 keep_values: [2, 66]
@@ -108,6 +173,7 @@ def create_density_raster_from_config(
             extension: .tif
             raster_driver: GTiff
             no_data_value: -9999
+            workers: 1
             tile_geometry:
                 tile_coord_scale: 1000
                 tile_width: 1000
@@ -115,35 +181,55 @@ def create_density_raster_from_config(
 
     Raises:
         TypeError: if config_density.keep_classes does not have the correct type
+        ValueError: if config_density.output_dtype is not supported, or is an integer type with colorize=True
 
     Returns:
         str: path to the output raster
     """
 
+    log.info("\nRead point cloud\n")
+    las = utils_las.read_las(input_las)
+    points_np = np.vstack((las.x, las.y, las.z)).transpose()
+    # keep only the points that can be binned in the raster (the buffer is not needed for the density)
+    is_kept = utils_raster.is_in_raster_extent(
+        points_np, tile_origin, config_io.tile_geometry.tile_width, config_density.pixel_size
+    )
+
+    return create_density_raster_from_points(
+        points_np[is_kept], np.asarray(las.classification)[is_kept], tile_origin, tilename, config_density, config_io
+    )
+
+
+def create_density_raster_from_points(
+    input_points: np.array,
+    input_classifs: np.array,
+    tile_origin: Tuple[int, int],
+    tilename: str,
+    config_density: DictConfig | dict,
+    config_io: DictConfig | dict,
+) -> str:
+    """Same as create_density_raster_from_config, from points that have already been read
+
+    Args:
+        input_points (np.array): numpy array with the input points
+        input_classifs (np.array): numpy array with classifications of the input points
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tilename (str): tilename used to generate the output filename
+        config_density (DictConfig | dict): hydra configuration with the density parameters
+        (cf. create_density_raster_from_config)
+        config_io (DictConfig | dict): hydra configuration with the general io parameters
+        (cf. create_density_raster_from_config)
+
+    Returns:
+        str: path to the output raster
+    """
     log.info("\nCreate density maps")
     out_dir = config_io.output_dir
     inter_dirs = config_density.get("intermediate_dirs", "")
     ext = config_io.extension
 
-    if not isinstance(config_density.keep_classes, Iterable):
-        raise TypeError(
-            "In create_colored_density_raster, "
-            "config_density.keep_classes is expected to be a list, "
-            f"got {type(config_density.keep_classes)} instead)"
-        )
-    if not np.all([isinstance(item, Iterable) for item in config_density["keep_classes"]]):
-        raise TypeError(
-            "In create_colored_density_raster, "
-            "config_density.keep_classes is expected to be a list of lists "
-            "(with the classes to keep on each band of the output raster), "
-            f"got {config_density['keep_classes']} instead)"
-        )
-    if config_density["colorize"] and (len(config_density["keep_classes"]) != 1):
-        raise ValueError(
-            "In create_colored_density_raster, config_density['keep_classes'] should describe only 1 band"
-            "if colorize = True,  "
-            f"got {config_density['keep_classes']} instead)"
-        )
+    check_config_density(config_density)
+    output_dtype = config_density.get("output_dtype", "float32")
 
     with tempfile.TemporaryDirectory(prefix="tmp_density", dir="tmp") as tmpdir:
         raster_dens = os.path.join(out_dir, config_density.output_subdir, f"{tilename}_density{ext}")
@@ -159,11 +245,6 @@ def create_density_raster_from_config(
         os.makedirs(os.path.dirname(raster_dens_values), exist_ok=True)
         os.makedirs(os.path.dirname(raster_dens), exist_ok=True)
 
-        log.info("\nRead point cloud\n")
-        las = laspy.read(input_las)
-        points_np = np.vstack((las.x, las.y, las.z)).transpose()
-        classifs = np.copy(las.classification)
-
         log.info("\nCreate density map (values)\n")
         raster_origin = utils_raster.compute_raster_origin(
             tile_origin,
@@ -171,8 +252,8 @@ def create_density_raster_from_config(
         )
 
         generate_raster_of_density(
-            input_points=points_np,
-            input_classifs=classifs,
+            input_points=input_points,
+            input_classifs=input_classifs,
             output_tif=raster_dens_values,
             epsg=config_io.spatial_reference,
             raster_origin=raster_origin,
@@ -181,6 +262,8 @@ def create_density_raster_from_config(
             pixel_size=config_density.pixel_size,
             no_data_value=config_io.no_data_value,
             raster_driver=config_io.raster_driver,
+            output_dtype=output_dtype,
+            workers=config_io.get("workers", 1),
         )
 
         if config_density["colorize"]:
@@ -189,6 +272,8 @@ def create_density_raster_from_config(
                 input_raster=raster_dens_values,
                 output_raster=raster_dens,
                 colormap=config_density.colormap,
+                raster_driver=config_io.raster_driver,
+                creation_options=utils_raster.get_creation_options(config_io.raster_driver, "AVERAGE"),
             )
 
     return raster_dens
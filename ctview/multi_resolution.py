@@ -0,0 +1,421 @@
+import logging as log
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from omegaconf import DictConfig, OmegaConf
+
+from ctview import add_color, aggregators, map_density, utils_raster
+from ctview.map_class import raster_generation as map_class
+
+
+def get_nesting_factor(base_pixel_size: float, pixel_size: float, tile_width: int) -> int | None:
+    """Get the factor k such as a raster with pixel size `pixel_size` can be derived from a raster with pixel size
+    `base_pixel_size` by grouping blocks of k x k pixels.
+
+    As raster origins are shifted by half a pixel from the tile origin (cf. utils_raster.compute_raster_origin),
+    the pixels edges of both rasters match only when k is an odd integer.
+
+    Args:
+        base_pixel_size (float): pixel size of the finest raster
+        pixel_size (float): pixel size of the raster to derive
+        tile_width (int): tile width (in meters)
+
+    Returns:
+        int | None: nesting factor k, None if the grids do not nest
+    """
+    factor = pixel_size / base_pixel_size
+    nesting_factor = round(factor)
+    nb_pixels = tile_width / pixel_size
+    if (
+        nesting_factor < 1
+        or not np.isclose(factor, nesting_factor)
+        or nesting_factor % 2 == 0
+        or not np.isclose(nb_pixels, round(nb_pixels))
+    ):
+        return None
+
+    return nesting_factor
+
+
+def group_pixel_sizes_by_base_grid(pixel_sizes: List[float], tile_width: int) -> Dict[float, Dict[float, int]]:
+    """Group pixel sizes so that each group can be derived from a single base grid (the finest pixel size of the group)
+
+    Args:
+        pixel_sizes (List[float]): pixel sizes to generate
+        tile_width (int): tile width (in meters)
+
+    Returns:
+        Dict[float, Dict[float, int]]: for each base pixel size, the pixel sizes derived from this base grid and their
+        nesting factor. Eg. for pixel_sizes=[0.5, 1, 2.5, 5]: {0.5: {0.5: 1, 2.5: 5}, 1: {1: 1, 5: 5}}
+    """
+    groups = {}
+    for pixel_size in sorted(set(pixel_sizes)):
+        for base_pixel_size, group in groups.items():
+            nesting_factor = get_nesting_factor(base_pixel_size, pixel_size, tile_width)
+            if nesting_factor:
+                group[pixel_size] = nesting_factor
+                break
+        else:
+            groups[pixel_size] = {pixel_size: 1}
+
+    return groups
+
+
+def compute_class_counts(
+    points: np.array,
+    classifs: np.array,
+    classes: List[int],
+    origin: Tuple[float, float],
+    tile_width: int,
+    pixel_size: float,
+    margin: int = 0,
+    workers: int = 1,
+    out: np.array = None,
+) -> np.array:
+    """Count the points of each class in `classes` in each pixel of a grid, in a single pass over the points.
+
+    The grid covers the tile (from `origin`, with the same pixel edges as map_density.compute_count) plus `margin`
+    pixels on each side. Without margin, the last column/first row of the grid include their right/top edges as in
+    map_density.compute_count. With a margin, all the pixels exclude their right/top edges: the points lying
+    exactly on the right/top edges of a grid derived from this grid (cf. derive_grid) are then never counted in it,
+    and are added by count_edge_points.
+
+    The counts are added to `out` class by class, so that the only other grid allocated is the count of one class.
+
+    Args:
+        points (np.array): numpy array with the input points (x, y, z)
+        classifs (np.array): numpy array with classifications of the input points
+        classes (List[int]): classes to count (points with other classes are ignored)
+        origin (Tuple[float, float]): origin of the raster (top left corner of the upper left pixel)
+        tile_width (int): tile width (in meters)
+        pixel_size (float): pixel size of the grid
+        margin (int, optional): number of additional pixels on each side of the tile. Defaults to 0.
+        workers (int, optional): number of threads used to compute the pixel of the points (the points are split
+        into chunks that are processed in parallel) and to count the points of each class. Defaults to 1.
+        out (np.array, optional): array with shape (len(classes), nb_pixels, nb_pixels) to which the points count
+        is added (eg. to accumulate the counts of several chunks of points). Defaults to None (new uint32 array).
+
+    Returns:
+        np.array: points count with shape (len(classes), nb_pixels, nb_pixels) (`out` if provided)
+    """
+    nb_pixels = round(tile_width / pixel_size) + 2 * margin
+    bins_x = origin[0] - margin * pixel_size + np.arange(nb_pixels + 1) * pixel_size
+    bins_y = origin[1] + margin * pixel_size - np.arange(nb_pixels, -1, -1) * pixel_size
+    if out is None:
+        out = np.zeros((len(classes), nb_pixels, nb_pixels), dtype=np.uint32)
+    elif out.shape != (len(classes), nb_pixels, nb_pixels):
+        raise ValueError(
+            f"In compute_class_counts, out should have shape {(len(classes), nb_pixels, nb_pixels)}, "
+            f"got {out.shape} instead"
+        )
+
+    # index of the class of each point in `classes` (-1 for the points to ignore)
+    lookup = np.full(max(np.max(classifs, initial=0), max(classes, default=0)) + 1, -1)
+    lookup[classes] = np.arange(len(classes))
+    class_index = lookup[classifs]
+
+    def compute_chunk_index(chunk: Tuple[int, int]) -> Tuple[np.array, np.array]:
+        # class index and flat pixel index of each kept point
+        start, stop = chunk
+        chunk_points = points[start:stop]
+        pixel_index = aggregators.compute_pixel_index(chunk_points, bins_x, bins_y)
+        if margin:
+            pixel_index[(chunk_points[:, 0] == bins_x[-1]) | (chunk_points[:, 1] == bins_y[-1])] = -1
+        chunk_class_index = class_index[start:stop]
+        is_kept = (chunk_class_index >= 0) & (pixel_index >= 0)
+        return chunk_class_index[is_kept], pixel_index[is_kept]
+
+    def add_class_count(index: int):
+        # each class is added to its own layer of `out`: the classes can be counted in parallel
+        count = np.bincount(kept_pixel_index[kept_class_index == index], minlength=nb_pixels**2)
+        np.add(out[index], count.reshape((nb_pixels, nb_pixels)), out=out[index], casting="unsafe")
+
+    aggregators.check_workers(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(compute_chunk_index, aggregators.split_range(len(points), workers)))
+        kept_class_index = np.concatenate([chunk_class_index for chunk_class_index, _ in chunks])
+        kept_pixel_index = np.concatenate([pixel_index for _, pixel_index in chunks])
+        del chunks
+        list(executor.map(add_class_count, range(len(classes))))
+
+    return out
+
+
+def count_edge_points(
+    points: np.array,
+    classifs: np.array,
+    classes: List[int],
+    origin: Tuple[float, float],
+    tile_width: int,
+    pixel_size: float,
+    out: np.array = None,
+) -> np.array:
+    """Count the points of each class lying exactly on the right/top edges of a grid (cf. compute_class_counts).
+    map_density.compute_count counts them in the last column/first row of the grid, whereas they are not counted in
+    this grid when it is derived from a base grid with a margin (cf. derive_grid).
+
+    Returns:
+        np.array: points count with shape (len(classes), nb_pixels, nb_pixels) (added to `out` if provided)
+    """
+    bins_x, bins_y = aggregators.get_grid_edges(origin, tile_width, pixel_size)
+    is_on_edge = (points[:, 0] == bins_x[-1]) | (points[:, 1] == bins_y[-1])
+
+    return compute_class_counts(
+        points[is_on_edge], classifs[is_on_edge], classes, origin, tile_width, pixel_size, out=out
+    )
+
+
+def derive_grid(base_array: np.array, margin: int, nesting_factor: int, reduction: str = "sum") -> np.array:
+    """Derive a coarser grid from a base grid computed with a margin of `margin` pixels (cf. compute_class_counts)
+    by reducing blocks of nesting_factor x nesting_factor pixels.
+
+    Args:
+        base_array (np.array): base grid (the 2 last axes are the rows and columns)
+        margin (int): margin (in base pixels) around the tile in the base grid
+        nesting_factor (int): nesting factor between the base grid and the derived grid (cf. get_nesting_factor)
+        reduction (str, optional): "sum" to sum the blocks values (eg. for points counts), "or" to compute a
+        logical OR on the blocks (eg. for class presence). Defaults to "sum".
+
+    Returns:
+        np.array: derived grid
+    """
+    nb_base_pixels = base_array.shape[-1] - 2 * margin
+    start = margin - (nesting_factor - 1) // 2
+    stop = start + nb_base_pixels
+    window = base_array[..., start:stop, start:stop]
+    nb_pixels = nb_base_pixels // nesting_factor
+    blocks = window.reshape(window.shape[:-2] + (nb_pixels, nesting_factor, nb_pixels, nesting_factor))
+
+    if reduction == "sum":
+        # keep the dtype of the points counts (uint32, cf. compute_class_counts) instead of the default uint64
+        return blocks.sum(axis=(-3, -1), dtype=np.result_type(base_array.dtype, np.uint32))
+    elif reduction == "or":
+        return np.logical_or.reduce(blocks, axis=(-3, -1))
+    else:
+        raise ValueError(f"In derive_grid, reduction should be 'sum' or 'or', got {reduction} instead")
+
+
+def get_pixel_size_subdir(pixel_size: float) -> str:
+    """Name of the output subdirectory for a given pixel size (eg. "0.5m")"""
+    return f"{pixel_size:g}m"
+
+
+def write_density_raster_from_counts(
+    counts: np.array,
+    output_tif: str,
+    raster_origin: tuple,
+    pixel_size: float,
+    config_density: DictConfig,
+    config_io: DictConfig,
+):
+    """Write a density raster from a multilayer points count array
+
+    Args:
+        counts (np.array): number of points per pixel (one layer per band of the output raster)
+        output_tif (str): path to the output density raster
+        raster_origin (tuple): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the raster
+        config_density (DictConfig): hydra configuration with the density parameters
+        config_io (DictConfig): hydra configuration with the general io parameters
+    """
+    output_dtype = config_density.get("output_dtype", "float32")
+    with tempfile.TemporaryDirectory(prefix="tmp_density", dir="tmp") as tmpdir:
+        if config_density["colorize"]:
+            raster_dens_values = os.path.join(tmpdir, os.path.basename(output_tif))
+        else:
+            raster_dens_values = output_tif
+
+        if np.issubdtype(np.dtype(output_dtype), np.integer):
+            data, scale = counts, 1 / pixel_size**2
+        else:
+            data, scale = counts / pixel_size**2, 1
+
+        utils_raster.write_multiband_raster_to_file(
+            data,
+            raster_origin,
+            raster_dens_values,
+            pixel_size=pixel_size,
+            epsg=config_io.spatial_reference,
+            no_data_value=config_io.no_data_value,
+            raster_driver=config_io.raster_driver,
+            overview_resampling="AVERAGE",
+            output_dtype=output_dtype,
+            scale=scale,
+        )
+
+        if config_density["colorize"]:
+            add_color.color_raster_with_interpolation(
+                input_raster=raster_dens_values,
+                output_raster=output_tif,
+                colormap=config_density.colormap,
+                raster_driver=config_io.raster_driver,
+                creation_options=utils_raster.get_creation_options(config_io.raster_driver, "AVERAGE"),
+            )
+
+
+def create_multi_resolution_rasters_from_config(
+    input_points: np.array,
+    input_classifs: np.array,
+    input_las: str,
+    tile_origin: Tuple[int, int],
+    tilename: str,
+    config: DictConfig,
+):
+    """Generate density and classification rasters at several pixel sizes with a single pass over the points
+    for all the pixel sizes that nest (cf. get_nesting_factor):
+    - the points of each class are counted once on the finest grid
+    - coarser density maps are derived by summing blocks of pixels
+    - coarser class maps are derived from the sum of the points count of each class on blocks of pixels
+    Pixel sizes that do not nest with a finer pixel size are computed from their own grid.
+
+    The pixel sizes are in config.multi_resolution.density_pixel_sizes and config.multi_resolution.class_pixel_sizes
+    The output rasters are saved in a subdirectory named after the pixel size (eg. "5m") of the usual output
+    directory of each product, with the usual filenames.
+
+    Args:
+        input_points (np.array): numpy array with the input points
+        input_classifs (np.array): numpy array with classifications of the input points
+        input_las (str): path to the input las file (used to compute the DSM for the pretty class map)
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tilename (str): tilename used to generate the output filenames
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+    """
+    config_io = config.io
+    config_density = config.density
+    config_class = config.class_map
+    out_dir = config_io.output_dir
+    ext = config_io.extension
+    tile_width = config_io.tile_geometry.tile_width
+
+    density_pixel_sizes = (
+        list(config.multi_resolution.density_pixel_sizes or []) if config_density.output_subdir else []
+    )
+    class_pixel_sizes = (
+        list(config.multi_resolution.class_pixel_sizes or [])
+        if config_class.output_class_subdir or config_class.output_class_pretty_subdir
+        else []
+    )
+
+    if density_pixel_sizes:
+        map_density.check_config_density(config_density)
+
+    classes = sorted(np.unique(input_classifs).tolist())
+
+    groups = group_pixel_sizes_by_base_grid(density_pixel_sizes + class_pixel_sizes, tile_width)
+    log.info(f"Multi-resolution: {len(groups)} pass(es) over the points for the grids {list(groups.values())}")
+
+    for base_pixel_size, group in groups.items():
+        margin = max(group.values()) // 2
+        base_counts = compute_class_counts(
+            input_points,
+            input_classifs,
+            classes,
+            utils_raster.compute_raster_origin(tile_origin, pixel_size=base_pixel_size),
+            tile_width,
+            base_pixel_size,
+            margin=margin,
+            workers=config_io.get("workers", 1),
+        )
+
+        for pixel_size, nesting_factor in group.items():
+            raster_origin = utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size)
+            subdir = get_pixel_size_subdir(pixel_size)
+            counts = derive_grid(base_counts, margin, nesting_factor, "sum")
+            if margin:
+                count_edge_points(
+                    input_points, input_classifs, classes, raster_origin, tile_width, pixel_size, out=counts
+                )
+
+            if pixel_size in density_pixel_sizes:
+                log.info(f"\nCreate density map at {pixel_size}m")
+                layers = []
+                for keep_classes in config_density.keep_classes:
+                    # an empty list of classes means all the points
+                    class_indices = [classes.index(c) for c in keep_classes or classes if c in classes]
+                    layers.append(counts[class_indices].sum(axis=0))
+                output_tif = os.path.join(out_dir, config_density.output_subdir, subdir, f"{tilename}_density{ext}")
+                os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+                write_density_raster_from_counts(
+                    np.array(layers), output_tif, raster_origin, pixel_size, config_density, config_io
+                )
+
+            if pixel_size in class_pixel_sizes:
+                log.info(f"\nCreate class map at {pixel_size}m")
+                create_class_rasters_from_counts(
+                    counts,
+                    classes,
+                    input_las,
+                    tilename,
+                    raster_origin,
+                    pixel_size,
+                    config_class,
+                    config_io,
+                )
+
+
+def create_class_rasters_from_counts(
+    counts: np.array,
+    classes: list,
+    input_las: str,
+    tilename: str,
+    raster_origin: tuple,
+    pixel_size: float,
+    config_class: DictConfig,
+    config_io: DictConfig,
+    subdir: str = None,
+    output_dxm_hillshade: str = None,
+):
+    """Generate the single band class map and/or the pretty class map (depending on the output directories in
+    config_class) at pixel size `pixel_size` from the number of points of each class in each pixel
+
+    Args:
+        counts (np.array): points count with shape (len(classes), nb_rows, nb_cols)
+        classes (list): class of each layer of counts
+        input_las (str): path to the input las file (used to compute the DSM for the pretty class map)
+        tilename (str): tilename used to generate the output filenames
+        raster_origin (tuple): origin of the raster (top left corner of the upper left pixel)
+        pixel_size (float): pixel size of the rasters
+        config_class (DictConfig): configuration dict for the classification (cf. configs/config_control.yaml)
+        config_io (DictConfig): hydra configuration with the general io parameters
+        subdir (str, optional): output subdirectory. Defaults to None (pixel size subdirectory,
+        cf. get_pixel_size_subdir)
+        output_dxm_hillshade (str, optional): path where to save the DSM hillshade of the pretty class map.
+        Defaults to None.
+    """
+    out_dir = config_io.output_dir
+    ext = config_io.extension
+    subdir = get_pixel_size_subdir(pixel_size) if subdir is None else subdir
+
+    with tempfile.TemporaryDirectory(prefix="tmp_class_map", dir="tmp") as tmpdir:
+        if config_class.output_class_subdir:
+            output_class_dir = os.path.join(out_dir, config_class.output_class_subdir, subdir)
+        else:
+            output_class_dir = tmpdir
+        os.makedirs(output_class_dir, exist_ok=True)
+        class_raster_path = os.path.join(output_class_dir, f"{tilename}_class{ext}")
+
+        map_class.write_class_raster_from_counts(
+            counts,
+            classes,
+            output_tif=class_raster_path,
+            raster_origin=raster_origin,
+            pixel_size=pixel_size,
+            config_class=config_class,
+            config_io=config_io,
+        )
+
+        if config_class.output_class_pretty_subdir:
+            output_class_pretty_dir = os.path.join(out_dir, config_class.output_class_pretty_subdir, subdir)
+            os.makedirs(output_class_pretty_dir, exist_ok=True)
+            map_class.generate_pretty_class_raster_from_single_band_raster(
+                input_raster=class_raster_path,
+                input_las=input_las,
+                tilename=tilename,
+                output_dir=output_class_pretty_dir,
+                config_class=OmegaConf.merge(config_class, {"pixel_size": pixel_size}),
+                config_io=config_io,
+                output_dxm_hillshade=output_dxm_hillshade,
+            )
@@ -0,0 +1,132 @@
+import logging as log
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from omegaconf import DictConfig
+
+# Writer used by utils_raster while products are generated in background_writer (one per thread)
+_active = threading.local()
+
+
+class RasterWriter:
+    """Write rasters in background threads while the next products are computed.
+
+    The rasters are written by `workers` threads, with at most `max_pending` writes waiting or in progress: submit
+    blocks when the queue is full, so that the arrays waiting to be written do not fill the memory.
+    Only the files in `output_dir` are written in background: the intermediate rasters (eg. in temporary
+    directories) are read by the next stage right away and are written synchronously.
+
+    An error raised by a write is raised again by wait_for (for this file) or by flush.
+    """
+
+    def __init__(self, output_dir: str, workers: int = 1, max_pending: int = 4):
+        self.output_dir = os.path.abspath(output_dir)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="raster_writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def is_in_output_dir(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.output_dir + os.sep)
+
+    def submit(self, output_path: str, write_fn: Callable, *args, **kwargs):
+        """Write output_path in background with write_fn(*args, **kwargs)"""
+        # a file is never written by 2 threads at the same time
+        self.wait_for(output_path)
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(write_fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.pending[os.path.abspath(output_path)] = future
+
+    def wait_for(self, path: str):
+        """Wait until path is written, if it is being written in background
+
+        Raises:
+            Exception: the error raised while writing path
+        """
+        with self.lock:
+            future = self.pending.pop(os.path.abspath(path), None)
+        if future is not None:
+            future.result()
+
+    def flush(self):
+        """Wait until all the submitted rasters are written
+
+        Raises:
+            Exception: the first error raised while writing these rasters (the other writes are completed anyway)
+        """
+        with self.lock:
+            futures = list(self.pending.items())
+            self.pending = {}
+        errors = []
+        for path, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Failed to write {path}: {e}")
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def get_active_writer() -> RasterWriter | None:
+    return getattr(_active, "writer", None)
+
+
+@contextmanager
+def background_writer(config_io: DictConfig):
+    """Write the rasters of config_io.output_dir in background in this context (cf. RasterWriter), with
+    config_io.writer_workers threads and a queue of config_io.writer_queue_size rasters. All the rasters are
+    written when the context exits (and the write errors are raised then). Writes are synchronous when
+    config_io.writer_workers is 0.
+
+    Raises:
+        ValueError: if io.writer_workers or io.writer_queue_size is negative or null
+    """
+    workers = config_io.get("writer_workers", 0)
+    max_pending = config_io.get("writer_queue_size", 4)
+    if workers < 0:
+        raise ValueError(f"io.writer_workers should be positive or null, got {workers}")
+    if workers and max_pending < 1:
+        raise ValueError(f"io.writer_queue_size should be strictly positive, got {max_pending}")
+    if not workers:
+        yield None
+        return
+
+    writer = RasterWriter(config_io.output_dir, workers, max_pending)
+    previous_writer = get_active_writer()
+    _active.writer = writer
+    try:
+        yield writer
+        writer.flush()
+    finally:
+        _active.writer = previous_writer
+        writer.shutdown()
+
+
+def write(output_path: str, write_fn: Callable, *args, **kwargs):
+    """Write output_path with write_fn(*args, **kwargs): in background if it is in the output directory of the
+    active writer (cf. background_writer), synchronously otherwise"""
+    writer = get_active_writer()
+    if writer is not None and writer.is_in_output_dir(output_path):
+        writer.submit(output_path, write_fn, *args, **kwargs)
+    else:
+        write_fn(*args, **kwargs)
+
+
+def wait_for(path: str):
+    """Wait until path is written, before reading it (no-op if it is not being written in background)"""
+    writer = get_active_writer()
+    if writer is not None:
+        writer.wait_for(path)
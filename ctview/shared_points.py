@@ -0,0 +1,98 @@
+import logging as log
+import os
+import shutil
+import tempfile
+import weakref
+from typing import Dict, Tuple
+
+import numpy as np
+
+# tmpfs mounted on most linux systems: the shared arrays stay in memory
+SHARED_MEMORY_DIR = "/dev/shm"
+
+
+def get_shared_memory_dir(nbytes: int = 0, shared_memory_dir: str = None) -> str:
+    """Directory where the shared arrays are created: `shared_memory_dir` (SHARED_MEMORY_DIR by default) if it is
+    writable and has room for `nbytes`, the temporary directory otherwise. Writing a memory-mapped array in a full
+    tmpfs (eg. the 64MB /dev/shm of docker containers) crashes the process (SIGBUS) instead of raising an error.
+
+    Args:
+        nbytes (int, optional): size of the arrays to create (in bytes). Defaults to 0.
+        shared_memory_dir (str, optional): preferred directory. Defaults to None (SHARED_MEMORY_DIR).
+
+    Raises:
+        OSError: if neither the preferred directory nor the temporary directory have room for `nbytes`
+
+    Returns:
+        str: directory where to create the shared arrays
+    """
+    shared_memory_dir = shared_memory_dir or SHARED_MEMORY_DIR
+    candidates = [shared_memory_dir, tempfile.gettempdir()]
+    for directory in candidates:
+        if not (os.path.isdir(directory) and os.access(directory, os.W_OK)):
+            continue
+        if shutil.disk_usage(directory).free >= nbytes:
+            if directory != shared_memory_dir:
+                log.warning(f"Not enough space in {shared_memory_dir} to share {nbytes} bytes, use {directory}")
+            return directory
+
+    raise OSError(f"Not enough space to share {nbytes} bytes of points in any of {candidates}")
+
+
+class SharedPoints:
+    """Arrays of a point cloud (eg. points, classifs) shared between processes without copy nor pickling.
+
+    Each array is a .npy file in a directory of a tmpfs when it has room for them (cf. get_shared_memory_dir), and
+    the worker processes memory-map these files from the directory name (cf. attach): all the processes read the
+    same memory pages.
+    The arrays can be filled in place (cf. allocate) so that the main process does not keep another copy of them.
+    The directory is removed when the container is closed (or when its context exits, or when it is garbage
+    collected), even if a worker failed.
+    """
+
+    def __init__(self, arrays: Dict[str, np.array] = {}, base_dir: str = None, nbytes: int = 0):
+        """
+        Args:
+            arrays (Dict[str, np.array], optional): arrays to copy into the container, by name. Defaults to {}.
+            base_dir (str, optional): preferred directory where to create the shared arrays (cf.
+            get_shared_memory_dir). Defaults to None (SHARED_MEMORY_DIR).
+            nbytes (int, optional): size (in bytes) of the arrays that will be allocated in the container in
+            addition to `arrays` (cf. allocate), used to choose its directory. Defaults to 0.
+        """
+        nbytes += sum(array.nbytes for array in arrays.values())
+        self.name = tempfile.mkdtemp(prefix="ctview_points_", dir=get_shared_memory_dir(nbytes, base_dir))
+        self._remove = weakref.finalize(self, shutil.rmtree, self.name, True)
+        self.arrays = {}
+        try:
+            for key, array in arrays.items():
+                self.allocate(key, array.shape, array.dtype)[...] = array
+        except BaseException:
+            self.close()
+            raise
+        log.debug(f"Shared {list(self.arrays)} in {self.name}")
+
+    def allocate(self, key: str, shape: Tuple[int, ...], dtype: np.dtype) -> np.array:
+        """Create a shared array named `key` (filled with zeros), to be filled in place"""
+        self.arrays[key] = np.lib.format.open_memmap(
+            os.path.join(self.name, f"{key}.npy"), mode="w+", dtype=dtype, shape=shape
+        )
+        return self.arrays[key]
+
+    def close(self):
+        self.arrays = {}
+        self._remove()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach(name: str) -> Dict[str, np.array]:
+    """Read-only views on the arrays of a SharedPoints container, from its name (no copy)"""
+    return {
+        os.path.splitext(filename)[0]: np.load(os.path.join(name, filename), mmap_mode="r")
+        for filename in sorted(os.listdir(name))
+        if filename.endswith(".npy")
+    }
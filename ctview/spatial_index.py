@@ -0,0 +1,215 @@
+import json
+import logging as log
+import os
+from typing import Dict, List, Tuple
+
+import laspy
+import lazrs
+import numpy as np
+from laspy.vlrs.vlrlist import VLRList
+
+# Suffix of the sidecar index written next to each las/laz file
+INDEX_SUFFIX = ".ctindex.json"
+INDEX_VERSION = 1
+
+# Number of points per chunk for las files and laz files with variable size chunks (laszip default)
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def get_index_path(las_file: str) -> str:
+    return str(las_file) + INDEX_SUFFIX
+
+
+def get_chunk_size(las_file: str) -> int:
+    """Number of points per chunk of a laz file (so that the index chunks match the compressed chunks), or
+    DEFAULT_CHUNK_SIZE for las files and laz files with variable size chunks"""
+    with laspy.open(las_file) as reader:
+        laszip_vlrs = [vlr for vlr in reader.header.vlrs if isinstance(vlr, laspy.vlrs.known.LasZipVlr)]
+    if laszip_vlrs:
+        laz_vlr = lazrs.LazVlr(laszip_vlrs[0].record_data)
+        if not laz_vlr.uses_variable_size_chunks():
+            return laz_vlr.chunk_size()
+
+    return DEFAULT_CHUNK_SIZE
+
+
+def is_index_up_to_date(index: Dict, las_file: str) -> bool:
+    """Check that an index has been built from the current version of a las file (modification time and size)"""
+    stat = os.stat(las_file)
+    return (
+        index.get("version") == INDEX_VERSION
+        and index.get("mtime_ns") == stat.st_mtime_ns
+        and index.get("file_size") == stat.st_size
+    )
+
+
+def load_index(las_file: str) -> Dict | None:
+    """Sidecar index of a las file (cf. build_index), or None if it does not exist or if the file has been modified
+    since the index was built"""
+    index_path = get_index_path(las_file)
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    if not is_index_up_to_date(index, las_file):
+        log.debug(f"Index {index_path} ignored: {las_file} has been modified")
+        return None
+
+    return index
+
+
+def build_index(las_file: str, cell_size: float, chunk_size: int = None, force: bool = False) -> Dict:
+    """Build the sidecar index of a las file (written to <las_file>.ctindex.json): the points are split in chunks of
+    consecutive points, and each cell of a coarse grid lists the chunks that contain points in this cell.
+    The index is not built again if an up-to-date index with the same cell size and chunk size already exists
+    (unless force is True).
+
+    Args:
+        las_file (str): path to the las/laz file
+        cell_size (float): size of the grid cells (in meters)
+        chunk_size (int, optional): number of points per chunk. Defaults to None (chunk size of the laz file,
+        cf. get_chunk_size)
+        force (bool, optional): build the index even if it is up to date. Defaults to False.
+
+    Returns:
+        Dict: index, with the grid cells as a list of [column, row, chunk ids] (cell (column, row) covers
+        [column * cell_size, (column + 1) * cell_size[ x [row * cell_size, (row + 1) * cell_size[)
+    """
+    chunk_size = chunk_size or get_chunk_size(las_file)
+    index = load_index(las_file)
+    if not force and index is not None and (index["cell_size"], index["chunk_size"]) == (cell_size, chunk_size):
+        return index
+
+    log.info(f"Build index of {las_file}")
+    stat = os.stat(las_file)
+    cells = {}
+    chunks = []
+    with laspy.open(las_file) as reader:
+        point_count = reader.header.point_count
+        for chunk_id, points in enumerate(reader.chunk_iterator(chunk_size)):
+            chunks.append([chunk_id * chunk_size, len(points)])
+            columns = np.floor(np.asarray(points.x) / cell_size).astype(np.int64)
+            rows = np.floor(np.asarray(points.y) / cell_size).astype(np.int64)
+            for column, row in np.unique(np.vstack((columns, rows)).transpose(), axis=0).tolist():
+                cells.setdefault((column, row), []).append(chunk_id)
+
+    index = {
+        "version": INDEX_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "file_size": stat.st_size,
+        "point_count": point_count,
+        "cell_size": cell_size,
+        "chunk_size": chunk_size,
+        "chunks": chunks,
+        "cells": [[column, row, chunk_ids] for (column, row), chunk_ids in sorted(cells.items())],
+    }
+    with open(get_index_path(las_file), "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+def get_morton_codes(columns: np.array, rows: np.array) -> np.array:
+    """Position of cells along a Z-order (Morton) curve, by interleaving the bits of their column and row"""
+    columns = columns.astype(np.uint64)
+    rows = rows.astype(np.uint64)
+    codes = np.zeros(len(columns), dtype=np.uint64)
+    for bit in range(32):
+        codes |= ((columns >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        codes |= ((rows >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+
+    return codes
+
+
+def sort_las_points(input_file: str, output_file: str, cell_size: float):
+    """Write a copy of a las file with its points sorted by grid cell along a Z-order curve, so that each chunk of
+    the index covers a few neighbor cells (the chunks of a tile whose points are in acquisition order usually cover
+    the whole tile)
+
+    Args:
+        input_file (str): path to the input las/laz file
+        output_file (str): path to the output las/laz file
+        cell_size (float): size of the grid cells (in meters)
+    """
+    las = laspy.read(input_file)
+    columns = np.floor(np.asarray(las.x) / cell_size)
+    rows = np.floor(np.asarray(las.y) / cell_size)
+    codes = get_morton_codes(columns - np.min(columns, initial=np.inf), rows - np.min(rows, initial=np.inf))
+    las.points = las.points[np.argsort(codes, kind="stable")]
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    las.write(output_file)
+
+
+def get_chunks_in_bounds(index: Dict, bounds: Tuple[float, ...]) -> List[Tuple[int, int]]:
+    """Ranges of points (start, count) of the chunks that can contain points in bounds (xmin, ymin, xmax, ymax),
+    consecutive chunks being merged in a single range"""
+    xmin, ymin, xmax, ymax = bounds
+    cell_size = index["cell_size"]
+    chunk_ids = set()
+    for column, row, cell_chunk_ids in index["cells"]:
+        if (
+            column * cell_size <= xmax
+            and (column + 1) * cell_size >= xmin
+            and row * cell_size <= ymax
+            and (row + 1) * cell_size >= ymin
+        ):
+            chunk_ids.update(cell_chunk_ids)
+
+    ranges = []
+    for chunk_id in sorted(chunk_ids):
+        start, count = index["chunks"][chunk_id]
+        if ranges and ranges[-1][0] + ranges[-1][1] == start:
+            ranges[-1][1] += count
+        else:
+            ranges.append([start, count])
+
+    return [(start, count) for start, count in ranges]
+
+
+def read_chunks_in_bounds(las_file: str, bounds: Tuple[float, ...], index: Dict) -> laspy.LasData:
+    """Read the chunks of a las file that can contain points in bounds (xmin, ymin, xmax, ymax), according to its
+    index (cf. build_index), without decoding the other chunks. The points are not cropped to bounds."""
+    with laspy.open(las_file) as reader:
+        header = reader.header
+        records = []
+        for start, count in get_chunks_in_bounds(index, bounds):
+            reader.seek(start)
+            records.append(reader.read_points(count).array)
+
+    array = np.concatenate(records) if records else np.zeros(0, dtype=header.point_format.dtype())
+
+    return laspy.LasData(
+        header, laspy.ScaleAwarePointRecord(array, header.point_format, header.scales, header.offsets)
+    )
+
+
+def is_copc(las_file: str) -> bool:
+    """Check if a laz file is a COPC (Cloud Optimized Point Cloud) file: its first vlr is the COPC info vlr"""
+    with laspy.open(las_file) as reader:
+        return len(reader.header.vlrs) > 0 and isinstance(reader.header.vlrs[0], laspy.copc.CopcInfoVlr)
+
+
+def read_copc(las_file: str, bounds: Tuple[float, ...] = None, resolution: float = None) -> Tuple[laspy.LasData, int]:
+    """Read the points of a COPC file with an octree query: only the nodes that intersect bounds (xmin, ymin, xmax,
+    ymax), and whose level is needed for the given resolution, are decoded (the points are not cropped to bounds).
+
+    Args:
+        las_file (str): path to the COPC file
+        bounds (Tuple[float, ...], optional): bounds of the query. Defaults to None (whole file).
+        resolution (float, optional): point spacing needed (in meters), for low resolution previews. Defaults to
+        None (all the levels).
+
+    Returns:
+        Tuple[laspy.LasData, int]: points, and total number of points of the file
+    """
+    with laspy.CopcReader.open(las_file) as reader:
+        header = reader.header
+        query_bounds = None if bounds is None else laspy.copc.Bounds(np.array(bounds[:2]), np.array(bounds[2:]))
+        points = reader.query(bounds=query_bounds, resolution=resolution)
+    point_count = header.point_count
+    # the COPC vlrs describe the original file only
+    header.vlrs = VLRList(
+        vlr for vlr in header.vlrs if not isinstance(vlr, (laspy.copc.CopcInfoVlr, laspy.copc.CopcHierarchyVlr))
+    )
+
+    return laspy.LasData(header, points), point_count
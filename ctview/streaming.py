@@ -0,0 +1,213 @@
+import bisect
+import logging as log
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from omegaconf import DictConfig
+
+from ctview import (
+    block,
+    count_cube,
+    map_density,
+    multi_resolution,
+    utils_pdal,
+    utils_raster,
+)
+
+# Ways to read the points of a tile (cf. io.points_backend in configs/config_control.yaml)
+POINTS_BACKENDS = ["memory", "stream", "auto"]
+
+
+def get_points_backend(config_io: DictConfig) -> str:
+    """Backend used to read the points of a tile: "memory" (the buffered tile is loaded in memory), "stream"
+    (the points are read by chunks, cf. create_products_streaming) or "auto" (memory if the tile fits in
+    io.memory_budget, stream otherwise, cf. estimate.fit_tile_to_memory_budget)
+
+    Raises:
+        ValueError: if io.points_backend is not in POINTS_BACKENDS
+    """
+    backend = config_io.get("points_backend", "memory")
+    if backend not in POINTS_BACKENDS:
+        raise ValueError(f"io.points_backend should be one of {POINTS_BACKENDS}, got {backend} instead")
+
+    return backend
+
+
+def get_tile_and_neighbor_files(tile_filename: str, config_io: DictConfig) -> List[str]:
+    """Paths to the las file of a tile and of its existing neighbors in config_io.input_dir (found from the
+    filenames, cf. block.get_tiles_by_index)
+
+    Raises:
+        ValueError: if the tile is not in the tile grid of config_io.input_dir (cf. block.get_tile_index_of)
+    """
+    tile_width = config_io.tile_geometry.tile_width
+    tile_coord_scale = config_io.tile_geometry.tile_coord_scale
+    tiles_by_index = block.get_tiles_by_index(utils_pdal.list_tiles(config_io.input_dir), tile_width, tile_coord_scale)
+    tile_index = block.get_tile_index_of(tile_filename, tiles_by_index, tile_width, tile_coord_scale)
+
+    return [
+        os.path.join(config_io.input_dir, tiles_by_index[index])
+        for index in [tile_index] + block.get_neighbor_indices([tile_index])
+        if index in tiles_by_index
+    ]
+
+
+def accumulate_class_counts(
+    chunks: Iterable[Tuple[np.array, np.array]],
+    tile_origin: Tuple[int, int],
+    tile_width: int,
+    pixel_sizes: List[float],
+    workers: int = 1,
+) -> Tuple[Dict[float, np.array], List[int]]:
+    """Count the points of each class in each pixel of the grids of a tile (cf. multi_resolution.compute_class_counts)
+    chunk by chunk, so that only one chunk of points is in memory at a time. The counts of each pixel size are
+    accumulated in a single cube, with a layer for each class seen in the previous chunks.
+
+    Args:
+        chunks (Iterable[Tuple[np.array, np.array]]): coordinates (x, y, z) and classification of the points, by chunk
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tile_width (int): tile width (in meters)
+        pixel_sizes (List[float]): pixel sizes of the grids
+        workers (int, optional): number of threads used to count the points of a chunk. Defaults to 1.
+
+    Returns:
+        Tuple[Dict[float, np.array], List[int]]: points count with shape (len(classes), nb_pixels, nb_pixels) for
+        each pixel size, and classes of the points (sorted)
+    """
+    classes = []
+    counts_by_pixel_size = {
+        pixel_size: np.zeros((0, round(tile_width / pixel_size), round(tile_width / pixel_size)), dtype=np.uint32)
+        for pixel_size in pixel_sizes
+    }
+    for points, classifs in chunks:
+        new_classes = sorted(set(np.unique(classifs).tolist()) - set(classes))
+        if new_classes:
+            # insert an empty layer for each new class, so that the classes stay sorted
+            positions = [bisect.bisect(classes, c) for c in new_classes]
+            for pixel_size in pixel_sizes:
+                counts_by_pixel_size[pixel_size] = np.insert(counts_by_pixel_size[pixel_size], positions, 0, axis=0)
+            classes = sorted(classes + new_classes)
+
+        for pixel_size in pixel_sizes:
+            multi_resolution.compute_class_counts(
+                points,
+                classifs,
+                classes,
+                utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size),
+                tile_width,
+                pixel_size,
+                workers=workers,
+                out=counts_by_pixel_size[pixel_size],
+            )
+
+    return counts_by_pixel_size, classes
+
+
+def create_products_streaming(
+    tile_filename: str,
+    las_with_buffer: str,
+    tile_origin: Tuple[int, int],
+    tilename: str,
+    config: DictConfig,
+    stream_chunk_size: int = None,
+):
+    """Generate the density maps, class maps and class count cubes of a tile (as
+    main_ctview.create_products_from_points) with constant memory: the points of the tile and of its neighbors are
+    streamed by pdal (cf. utils_pdal.stream_points) by chunks of config.io.stream_chunk_size points, directly from
+    the input files, and counted per class on the grid of each product. The products are then rendered from these
+    counts.
+
+    Contrary to multi_resolution, each pixel size is counted on its own grid: the maps at all the pixel sizes are
+    the same as the ones computed in single resolution mode.
+
+    Args:
+        tile_filename (str): filename of the tile (in config.io.input_dir)
+        las_with_buffer (str): path to the las file of the tile with its buffer (used to compute the DSM for the
+        pretty class map)
+        tile_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tilename (str): tilename used to generate the output filenames
+        config (DictConfig): ctview hydra configuration (cf. configs/config_control.yaml)
+        stream_chunk_size (int, optional): number of points per chunk. Defaults to None (io.stream_chunk_size).
+    """
+    config_io = config.io
+    tile_width = config_io.tile_geometry.tile_width
+    density_pixel_sizes = count_cube.get_density_pixel_sizes(config)
+    class_pixel_sizes = count_cube.get_class_pixel_sizes(config)
+    pixel_sizes = sorted(set(density_pixel_sizes + class_pixel_sizes))
+    if density_pixel_sizes:
+        map_density.check_config_density(config.density)
+
+    # rasters extent, with a half pixel margin on the west and north edges (cf. utils_raster.is_in_raster_extent)
+    margin = max(pixel_sizes, default=0) / 2
+    bounds = (
+        tile_origin[0] - margin,
+        tile_origin[1] - tile_width,
+        tile_origin[0] + tile_width,
+        tile_origin[1] + margin,
+    )
+    las_files = get_tile_and_neighbor_files(tile_filename, config_io)
+    log.info(f"Stream the points of {len(las_files)} files in {bounds}")
+    counts_by_pixel_size, classes = accumulate_class_counts(
+        utils_pdal.stream_points(
+            las_files, bounds, stream_chunk_size or config_io.get("stream_chunk_size", utils_pdal.STREAM_CHUNK_SIZE)
+        ),
+        tile_origin,
+        tile_width,
+        pixel_sizes,
+        workers=config_io.get("workers", 1),
+    )
+
+    is_multi_resolution_density = bool(config.multi_resolution.density_pixel_sizes)
+    for pixel_size in density_pixel_sizes:
+        log.info(f"\nCreate density map at {pixel_size}m")
+        counts = counts_by_pixel_size[pixel_size]
+        layers = []
+        for keep_classes in config.density.keep_classes:
+            # an empty list of classes means all the points
+            class_indices = [classes.index(c) for c in keep_classes or classes if c in classes]
+            layers.append(counts[class_indices].sum(axis=0))
+        subdir = count_cube.get_product_subdir(config, pixel_size, is_multi_resolution_density)
+        output_tif = os.path.join(
+            config_io.output_dir, config.density.output_subdir, subdir, f"{tilename}_density{config_io.extension}"
+        )
+        os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+        multi_resolution.write_density_raster_from_counts(
+            np.array(layers),
+            output_tif,
+            utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size),
+            pixel_size,
+            config.density,
+            config_io,
+        )
+
+    is_multi_resolution_class = bool(config.multi_resolution.class_pixel_sizes)
+    save_count_cubes = bool(config.count_cube.output_subdir)
+    for pixel_size in class_pixel_sizes:
+        log.info(f"\nCreate class map at {pixel_size}m")
+        multi_resolution.create_class_rasters_from_counts(
+            counts_by_pixel_size[pixel_size],
+            classes,
+            las_with_buffer,
+            tilename,
+            utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size),
+            pixel_size,
+            config.class_map,
+            config_io,
+            subdir=count_cube.get_product_subdir(config, pixel_size, is_multi_resolution_class),
+            output_dxm_hillshade=(
+                count_cube.get_hillshade_path(config, pixel_size, tilename) if save_count_cubes else None
+            ),
+        )
+
+    if save_count_cubes:
+        for pixel_size in pixel_sizes:
+            count_cube.write_count_cube(
+                counts_by_pixel_size[pixel_size],
+                classes,
+                count_cube.get_count_cube_path(config, pixel_size, tilename),
+                utils_raster.compute_raster_origin(tile_origin, pixel_size=pixel_size),
+                pixel_size,
+                config_io.spatial_reference,
+            )
+        log.info(f"Saved class count cubes at pixel sizes {pixel_sizes}")
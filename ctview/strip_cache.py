@@ -0,0 +1,105 @@
+import hashlib
+import logging as log
+import os
+from collections import OrderedDict
+from typing import Tuple
+
+import laspy
+import numpy as np
+
+from ctview import utils_las
+
+
+def get_strip_mask(points: np.array, tile_bounds: Tuple[float, ...], buffer_size: float) -> np.array:
+    """Mask of the points of a tile that can be in the buffer of its neighbors: points at a distance lower than or
+    equal to buffer_size from the tile edges (or outside of the tile)
+
+    Args:
+        points (np.array): numpy array with the points of the tile (x, y, ...)
+        tile_bounds (Tuple[float, ...]): bounds of the tile (xmin, ymin, xmax, ymax)
+        buffer_size (float): buffer size (in meters)
+
+    Returns:
+        np.array: boolean mask of the points
+    """
+    xmin, ymin, xmax, ymax = tile_bounds
+    is_inside = (
+        (points[:, 0] > xmin + buffer_size)
+        & (points[:, 0] < xmax - buffer_size)
+        & (points[:, 1] > ymin + buffer_size)
+        & (points[:, 1] < ymax - buffer_size)
+    )
+
+    return ~is_inside
+
+
+class StripCache:
+    """LRU cache of the edge strips of the decoded tiles (cf. get_strip_mask), so that the buffer of the next tiles
+    can be built without decoding their neighbors again.
+
+    Strips are keyed by file, modification time and buffer size. The strips in memory are evicted (least recently
+    used first) when their total size exceeds memory_budget. If cache_dir is set, the strips are also written there
+    as uncompressed las files, and read back when they are no longer in memory.
+    """
+
+    def __init__(self, memory_budget: float, cache_dir: str = None):
+        """
+        Args:
+            memory_budget (float): maximum size of the strips kept in memory (in MB)
+            cache_dir (str, optional): directory where to write the strips. Defaults to None.
+        """
+        self.max_bytes = memory_budget * 1024**2
+        self.cache_dir = cache_dir
+        self.strips = OrderedDict()
+        self.nb_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(filename: str, buffer_size: float) -> Tuple[str, int, float]:
+        return (os.path.abspath(filename), os.stat(filename).st_mtime_ns, buffer_size)
+
+    def get_disk_path(self, key: Tuple[str, int, float]) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".las")
+
+    def get(self, filename: str, buffer_size: float) -> laspy.LasData | None:
+        """Edge strip of `filename` for a buffer of `buffer_size` meters, or None if it is not in the cache"""
+        key = self.get_key(filename, buffer_size)
+        if key in self.strips:
+            self.memory_hits += 1
+            self.strips.move_to_end(key)
+            return self.strips[key]
+
+        if self.cache_dir and os.path.isfile(self.get_disk_path(key)):
+            self.disk_hits += 1
+            strip = utils_las.read_las(self.get_disk_path(key))
+            self.add_to_memory(key, strip)
+            return strip
+
+        self.misses += 1
+        return None
+
+    def put(self, filename: str, buffer_size: float, strip: laspy.LasData):
+        """Add the edge strip of `filename` for a buffer of `buffer_size` meters to the cache"""
+        key = self.get_key(filename, buffer_size)
+        if self.cache_dir and not os.path.isfile(self.get_disk_path(key)):
+            strip.write(self.get_disk_path(key))
+        self.add_to_memory(key, strip)
+
+    def add_to_memory(self, key: Tuple[str, int, float], strip: laspy.LasData):
+        if key in self.strips:
+            self.nb_bytes -= self.strips.pop(key).points.array.nbytes
+        self.strips[key] = strip
+        self.nb_bytes += strip.points.array.nbytes
+        while self.nb_bytes > self.max_bytes and self.strips:
+            _, evicted = self.strips.popitem(last=False)
+            self.nb_bytes -= evicted.points.array.nbytes
+
+    def log_stats(self):
+        log.info(
+            f"Strip cache: {self.memory_hits} memory hits, {self.disk_hits} disk hits, {self.misses} misses "
+            f"({len(self.strips)} strips, {self.nb_bytes / 1024**2:.1f} MB in memory)"
+        )
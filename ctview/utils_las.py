@@ -0,0 +1,61 @@
+import logging as log
+import os
+import struct
+
+import laspy
+import numpy as np
+
+# Position of the "Point Data Record Length" field in the header of a las file
+POINT_RECORD_LENGTH_OFFSET = 105
+
+
+def read_las(las_file: str, mmap: bool = True) -> laspy.LasData:
+    """Read a las/laz file. The point records of an uncompressed las file are memory-mapped (read-only) instead
+    of being copied in memory: the dimensions stored as is in the records (eg. X, Y, Z, classification for point
+    formats >= 6) are views on the file, and the pages of the file are shared (in the page cache) by the processes
+    that read it. Compressed files are decoded in memory (cf. laspy.read).
+
+    Args:
+        las_file (str): path to the las/laz file
+        mmap (bool, optional): memory-map uncompressed las files. Defaults to True.
+
+    Returns:
+        laspy.LasData: points of the file (read-only if they are memory-mapped)
+    """
+    if not mmap:
+        return laspy.read(las_file)
+
+    with laspy.open(las_file) as reader:
+        header = reader.header
+    if header.are_points_compressed:
+        return laspy.read(las_file)
+
+    point_dtype = header.point_format.dtype()
+    if read_point_record_length(las_file) != point_dtype.itemsize:
+        # records with extra bytes or padding that the point format does not describe
+        log.debug(f"Record length of {las_file} does not match its point format: file not memory-mapped")
+        return laspy.read(las_file)
+    if header.offset_to_point_data + header.point_count * point_dtype.itemsize > os.path.getsize(las_file):
+        # truncated file: let laspy raise its usual error
+        return laspy.read(las_file)
+
+    # np.memmap does not support empty arrays
+    if header.point_count == 0:
+        array = np.zeros(0, dtype=point_dtype)
+    else:
+        array = np.memmap(
+            las_file, dtype=point_dtype, mode="r", offset=header.offset_to_point_data, shape=(header.point_count,)
+        )
+    log.debug(f"Memory-mapped {header.point_count} points of {las_file}")
+
+    return laspy.LasData(
+        header, laspy.ScaleAwarePointRecord(array, header.point_format, header.scales, header.offsets)
+    )
+
+
+def read_point_record_length(las_file: str) -> int:
+    """Size of the point records of a las file, as written in its header ("Point Data Record Length", at the same
+    position in all the las versions)"""
+    with open(las_file, "rb") as f:
+        f.seek(POINT_RECORD_LENGTH_OFFSET)
+        return struct.unpack("<H", f.read(2))[0]
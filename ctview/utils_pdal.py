@@ -1,5 +1,26 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+import laspy
+import numpy as np
 import pdal
 
+LAS_EXTENSIONS = (".las", ".laz")
+
+# Chunk size (number of points) used to stream the points in the exact mode of get_las_metadata
+STREAM_CHUNK_SIZE = 1_000_000
+
+# Geokeys that hold the EPSG code of the spatial reference (projected, then geographic)
+CRS_GEOKEYS = [3072, 2048]
+# Geokey value for a user-defined spatial reference (no EPSG code)
+USER_DEFINED_GEOKEY = 32767
+
+
+def list_tiles(input_dir: str) -> List[str]:
+    """List the las/laz files of a directory (sorted by name)"""
+    return sorted(f for f in os.listdir(input_dir) if f.lower().endswith(LAS_EXTENSIONS))
+
 
 def read_las_file(input_las: str):
     """Read a las file and put it in an array"""
@@ -15,11 +36,89 @@ def get_info_from_las(points):
     return pipeline.metadata
 
 
-def get_bounds_from_las(in_las: str):
-    """get bounds=([minx,maxx],[miny,maxy]) from las file"""
-    metadata = get_info_from_las(read_las_file(in_las))
-    xmin = metadata["metadata"]["filters.stats"]["bbox"]["native"]["bbox"]["minx"]
-    xmax = metadata["metadata"]["filters.stats"]["bbox"]["native"]["bbox"]["maxx"]
-    ymin = metadata["metadata"]["filters.stats"]["bbox"]["native"]["bbox"]["miny"]
-    ymax = metadata["metadata"]["filters.stats"]["bbox"]["native"]["bbox"]["maxy"]
+def stream_points(
+    las_files: List[str], bounds: Tuple[float, ...], chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[Tuple[np.array, np.array]]:
+    """Read the points of several las files in bounds (xmin, ymin, xmax, ymax) with pdal in streaming mode: each file
+    is read by a readers.las | filters.crop pipeline, by chunks of at most chunk_size points
+
+    Yields:
+        Tuple[np.array, np.array]: coordinates (x, y, z) and classification of the points of a chunk
+    """
+    xmin, ymin, xmax, ymax = bounds
+    for las_file in las_files:
+        pipeline = pdal.Reader.las(filename=las_file) | pdal.Filter.crop(bounds=f"([{xmin},{xmax}],[{ymin},{ymax}])")
+        for array in pipeline.iterator(chunk_size=chunk_size):
+            yield np.vstack((array["X"], array["Y"], array["Z"])).transpose(), array["Classification"]
+
+
+def get_crs_from_header(header: laspy.LasHeader) -> str | None:
+    """Spatial reference of a las file, read in its vlrs: WKT string (point formats 6 to 10) or "EPSG:<code>"
+    (geokeys), None if there is no spatial reference"""
+    for vlr in header.vlrs.get("WktCoordinateSystemVlr"):
+        return vlr.string
+    for vlr in header.vlrs.get("GeoKeyDirectoryVlr"):
+        for key_id in CRS_GEOKEYS:
+            for key in vlr.geo_keys:
+                if key.id == key_id and key.tiff_tag_location == 0 and key.value_offset != USER_DEFINED_GEOKEY:
+                    return f"EPSG:{key.value_offset}"
+
+    return None
+
+
+def get_las_metadata(in_las: str, exact: bool = False) -> Dict:
+    """Get the metadata of a las file from its header only, without reading the points.
+
+    Args:
+        in_las (str): path to the las/laz file
+        exact (bool, optional): compute the bounds from the points instead of the header (the points are streamed by
+        chunks, for files with wrong header bounds). Defaults to False.
+
+    Returns:
+        Dict: metadata with keys "bounds" (xmin, ymin, xmax, ymax), "point_count", "point_format" (id),
+        "point_size" (size of a point record in bytes, with the extra bytes) and "crs" (cf. get_crs_from_header)
+    """
+    with laspy.open(in_las) as reader:
+        header = reader.header
+        mins, maxs = header.mins[:2], header.maxs[:2]
+        if exact:
+            mins, maxs = np.full(2, np.inf), np.full(2, -np.inf)
+            for points in reader.chunk_iterator(STREAM_CHUNK_SIZE):
+                xy = np.vstack((points.x, points.y))
+                mins = np.minimum(mins, xy.min(axis=1, initial=np.inf))
+                maxs = np.maximum(maxs, xy.max(axis=1, initial=-np.inf))
+
+    return {
+        "bounds": (float(mins[0]), float(mins[1]), float(maxs[0]), float(maxs[1])),
+        "point_count": header.point_count,
+        "point_format": header.point_format.id,
+        "point_size": header.point_format.size,
+        "crs": get_crs_from_header(header),
+    }
+
+
+def get_bounds_from_las(in_las: str, exact: bool = False) -> Tuple[list, list]:
+    """get bounds=([minx,maxx],[miny,maxy]) from las file header (or from its points if exact is True, cf.
+    get_las_metadata)"""
+    xmin, ymin, xmax, ymax = get_las_metadata(in_las, exact)["bounds"]
     return ([xmin, xmax], [ymin, ymax])
+
+
+def get_tile_index(input_dir: str, workers: int = 1, exact: bool = False) -> Dict[str, Dict]:
+    """Scan the las/laz files of a directory concurrently and index their metadata (cf. get_las_metadata)
+
+    Args:
+        input_dir (str): directory of the las/laz files
+        workers (int, optional): number of files read at the same time. Defaults to 1.
+        exact (bool, optional): compute the bounds from the points (cf. get_las_metadata). Defaults to False.
+
+    Returns:
+        Dict[str, Dict]: metadata of each file, by filename (sorted by name)
+    """
+    filenames = list_tiles(input_dir)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        metadata = executor.map(
+            get_las_metadata, [os.path.join(input_dir, f) for f in filenames], [exact] * len(filenames)
+        )
+
+    return dict(zip(filenames, metadata))
@@ -1,10 +1,11 @@
 import logging as log
 from collections.abc import Iterable
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple
 
 import numpy as np
 import rasterio
 
+from ctview import aggregators, raster_writer
 from ctview.add_color import add_colors_as_metadata
 
 
@@ -14,12 +15,17 @@ def generate_raster_raw(
     output_tif: str,
     epsg: int | str,
     raster_origin: tuple,
-    fn: callable,
+    fn: Callable | str,
     classes_by_layer: list = [[]],
     tile_width: int = 1000,
     pixel_size: float = 1,
     no_data_value: int = -9999,
     raster_driver: str = "GTiff",
+    overview_resampling: str = "NEAREST",
+    output_dtype: str = "float32",
+    scale: float = 1,
+    input_dimensions: Dict[str, np.array] = {},
+    workers: int = 1,
 ):
     """Generate a (multilayer) raster of [something dependent of the function fn] for the classes in `class_by_layer`.
 
@@ -37,6 +43,9 @@ def generate_raster_raw(
         output_tif (str): path to the output file
         epsg (int): spatial reference of the output file
         raster_origin (tuple): origin of the output raster
+        fn (callable | str): either the name of a per-pixel aggregator (cf. ctview.aggregators, eg. "count",
+        "presence", "z_max"): all the layers are then computed from a single sort of the points by pixel,
+        or a function fn(points, origin, tile_width, pixel_size) that computes one layer from the points
         classes_by_layer (list, optional): _description_. Defaults to [[]].
         tile_width (int, optional): size ot the raster tile in meters. Defaults to 1000.
         pixel_size (float, optional): pixel size of the output raster. Defaults to 1.
@@ -45,6 +54,17 @@ def generate_raster_raw(
         no_data_value (int, optional): No data value of the output. Defaults to -9999.
         raster_driver (str): raster_driver (str): One of GDAL raster drivers formats
         (cf. https://gdal.org/drivers/raster/index.html#raster-drivers). Defaults to "GTiff"
+        overview_resampling (str, optional): resampling method used to build the internal overviews when
+        raster_driver is "COG" (cf. get_creation_options). Defaults to "NEAREST".
+        output_dtype (str, optional): data type of the output raster. For integer types, values are rounded and
+        saturated to the type range, and the maximum value of the type is used as no data value (instead of
+        no_data_value). Defaults to "float32".
+        scale (float, optional): scale factor stored in the output metadata (GDAL scale/offset) so that
+        the physical values read as stored_value * scale. Not stored when equal to 1. Defaults to 1.
+        input_dimensions (Dict[str, np.array], optional): additional point dimensions needed by the aggregator
+        `fn` (eg. {"intensity": ...}). Defaults to {}.
+        workers (int, optional): number of threads used to compute the layers when `fn` is the name of an
+        aggregator. Defaults to 1.
 
     Returns:
         rasters (np.array): multilayer raster
@@ -60,36 +80,111 @@ def generate_raster_raw(
             f"got {classes_by_layer} instead)"
         )
 
-    rasters = []
-    for classes in classes_by_layer:
-        if classes:
-            filtered_points = input_points[np.isin(input_classifs, classes), :]
-        else:
-            filtered_points = input_points
-
-        rasters.append(fn(filtered_points, raster_origin, tile_width, pixel_size))
-
-    rasters = np.array(rasters)
-    with rasterio.Env():
-        with rasterio.open(
-            output_tif,
-            "w",
-            driver=raster_driver,
-            height=rasters.shape[1],
-            width=rasters.shape[2],
-            count=rasters.shape[0],
-            dtype=rasterio.float32,
-            crs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
-            transform=rasterio.transform.from_origin(raster_origin[0], raster_origin[1], pixel_size, pixel_size),
-            nodata=no_data_value,
-        ) as out_file:
-            out_file.write(rasters.astype(rasterio.float32))
-
-    log.debug(f"Saved to {output_tif}")
+    if isinstance(fn, str):
+        rasters = aggregators.compute_aggregated_layers(
+            input_points,
+            input_classifs,
+            [(fn, classes) for classes in classes_by_layer],
+            raster_origin,
+            tile_width,
+            pixel_size,
+            input_dimensions=input_dimensions,
+            workers=workers,
+        )
+        rasters[np.isnan(rasters)] = no_data_value
+    else:
+        rasters = []
+        for classes in classes_by_layer:
+            if classes:
+                filtered_points = input_points[np.isin(input_classifs, classes), :]
+            else:
+                filtered_points = input_points
+
+            rasters.append(fn(filtered_points, raster_origin, tile_width, pixel_size))
+
+    rasters = write_multiband_raster_to_file(
+        np.array(rasters),
+        raster_origin,
+        output_tif,
+        pixel_size=pixel_size,
+        epsg=epsg,
+        no_data_value=no_data_value,
+        raster_driver=raster_driver,
+        overview_resampling=overview_resampling,
+        output_dtype=output_dtype,
+        scale=scale,
+    )
 
     return rasters
 
 
+def write_multiband_raster_to_file(
+    input_array: np.array,
+    raster_origin: tuple,
+    output_tif: str,
+    pixel_size: float = 1,
+    epsg: int | str = 2154,
+    no_data_value: int = -9999,
+    raster_driver: str = "GTiff",
+    overview_resampling: str = "NEAREST",
+    output_dtype: str = "float32",
+    scale: float = 1,
+) -> np.array:
+    """Write a 3D numpy array (layer, row, col) to a multiband raster file
+
+    Args:
+        input_array (np.array): 3D numpy array (raster data, one layer per band)
+        raster_origin (tuple): X, Y coordinates of the raster origin
+        output_tif (str): path to the output file
+        pixel_size (float, optional): pixel size of the data. Defaults to 1.
+        epsg (int | str, optional): Spatial reference of the output file. Defaults to 2154.
+        no_data_value (int, optional): No data value of the output. Defaults to -9999.
+        raster_driver (str, optional): One of GDAL raster drivers formats. Defaults to "GTiff".
+        overview_resampling (str, optional): resampling method used to build the internal overviews when
+        raster_driver is "COG" (cf. get_creation_options). Defaults to "NEAREST".
+        output_dtype (str, optional): data type of the output raster. For integer types, values are rounded and
+        saturated to the type range, and the maximum value of the type is used as no data value (instead of
+        no_data_value). Defaults to "float32".
+        scale (float, optional): scale factor stored in the output metadata (GDAL scale/offset) so that
+        the physical values read as stored_value * scale. Not stored when equal to 1. Defaults to 1.
+
+    Returns:
+        np.array: the data as written in the file (after saturation for integer types)
+    """
+    if np.issubdtype(np.dtype(output_dtype), np.integer):
+        # Saturate values instead of overflowing, the maximum value of the data type is kept for no data
+        dtype_info = np.iinfo(output_dtype)
+        no_data_value = dtype_info.max
+        input_array = np.clip(np.rint(input_array), dtype_info.min, dtype_info.max - 1)
+
+    def write():
+        with rasterio.Env():
+            with rasterio.open(
+                output_tif,
+                "w",
+                driver=raster_driver,
+                height=input_array.shape[1],
+                width=input_array.shape[2],
+                count=input_array.shape[0],
+                dtype=output_dtype,
+                crs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
+                transform=rasterio.transform.from_origin(raster_origin[0], raster_origin[1], pixel_size, pixel_size),
+                nodata=no_data_value,
+                **get_creation_options(raster_driver, overview_resampling),
+            ) as out_file:
+                out_file.write(input_array.astype(output_dtype))
+                if scale != 1:
+                    out_file.scales = [scale] * input_array.shape[0]
+                    out_file.offsets = [0] * input_array.shape[0]
+
+        log.debug(f"Saved to {output_tif}")
+
+    # compression and write in background when products are generated with a raster_writer.background_writer
+    raster_writer.write(output_tif, write)
+
+    return input_array
+
+
 def compute_raster_origin(pcd_origin: Tuple[int, int], pixel_size: int) -> Tuple[float, float]:
     """
     Compute the origin of the raster using the pointcloud origin (the top left of the top-left pixel)
@@ -101,6 +196,54 @@ def compute_raster_origin(pcd_origin: Tuple[int, int], pixel_size: int) -> Tuple
     return raster_origin
 
 
+def is_in_raster_extent(
+    points: np.array, pcd_origin: Tuple[int, int], tile_width: int, max_pixel_size: float
+) -> np.array:
+    """Mask of the points that can be binned in a raster of the tile (cf. compute_raster_origin) with a pixel size
+    lower than or equal to `max_pixel_size`: as the raster pixels are centered on the tile grid, the rasters
+    extend max_pixel_size / 2 beyond the tile on its left and top edges (the edges are included)
+
+    Args:
+        points (np.array): numpy array with the points (x, y, z)
+        pcd_origin (Tuple[int, int]): origin (top left corner) of the tile
+        tile_width (int): tile width (in meters)
+        max_pixel_size (float): largest pixel size of the rasters
+
+    Returns:
+        np.array: boolean mask of the points
+    """
+    pcd_origin_x, pcd_origin_y = pcd_origin
+    margin = max_pixel_size / 2
+
+    return (
+        (points[:, 0] >= pcd_origin_x - margin)
+        & (points[:, 0] <= pcd_origin_x + tile_width)
+        & (points[:, 1] >= pcd_origin_y - tile_width)
+        & (points[:, 1] <= pcd_origin_y + margin)
+    )
+
+
+def get_creation_options(raster_driver: str, overview_resampling: str = "NEAREST") -> Dict[str, str]:
+    """Get the creation options to use to write a raster with `raster_driver`.
+
+    When raster_driver is "COG" (Cloud Optimized GeoTiff), the internal overviews are computed in memory while the
+    output file is written (no separate gdaladdo pass is needed). `overview_resampling` should be:
+    - "NEAREST" for categorical data (eg. class maps)
+    - "AVERAGE" for continuous data (eg. density maps, hillshades)
+
+    Args:
+        raster_driver (str): One of GDAL raster drivers formats
+        overview_resampling (str, optional): resampling method used to compute the overviews. Defaults to "NEAREST".
+
+    Returns:
+        Dict[str, str]: creation options (empty for drivers other than "COG")
+    """
+    if raster_driver == "COG":
+        return {"RESAMPLING": overview_resampling}
+
+    return {}
+
+
 def write_single_band_raster_to_file(
     input_array: np.array,
     raster_origin: tuple,
@@ -109,6 +252,7 @@ def write_single_band_raster_to_file(
     epsg: int = 2154,
     raster_driver: str = "GTiff",
     colormap: List[Dict] = [],
+    overview_resampling: str = "NEAREST",
 ):
     """Write 2D numpy array of uint8 to a single band raster file (tiff file)
 
@@ -122,27 +266,35 @@ def write_single_band_raster_to_file(
         colormap (List[Dict], optional): Information about the raster values to add to the metadata. Defaults to [].
             List of dictionaries, the dict for each value is like
             {"value": 1, "description": "value_1", "color":[255, 128, 0]}  # rgb values
+        overview_resampling (str, optional): resampling method used to build the internal overviews when
+        raster_driver is "COG" (cf. get_creation_options). Defaults to "NEAREST".
     """
-    with rasterio.Env():
-        with rasterio.open(
-            output_tif,
-            "w",
-            driver=raster_driver,
-            height=input_array.shape[0],
-            width=input_array.shape[1],
-            count=1,
-            dtype=rasterio.uint8,
-            crs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
-            transform=rasterio.transform.from_origin(raster_origin[0], raster_origin[1], pixel_size, pixel_size),
-            nodata=0,  # Set to 0 as data are uint8
-        ) as out_file:
-            out_file.write(input_array.astype(rasterio.uint8), 1)
-
     if colormap:
         check_colormap_fits_raster_data(colormap, input_array)
-        add_colors_as_metadata(output_tif, colormap)
 
-    log.debug(f"Saved to {output_tif}")
+    def write():
+        with rasterio.Env():
+            with rasterio.open(
+                output_tif,
+                "w",
+                driver=raster_driver,
+                height=input_array.shape[0],
+                width=input_array.shape[1],
+                count=1,
+                dtype=rasterio.uint8,
+                crs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
+                transform=rasterio.transform.from_origin(raster_origin[0], raster_origin[1], pixel_size, pixel_size),
+                nodata=0,  # Set to 0 as data are uint8
+                **get_creation_options(raster_driver, overview_resampling),
+            ) as out_file:
+                out_file.write(input_array.astype(rasterio.uint8), 1)
+
+        if colormap:
+            add_colors_as_metadata(output_tif, colormap)
+
+        log.debug(f"Saved to {output_tif}")
+
+    raster_writer.write(output_tif, write)
 
 
 def check_colormap_fits_raster_data(colormap: List[Dict], data: np.array):
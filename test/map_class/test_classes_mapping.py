@@ -17,9 +17,12 @@ from ctview.map_class.classes_mapping import (
     apply_precedence_order,
     check_and_list_original_classes_to_keep,
     compute_binary_class,
+    compute_majority_class,
+    compute_majority_class_from_counts,
     convert_class_array_to_precedence_array,
 )
 from ctview.map_class.raster_generation import generate_class_raster_raw
+from ctview.multi_resolution import compute_class_counts
 
 gdal.UseExceptions()
 
@@ -184,3 +187,33 @@ def test_generate_class_raster_flatten():
             assert unique_band[0, 3] == 2
             assert unique_band[0, 9] == 0
             assert unique_band[8, 15] == 1
+
+
+def test_compute_majority_class():
+    points = np.array(
+        [[0.5, -0.5, 0], [0.5, -0.5, 0], [0.5, -0.5, 0], [1.5, -0.5, 0], [1.5, -0.5, 0], [0.5, -1.5, 0], [3, 3, 0]]
+    )
+    classifs = np.array([2, 2, 6, 2, 6, 65, 2])
+    # pixel (0, 0): 2 points of class 2 and 1 of class 6, pixel (0, 1): tie between 2 and 6, pixel (1, 0): class
+    # that is not in the priorities, last point: out of the tile
+    output = compute_majority_class(points, classifs, (0, 0), 2, 1, priorities=[6, 2])
+    assert np.array_equal(output, [[2, 6], [0, 0]])
+
+    output = compute_majority_class(points, classifs, (0, 0), 2, 1, priorities=[6, 2], weights={6: 2.5})
+    assert np.array_equal(output, [[6, 6], [0, 0]])
+
+
+def test_compute_majority_class_wrong_weights():
+    with pytest.raises(ValueError):
+        compute_majority_class(INPUT_POINTS, INPUT_CLASSIFS, RASTER_ORIGIN, 50, 1, [2, 1], weights={2: 0})
+
+
+def test_compute_majority_class_from_counts():
+    priorities = [66, 2, 1, 6]
+    weights = {66: 3}
+    classes = sorted(np.unique(INPUT_CLASSIFS).tolist())
+    counts = compute_class_counts(INPUT_POINTS, INPUT_CLASSIFS, classes, RASTER_ORIGIN, 50, 1)
+    expected = compute_majority_class(INPUT_POINTS, INPUT_CLASSIFS, RASTER_ORIGIN, 50, 1, priorities, weights)
+    output = compute_majority_class_from_counts(counts, classes, priorities, weights)
+    assert np.array_equal(output, expected)
+    assert set(np.unique(output)).issubset({0, 66, 2, 1})
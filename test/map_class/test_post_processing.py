@@ -7,8 +7,12 @@ import pytest
 from osgeo import gdal
 
 from ctview.map_class.post_processing import (
+    apply_by_blocks,
+    as_byte_array,
     choose_pixel_to_keep,
+    choose_pixel_to_keep_in_place,
     fill_nodata_in_array,
+    get_blocks,
     post_processing,
     smooth_class_array,
 )
@@ -146,6 +150,39 @@ def test_choose_pixel_to_keep():
     assert np.array_equal(result, expected_result)
 
 
+def test_fill_nodata_in_array_in_place():
+    input_array = np.array([[2, 2, 2], [2, 0, 2], [2, 2, 2]], dtype=np.uint8)
+
+    output_array = fill_nodata_in_array(input_array)
+    assert output_array is not input_array
+    assert input_array[1, 1] == 0  # input not modified
+    assert output_array[1, 1] == 2
+
+    output_array = fill_nodata_in_array(input_array, in_place=True)
+    assert output_array is input_array
+    assert input_array[1, 1] == 2
+
+
+def test_as_byte_array():
+    input_array = np.array([[2, 6], [1, 0]], dtype=np.uint8)
+    assert as_byte_array(input_array) is input_array
+
+    output_array = as_byte_array(np.array([[2, 6], [-9999, 300]], dtype=np.float64))
+    assert output_array.dtype == np.uint8
+    assert np.array_equal(output_array, [[2, 6], [0, 255]])
+
+    output_array = as_byte_array(np.zeros((4, 4), dtype=np.uint8)[:, :2])  # not contiguous
+    assert output_array.flags.c_contiguous
+
+
+def test_choose_pixel_to_keep_in_place():
+    class_map_raw = np.array([[1, 1, 5], [3, 4, 3], [2, 2, 3]], dtype=np.uint8)
+    class_map_smooth = np.array([[6, 2, 3], [3, 4, 3], [2, 2, 3]], dtype=np.uint8)
+    expected_result = choose_pixel_to_keep(class_map_raw, class_map_smooth)
+    choose_pixel_to_keep_in_place(class_map_raw, class_map_smooth)
+    assert np.array_equal(class_map_raw, expected_result)
+
+
 def test_post_processing():
     config_dict = {
         "fillnodata": {"apply": True, "max_distance": 2, "smoothing_iterations": 0},
@@ -157,8 +194,10 @@ def test_post_processing():
     ds = gdal.Open(input_file)
     driver = ds.GetDriver()
     input_array = np.array(ds.GetRasterBand(1).ReadAsArray())
+    input_array_copy = input_array.copy()
     output_array = post_processing(input_array=input_array, pp_config=config_dict)
 
+    assert np.array_equal(input_array, input_array_copy)  # input not modified
     assert not np.all(output_array == input_array)
     assert not np.all(output_array == 0)
     # Save output to visualize
@@ -170,3 +209,63 @@ def test_post_processing():
     outDs.SetGeoTransform(ds.GetGeoTransform())
     ds = None
     outDs = None
+
+
+def read_class_raw_array() -> np.array:
+    ds = gdal.Open(Path("data") / "raster" / "class_raw" / f"{TILENAME}.tif")
+    return np.array(ds.GetRasterBand(1).ReadAsArray())
+
+
+def generate_random_class_array(size: int = 200) -> np.array:
+    """Class array with many small polygons of ground, buildings, other classes and nodata, whose merge by the
+    sieve filter depends on the size of their neighbours"""
+    rng = np.random.default_rng(0)
+    class_array = rng.choice([0, 1, 2, 6, 65], p=[0.1, 0.1, 0.5, 0.2, 0.1], size=(size // 4, size // 4))
+    # blocks of 4x4 pixels, with a few isolated pixels
+    class_array = np.kron(class_array, np.ones((4, 4), dtype=np.uint8)).astype(np.uint8)
+    is_isolated = rng.random(class_array.shape) < 0.05
+    class_array[is_isolated] = rng.choice([0, 1, 2, 6, 65], size=np.count_nonzero(is_isolated))
+
+    return class_array
+
+
+def test_get_blocks():
+    assert get_blocks((5, 7), 4) == [(0, 4, 0, 4), (0, 4, 4, 7), (4, 5, 0, 4), (4, 5, 4, 7)]
+
+
+@pytest.mark.parametrize("block_size, workers", [(7, 1), (16, 3), (300, 2)])
+def test_apply_by_blocks(block_size, workers):
+    def max_filter(array):  # 3x3 max filter: output pixels depend on the input pixels at a distance of 1 pixel
+        padded = np.pad(array, 1, mode="edge")
+        rows, cols = array.shape
+        return np.max(
+            [np.roll(padded, (dr, dc), axis=(0, 1))[1:-1, 1:-1] for dr in range(-1, 2) for dc in range(-1, 2)], axis=0
+        )
+
+    input_array = np.random.default_rng(0).integers(0, 255, size=(50, 40))
+    output_array = apply_by_blocks(max_filter, input_array, block_size, halo=1, workers=workers)
+    assert np.array_equal(output_array, max_filter(input_array))
+
+
+@pytest.mark.parametrize(
+    "get_input_array, block_size",
+    [
+        (read_class_raw_array, 8),
+        (read_class_raw_array, 16),
+        (generate_random_class_array, 16),
+        (generate_random_class_array, 50),
+    ],
+)
+def test_post_processing_by_blocks(get_input_array, block_size):
+    config_dict = {
+        "fillnodata": {"apply": True, "max_distance": 2, "smoothing_iterations": 0},
+        "smoothing": {"apply": True, "nconnectedness": 4, "threshold": 12},
+    }
+    input_array = get_input_array()
+    expected_array = post_processing(input_array=input_array, pp_config=config_dict)
+    output_array = post_processing(
+        input_array=input_array, pp_config={**config_dict, "block_size": block_size}, workers=4
+    )
+
+    assert not np.array_equal(expected_array, as_byte_array(input_array))
+    assert np.array_equal(output_array, expected_array)
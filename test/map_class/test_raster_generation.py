@@ -10,7 +10,9 @@ from osgeo import gdal
 from pdaltools.las_info import get_tile_origin_using_header_info
 
 import ctview.utils_raster as utils_raster
+from ctview.map_class.classes_mapping import compute_majority_class
 from ctview.map_class.raster_generation import (
+    generate_class_raster,
     generate_class_raster_raw,
     generate_pretty_class_raster_from_single_band_raster,
 )
@@ -104,3 +106,29 @@ def test_generate_pretty_class_raster_from_single_band_raster():
         cfg.class_map,
         cfg.io,
     )
+
+
+def test_generate_class_raster_majority():
+    output_dir = os.path.join(OUTPUT_DIR, "generate_class_raster_majority")
+    with initialize(version_base="1.2", config_path="../../configs"):
+        cfg = compose(
+            config_name="config_control",
+            overrides=[
+                f"io.output_dir={output_dir}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                "class_map.pixel_size=1",
+                "class_map.mode=majority",
+                "+class_map.majority_weights={6: 2}",
+                "class_map.post_processing.fillnodata.apply=False",
+                "class_map.post_processing.smoothing.apply=False",
+            ],
+        )
+
+    output_tif = generate_class_raster(
+        INPUT_POINTS, INPUT_CLASSIFS, TILENAME, output_dir, cfg.class_map, cfg.io, cfg.io.tile_geometry, RASTER_ORIGIN
+    )
+    expected = compute_majority_class(
+        INPUT_POINTS, INPUT_CLASSIFS, RASTER_ORIGIN, TILE_WIDTH, 1, list(cfg.class_map.precedence_classes), {6: 2}
+    )
+    with rasterio.open(output_tif) as raster:
+        assert np.array_equal(raster.read(1), expected)
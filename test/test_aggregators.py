@@ -0,0 +1,162 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+import rasterio
+from pdaltools.las_info import get_tile_origin_using_header_info
+
+import ctview.aggregators as aggregators
+import ctview.map_density as map_density
+import ctview.utils_raster as utils_raster
+from ctview.map_class.classes_mapping import compute_binary_class
+
+OUTPUT_DIR = Path("tmp") / "aggregators"
+
+INPUT_LAS = Path("data") / "las" / "ground" / "test_data_77055_627755_LA93_IGN69.laz"
+TILE_WIDTH = 50
+PIXEL_SIZE = 2
+
+LAS = laspy.read(INPUT_LAS)
+INPUT_POINTS = np.vstack((LAS.x, LAS.y, LAS.z)).transpose()
+INPUT_CLASSIFS = np.copy(LAS.classification)
+TILE_ORIGIN = get_tile_origin_using_header_info(INPUT_LAS, tile_width=TILE_WIDTH)
+RASTER_ORIGIN = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size=PIXEL_SIZE)
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def test_compute_aggregated_layers_matches_histogram():
+    layers = aggregators.compute_aggregated_layers(
+        INPUT_POINTS,
+        INPUT_CLASSIFS,
+        [("density", []), ("count", [2]), ("presence", [2])],
+        RASTER_ORIGIN,
+        TILE_WIDTH,
+        PIXEL_SIZE,
+    )
+    assert layers.shape == (3, 25, 25)
+    assert np.array_equal(layers[0], map_density.compute_density(INPUT_POINTS, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE))
+    points_2 = INPUT_POINTS[INPUT_CLASSIFS == 2]
+    assert np.array_equal(layers[1], map_density.compute_count(points_2, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE))
+    assert np.array_equal(layers[2], compute_binary_class(points_2, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE))
+
+
+def test_compute_aggregated_layers_z_statistics():
+    points = np.array([[0.5, -0.5, 1], [0.5, -0.5, 3], [1.5, -0.5, 10], [0.5, -1.5, 4]])
+    classifs = np.array([2, 2, 2, 3])
+    layers = aggregators.compute_aggregated_layers(
+        points,
+        classifs,
+        [("z_min", []), ("z_max", []), ("z_mean", []), ("z_std", []), ("z_max", [3])],
+        (0, 0),
+        2,
+        1,
+    )
+    assert np.array_equal(layers[0], [[1, 10], [4, np.nan]], equal_nan=True)
+    assert np.array_equal(layers[1], [[3, 10], [4, np.nan]], equal_nan=True)
+    assert np.array_equal(layers[2], [[2, 10], [4, np.nan]], equal_nan=True)
+    assert np.array_equal(layers[3], [[1, 0], [0, np.nan]], equal_nan=True)
+    assert np.array_equal(layers[4], [[np.nan, np.nan], [4, np.nan]], equal_nan=True)
+
+
+def test_compute_aggregated_layers_extra_dimensions():
+    layers = aggregators.compute_aggregated_layers(
+        INPUT_POINTS,
+        INPUT_CLASSIFS,
+        [("return_number_histogram", []), ("intensity_mean", [])],
+        RASTER_ORIGIN,
+        TILE_WIDTH,
+        PIXEL_SIZE,
+        input_dimensions={"return_number": np.asarray(LAS.return_number), "intensity": np.asarray(LAS.intensity)},
+    )
+    assert layers.shape == (aggregators.RETURN_NUMBER_MAX + 1, 25, 25)
+    count = map_density.compute_count(INPUT_POINTS, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE)
+    assert np.array_equal(layers[:-1].sum(axis=0), count)
+    assert np.all(np.isnan(layers[-1]) == (count == 0))
+
+
+def test_compute_aggregated_layers_missing_dimension():
+    with pytest.raises(ValueError):
+        aggregators.compute_aggregated_layers(
+            INPUT_POINTS, INPUT_CLASSIFS, [("intensity_mean", [])], RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE
+        )
+
+
+def test_compute_aggregated_layers_unknown_aggregator():
+    with pytest.raises(ValueError):
+        aggregators.compute_aggregated_layers(
+            INPUT_POINTS, INPUT_CLASSIFS, [("unknown", [])], RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE
+        )
+
+
+def test_register_aggregator():
+    @aggregators.register_aggregator("test_z_range", dimensions=["z"], fill_value=np.nan)
+    def aggregate_z_range(values, starts, pixel_size):
+        return np.maximum.reduceat(values["z"], starts) - np.minimum.reduceat(values["z"], starts)
+
+    layers = aggregators.compute_aggregated_layers(
+        INPUT_POINTS,
+        INPUT_CLASSIFS,
+        [("test_z_range", []), ("z_min", []), ("z_max", [])],
+        RASTER_ORIGIN,
+        TILE_WIDTH,
+        PIXEL_SIZE,
+    )
+    assert np.array_equal(layers[0], layers[2] - layers[1], equal_nan=True)
+
+
+def test_generate_raster_raw_with_aggregator():
+    output_tif = OUTPUT_DIR / "z_max.tif"
+    utils_raster.generate_raster_raw(
+        input_points=INPUT_POINTS,
+        input_classifs=INPUT_CLASSIFS,
+        output_tif=output_tif,
+        epsg=2154,
+        raster_origin=RASTER_ORIGIN,
+        fn="z_max",
+        classes_by_layer=[[], [125]],
+        tile_width=TILE_WIDTH,
+        pixel_size=PIXEL_SIZE,
+        no_data_value=-9999,
+    )
+    with rasterio.open(output_tif) as raster:
+        assert raster.nodata == -9999
+        data = raster.read()
+        assert np.all(data[1] == -9999)  # no point with class 125
+        assert np.max(data[0]) == pytest.approx(np.max(INPUT_POINTS[:, 2]), abs=1e-4)
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_compute_aggregated_layers_workers(workers):
+    layers = [("count", []), ("presence", [2]), ("z_mean", []), ("z_std", [1, 2]), ("intensity_mean", [])]
+    input_dimensions = {"intensity": np.asarray(LAS.intensity)}
+    expected = aggregators.compute_aggregated_layers(
+        INPUT_POINTS, INPUT_CLASSIFS, layers, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE, input_dimensions
+    )
+    output = aggregators.compute_aggregated_layers(
+        INPUT_POINTS, INPUT_CLASSIFS, layers, RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE, input_dimensions, workers=workers
+    )
+    assert np.array_equal(output, expected, equal_nan=True)
+
+
+def test_compute_aggregated_layers_workers_more_than_points():
+    points = np.array([[0.5, -0.5, 1], [1.5, -1.5, 3]])
+    output = aggregators.compute_aggregated_layers(points, np.array([2, 2]), [("count", [])], (0, 0), 2, 1, workers=4)
+    assert np.array_equal(output, [[[1, 0], [0, 1]]])
+
+
+@pytest.mark.parametrize("workers", [0, 1.5])
+def test_compute_aggregated_layers_wrong_workers(workers):
+    with pytest.raises(ValueError):
+        aggregators.compute_aggregated_layers(
+            INPUT_POINTS, INPUT_CLASSIFS, [("count", [])], RASTER_ORIGIN, TILE_WIDTH, PIXEL_SIZE, workers=workers
+        )
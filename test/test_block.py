@@ -0,0 +1,228 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+import rasterio
+from hydra import compose, initialize
+from osgeo import gdal
+
+from ctview import block, shared_points, utils_pdal
+from ctview.main_block import main_block
+from ctview.main_ctview import main
+
+gdal.UseExceptions()
+
+OUTPUT_DIR = Path("tmp") / "block"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+BUFFER_SIZE = 10
+TILES_BY_INDEX = block.get_tiles_by_index(utils_pdal.list_tiles(INPUT_DIR), TILE_WIDTH, TILE_COORD_SCALE)
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def test_get_tiles_by_index():
+    assert TILES_BY_INDEX[(15411, 125552)] == "test_data_77055_627760_LA93_IGN69.laz"
+    assert len(TILES_BY_INDEX) == 6
+
+
+def test_get_tile_index_of():
+    filename = "test_data_77055_627760_LA93_IGN69.laz"
+    assert block.get_tile_index_of(filename, TILES_BY_INDEX, TILE_WIDTH, TILE_COORD_SCALE) == (15411, 125552)
+    with pytest.raises(ValueError, match="test_data_77100_627760_LA93_IGN69.laz"):
+        block.get_tile_index_of("test_data_77100_627760_LA93_IGN69.laz", TILES_BY_INDEX, TILE_WIDTH, TILE_COORD_SCALE)
+
+
+def test_group_tiles_by_block():
+    tile_indices = [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1), (3, 3)]
+    assert block.group_tiles_by_block(tile_indices, 2) == [
+        [(0, 0), (0, 1), (1, 0), (1, 1)],
+        [(2, 0), (2, 1)],
+        [(3, 3)],
+    ]
+    assert block.group_tiles_by_block(tile_indices, 1) == [[tile_index] for tile_index in sorted(tile_indices)]
+
+
+def test_get_hilbert_index():
+    nb_cells = 8
+    cells = {block.get_hilbert_index(x, y, nb_cells): (x, y) for x in range(nb_cells) for y in range(nb_cells)}
+    assert sorted(cells) == list(range(nb_cells**2))
+    # consecutive cells are adjacent
+    for ii in range(nb_cells**2 - 1):
+        assert np.abs(np.subtract(cells[ii], cells[ii + 1])).sum() == 1
+
+
+@pytest.mark.parametrize("order", block.BLOCK_ORDERS)
+def test_order_blocks(order):
+    blocks = block.group_tiles_by_block([(x, y) for x in range(10, 14) for y in range(20, 24)], 2)
+    ordered_blocks = block.order_blocks(blocks, 2, order)
+    assert sorted(ordered_blocks) == sorted(blocks)
+    if order != "lexicographic":
+        # consecutive blocks are adjacent
+        for block_1, block_2 in zip(ordered_blocks[:-1], ordered_blocks[1:]):
+            assert np.abs(np.subtract(block_1[0], block_2[0])).sum() == 2
+
+
+def test_get_neighbor_indices():
+    assert len(block.get_neighbor_indices([(0, 0)])) == 8
+    assert len(block.get_neighbor_indices([(0, 0), (0, 1), (1, 0), (1, 1)])) == 12
+
+
+def test_get_block_size():
+    tiles_metadata = list(utils_pdal.get_tile_index(INPUT_DIR).values())
+    assert block.get_block_size(tiles_metadata, 3, None, TILE_WIDTH, BUFFER_SIZE) == 3
+    assert block.get_block_size(tiles_metadata, 3, 1000, TILE_WIDTH, BUFFER_SIZE) == 3
+    # about 2MB per tile: 14MB for a 2x2 block, 24MB for a 3x3 block (with the buffer)
+    assert block.get_block_size(tiles_metadata, 3, 20, TILE_WIDTH, BUFFER_SIZE) == 2
+    assert block.get_block_size(tiles_metadata, 3, 1, TILE_WIDTH, BUFFER_SIZE) == 1
+
+
+def test_write_tile_with_buffer():
+    tiles = [(15410, 125551), (15411, 125551)]
+    block_points = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+    # the 2 tiles of the block and their 4 neighbors are decoded once
+    assert len(block_points.records) == 6
+
+    output_las = OUTPUT_DIR / "write_tile_with_buffer" / TILES_BY_INDEX[tiles[1]]
+    bounds = block.get_tile_bounds(tiles[1], TILE_WIDTH, BUFFER_SIZE)
+    block.write_tile_with_buffer(block_points, TILES_BY_INDEX[tiles[1]], bounds, str(output_las))
+    las = laspy.read(output_las)
+    assert len(las.points) == np.count_nonzero(block.is_in_bounds(block_points.points, bounds))
+    assert np.all(las.x >= bounds[0]) and np.all(las.x <= bounds[2])
+    assert np.all(las.y >= bounds[1]) and np.all(las.y <= bounds[3])
+
+
+def test_read_block_points_decode_workers():
+    tiles = [(15410, 125551), (15411, 125551)]
+    expected = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+    block_points = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE, decode_workers=3)
+    assert list(block_points.records) == list(expected.records)
+    assert np.array_equal(block_points.points, expected.points)
+    assert np.array_equal(block_points.classifs, expected.classifs)
+    assert block_points.nb_decoded_files == 6
+
+
+def test_read_block_points_shared():
+    tiles = [(15410, 125551), (15411, 125551)]
+    expected = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+    block_points = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE, shared=True)
+    with block_points.shared as shared:
+        # the block arrays are the shared arrays themselves
+        arrays = shared_points.attach(shared.name)
+        assert np.shares_memory(block_points.points, shared.arrays["points"])
+        assert np.array_equal(arrays["points"], expected.points)
+        assert np.array_equal(arrays["classifs"], expected.classifs)
+    assert not os.path.exists(shared.name)
+
+
+def test_read_block_points_with_metadata(caplog):
+    tiles = [(15410, 125551)]
+    expected = block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+    tiles_metadata = utils_pdal.get_tile_index(INPUT_DIR)
+    block_points = block.read_block_points(
+        tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE, tiles_metadata=tiles_metadata
+    )
+    assert np.array_equal(block_points.points, expected.points)
+
+    # a neighbor whose points are out of the buffer is not decoded
+    east_tile = TILES_BY_INDEX[(15411, 125551)]
+    tiles_metadata[east_tile]["bounds"] = (770580, 6277500, 770600, 6277550)
+    with caplog.at_level(logging.DEBUG):
+        block_points = block.read_block_points(
+            tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE, tiles_metadata=tiles_metadata
+        )
+    assert block_points.nb_decoded_files == expected.nb_decoded_files - 1
+    assert east_tile not in block_points.records
+    assert f"File {east_tile} skipped" in caplog.text
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_iter_block_points(prefetch):
+    blocks = block.group_tiles_by_block(list(TILES_BY_INDEX), 1)
+    read_blocks = []
+
+    def read_block(tiles):
+        read_blocks.append(tiles)
+        return block.read_block_points(tiles, TILES_BY_INDEX, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+
+    for ii, (tiles, block_points) in enumerate(block.iter_block_points(blocks, read_block, prefetch)):
+        assert tiles == blocks[ii]
+        # the block is read before it is processed, and at most `prefetch` blocks in advance
+        assert blocks[ii] in read_blocks
+        assert len(read_blocks) <= ii + 1 + prefetch
+        assert TILES_BY_INDEX[tiles[0]] in block_points.records
+    assert read_blocks == blocks
+
+
+def get_config(output_dir: Path, overrides: list = []):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_dir={INPUT_DIR}",
+                f"io.output_dir={output_dir}",
+                f"io.tile_geometry.tile_coord_scale={TILE_COORD_SCALE}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                f"buffer.size={BUFFER_SIZE}",
+                "density.pixel_size=2",
+                "density.colorize=False",
+                "class_map.output_class_subdir=CLASS",
+            ]
+            + overrides,
+        )
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        ["block.size=1"],
+        ["block.size=2"],
+        ["block.size=1", "block.order=serpentine", "block.strip_cache_budget=100", "block.workers=2"],
+        ["block.size=1", "block.prefetch=0"],
+        ["block.size=2", "block.tile_workers=2"],
+        ["block.size=2", "block.tile_workers=2", "io.memory_budget=1"],
+    ],
+)
+def test_main_block(overrides):
+    # "=" is not allowed in the hydra override of io.output_dir
+    output_dir = OUTPUT_DIR / ("main_block_" + "_".join(o.split(".")[-1].replace("=", "-") for o in overrides))
+    main_block(get_config(output_dir, overrides))
+
+    # Same products as the ones computed tile by tile
+    for filename in TILES_BY_INDEX.values():
+        tilename = os.path.splitext(filename)[0]
+        tile_output_dir = OUTPUT_DIR / "main_ctview" / tilename
+        main(get_config(tile_output_dir, [f"io.input_filename={filename}"]))
+        for product in [Path("DENS_FINAL") / f"{tilename}_density.tif", Path("CLASS") / f"{tilename}_class.tif"]:
+            with rasterio.open(tile_output_dir / product) as expected, rasterio.open(output_dir / product) as raster:
+                assert raster.transform == expected.transform
+                assert np.array_equal(raster.read(), expected.read())
+        assert (output_dir / "CLASS_FINAL" / f"{tilename}.tif").is_file()
+
+
+@pytest.mark.parametrize(
+    "override",
+    [
+        "block.size=0",
+        "block.workers=0",
+        "block.decode_workers=0",
+        "block.tile_workers=0",
+        "block.prefetch=-1",
+        "block.order=random",
+    ],
+)
+def test_check_config_block(override):
+    with pytest.raises(ValueError):
+        block.check_config_block(get_config(OUTPUT_DIR, [override]).block)
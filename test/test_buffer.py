@@ -0,0 +1,125 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from hydra import compose, initialize
+from osgeo import gdal
+
+from ctview import buffer
+from ctview.main_ctview import main
+
+gdal.UseExceptions()
+
+OUTPUT_DIR = Path("tmp") / "buffer"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+# tile with neighbors on its west, east and north edges
+INPUT_FILENAME = "test_data_77055_627755_LA93_IGN69.laz"
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def get_config(overrides: list, buffer_size="100"):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(config_name="config_control", overrides=[f"buffer.size={buffer_size}"] + overrides)
+
+
+@pytest.mark.parametrize(
+    "overrides, expected_needs_dxm, expected_buffer_size",
+    [
+        # pretty class map: DSM hillshade
+        (["density.pixel_size=5", "class_map.pixel_size=0.5"], True, 100),
+        # no DXM stage: the given buffer size is kept
+        (["density.pixel_size=5", "class_map.output_class_pretty_subdir=null"], False, 100),
+        (["density.output_subdir=null", "class_map.output_class_pretty_subdir=null"], False, 100),
+        (
+            [
+                "density.output_subdir=null",
+                "class_map.output_class_subdir=CLASS",
+                "class_map.output_class_pretty_subdir=null",
+                "class_map.pixel_size=0.5",
+                "multi_resolution.class_pixel_sizes=[0.5, 2.5]",
+            ],
+            False,
+            100,
+        ),
+    ],
+)
+def test_get_buffer_size(overrides, expected_needs_dxm, expected_buffer_size):
+    config = get_config(overrides)
+    assert buffer.needs_dxm(config) == expected_needs_dxm
+    assert buffer.get_buffer_size(config) == expected_buffer_size
+
+
+def test_get_buffer_size_smaller_than_binning_margin():
+    # half of the largest pixel size is needed to bin the points
+    config = get_config(["density.pixel_size=5", "class_map.output_class_pretty_subdir=null"], buffer_size="1")
+    assert buffer.get_buffer_size(config) == 2.5
+
+
+@pytest.mark.parametrize(
+    "overrides, expected_buffer_size",
+    [
+        # DSM at 0.5m: interpolation and hillshade margins
+        (["density.pixel_size=5", "class_map.pixel_size=0.5"], 0.5 * 9),
+        # DSM at 2m
+        (["density.pixel_size=5", "class_map.pixel_size=2"], 2 * 9),
+        # no DXM stage: half of the largest pixel size
+        (["density.pixel_size=5", "class_map.output_class_pretty_subdir=null"], 2.5),
+        (
+            [
+                "density.output_subdir=null",
+                "class_map.output_class_subdir=CLASS",
+                "class_map.output_class_pretty_subdir=null",
+                "class_map.pixel_size=0.5",
+                "multi_resolution.class_pixel_sizes=[0.5, 2.5]",
+            ],
+            1.25,
+        ),
+    ],
+)
+def test_get_buffer_size_auto(overrides, expected_buffer_size):
+    assert buffer.get_buffer_size(get_config(overrides, buffer_size="auto")) == expected_buffer_size
+
+
+@pytest.mark.parametrize("buffer_size", ["-1", "wrong", "true"])
+def test_get_buffer_size_wrong_value(buffer_size):
+    with pytest.raises(ValueError):
+        buffer.get_buffer_size(get_config([], buffer_size=buffer_size))
+
+
+def test_auto_buffer_pretty_class_map_at_tile_edges():
+    # the gaps between the DSM points of the test data are less than 16m wide: the automatic buffer (9 DSM pixels
+    # of 2m) is large enough to interpolate the DSM on the tile edges
+    tilename = os.path.splitext(INPUT_FILENAME)[0]
+    for buffer_size in ["auto", "50"]:
+        main(
+            get_config(
+                [
+                    f"io.input_filename={INPUT_FILENAME}",
+                    f"io.input_dir={INPUT_DIR}",
+                    f"io.output_dir={OUTPUT_DIR / buffer_size}",
+                    "io.tile_geometry.tile_coord_scale=10",
+                    "io.tile_geometry.tile_width=50",
+                    "density.output_subdir=null",
+                    "class_map.pixel_size=2",
+                ],
+                buffer_size=buffer_size,
+            )
+        )
+
+    # same pretty class map as with the whole neighbor tiles (50m buffer), on the tile edges too
+    with rasterio.open(OUTPUT_DIR / "50" / "CLASS_FINAL" / f"{tilename}.tif") as expected, rasterio.open(
+        OUTPUT_DIR / "auto" / "CLASS_FINAL" / f"{tilename}.tif"
+    ) as raster:
+        assert raster.transform == expected.transform
+        assert np.array_equal(raster.read(), expected.read())
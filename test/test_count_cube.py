@@ -0,0 +1,103 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import rasterio
+from hydra import compose, initialize
+from osgeo import gdal
+from pdaltools.las_info import get_tile_origin_using_header_info
+
+import ctview.count_cube as count_cube
+import ctview.multi_resolution as multi_resolution
+import ctview.utils_raster as utils_raster
+from ctview.main_ctview import main
+from ctview.main_rerender import main_rerender
+
+gdal.UseExceptions()
+
+OUTPUT_DIR = Path("tmp") / "count_cube"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+INPUT_FILENAME = "test_data_77055_627755_LA93_IGN69.laz"
+INPUT_LAS = INPUT_DIR / INPUT_FILENAME
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+
+LAS = laspy.read(INPUT_LAS)
+INPUT_POINTS = np.vstack((LAS.x, LAS.y, LAS.z)).transpose()
+INPUT_CLASSIFS = np.copy(LAS.classification)
+TILE_ORIGIN = get_tile_origin_using_header_info(INPUT_LAS, tile_width=TILE_WIDTH)
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def test_write_and_read_count_cube():
+    pixel_size = 2
+    output_tif = OUTPUT_DIR / "write_and_read" / "counts.tif"
+    classes = sorted(np.unique(INPUT_CLASSIFS).tolist())
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    counts = multi_resolution.compute_class_counts(
+        INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size
+    )
+    count_cube.write_count_cube(counts, classes, output_tif, raster_origin, pixel_size, 2154)
+
+    with rasterio.open(output_tif) as raster:
+        assert raster.profile["compress"] == "deflate"
+        assert raster.profile["tiled"]
+
+    read_counts, read_classes, read_origin, read_pixel_size = count_cube.read_count_cube(output_tif)
+    assert read_classes == classes
+    assert np.array_equal(read_counts, counts)
+    assert read_origin == raster_origin
+    assert read_pixel_size == pixel_size
+
+
+def get_config(output_dir: Path, overrides: list = []):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_filename={INPUT_FILENAME}",
+                f"io.input_dir={INPUT_DIR}",
+                f"io.output_dir={output_dir}",
+                f"io.tile_geometry.tile_coord_scale={TILE_COORD_SCALE}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                "buffer.size=10",
+                "density.pixel_size=2",
+                "density.colorize=False",
+                "class_map.output_class_subdir=CLASS",
+                "count_cube.output_subdir=COUNTS",
+            ]
+            + overrides,
+        )
+
+
+def test_rerender_from_count_cubes():
+    output_dir = OUTPUT_DIR / "rerender"
+    tilename = os.path.splitext(INPUT_FILENAME)[0]
+    main(get_config(output_dir))
+    assert (output_dir / "COUNTS" / "2m" / f"{tilename}_counts.tif").is_file()
+    assert (output_dir / "COUNTS" / "0.5m" / f"{tilename}_counts.tif").is_file()
+    assert (output_dir / "COUNTS" / "0.5m" / f"{tilename}_dsm_hillshade.tif").is_file()
+
+    # Re-render the same products in another directory: they must be the same as the ones computed from the points
+    rerender_dir = OUTPUT_DIR / "rerender_copy"
+    shutil.copytree(output_dir / "COUNTS", rerender_dir / "COUNTS")
+    main_rerender(get_config(rerender_dir))
+    for product in [Path("DENS_FINAL") / f"{tilename}_density.tif", Path("CLASS") / f"{tilename}_class.tif"]:
+        with rasterio.open(output_dir / product) as expected, rasterio.open(rerender_dir / product) as raster:
+            assert np.array_equal(raster.read(), expected.read())
+    assert (rerender_dir / "CLASS_FINAL" / f"{tilename}.tif").is_file()
+
+    # Re-render with another configuration
+    main_rerender(get_config(rerender_dir, ["density.keep_classes=[[2], []]"]))
+    with rasterio.open(rerender_dir / "DENS_FINAL" / f"{tilename}_density.tif") as raster:
+        assert raster.count == 2
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+from hydra import compose, initialize
+
+from ctview import block, estimate, utils_pdal
+
+INPUT_DIR = Path("data") / "las" / "ground"
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+BUFFER_SIZE = 10
+TILES_BY_INDEX = block.get_tiles_by_index(utils_pdal.list_tiles(INPUT_DIR), TILE_WIDTH, TILE_COORD_SCALE)
+TILE_INDEX = (15411, 125551)
+
+
+def get_config(overrides: list = []):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_dir={INPUT_DIR}",
+                f"io.tile_geometry.tile_coord_scale={TILE_COORD_SCALE}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                f"buffer.size={BUFFER_SIZE}",
+                "density.pixel_size=2",
+            ]
+            + overrides,
+        )
+
+
+def test_get_overlap_share():
+    assert estimate.get_overlap_share((0, 0, 10, 10), (5, 0, 20, 10)) == 0.5
+    assert estimate.get_overlap_share((0, 0, 10, 10), (-5, -5, 20, 20)) == 1
+    assert estimate.get_overlap_share((0, 0, 10, 10), (11, 0, 20, 10)) == 0
+
+
+def test_get_tile_point_count():
+    tiles_metadata = utils_pdal.get_tile_index(INPUT_DIR)
+    point_count, point_size = estimate.get_tile_point_count(
+        TILE_INDEX, TILES_BY_INDEX, tiles_metadata, TILE_WIDTH, BUFFER_SIZE
+    )
+    assert point_count == estimate.read_tile_point_count(TILES_BY_INDEX[TILE_INDEX], BUFFER_SIZE, get_config().io)[0]
+
+    # close to the number of points in the buffered tile
+    bounds = block.get_tile_bounds(TILE_INDEX, TILE_WIDTH, BUFFER_SIZE)
+    nb_points = 0
+    for filename in TILES_BY_INDEX.values():
+        las = laspy.read(INPUT_DIR / filename)
+        nb_points += np.count_nonzero(block.is_in_bounds(np.vstack((las.x, las.y)).transpose(), bounds))
+        assert point_size == las.header.point_format.size
+    assert point_count == pytest.approx(nb_points, rel=0.2)
+
+    with pytest.raises(ValueError):
+        estimate.read_tile_point_count("test_data_77100_627760_LA93_IGN69.laz", BUFFER_SIZE, get_config().io)
+
+
+def test_estimate_tile_memory():
+    config = get_config()
+    memory = estimate.estimate_tile_memory(1e6, 30, config)
+    assert memory["total"] == pytest.approx(memory["points"] + memory["rasters"] + memory["dxm"])
+    assert memory["dxm"] > 0  # the pretty class map needs the DSM
+    # the points of a chunk only in stream mode
+    assert estimate.estimate_tile_memory(1e6, 30, config, True, 1000)["points"] < memory["points"] / 100
+    # no DXM and fewer rasters when the pretty class map is disabled
+    config_density = get_config(["class_map.output_class_pretty_subdir=null"])
+    memory_density = estimate.estimate_tile_memory(1e6, 30, config_density)
+    assert memory_density["dxm"] == 0
+    assert memory_density["rasters"] < memory["rasters"]
+
+
+@pytest.mark.parametrize(
+    "overrides, expected_backend",
+    [
+        (["io.points_backend=auto", "io.memory_budget=1000"], "memory"),
+        (["io.points_backend=auto", "io.memory_budget=100"], "stream"),
+        (["io.points_backend=auto"], "memory"),
+        (["io.points_backend=stream", "io.memory_budget=50"], "stream"),
+        (["io.points_backend=memory", "io.memory_budget=1"], "memory"),
+    ],
+)
+def test_fit_tile_to_memory_budget(overrides, expected_backend):
+    # pretty class map disabled: no DXM
+    config = get_config(
+        ["class_map.output_class_pretty_subdir=null", "class_map.output_class_subdir=CLASS"] + overrides
+    )
+    point_count, point_size = 5e6, 30
+    backend, chunk_size = estimate.fit_tile_to_memory_budget(point_count, point_size, config)
+    assert backend == expected_backend
+    if backend == "stream":
+        assert chunk_size <= config.io.stream_chunk_size
+        memory = estimate.estimate_tile_memory(point_count, point_size, config, True, chunk_size)
+        assert memory["total"] <= config.io.memory_budget
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import pytest
+from hydra import compose, initialize
+
+from ctview import estimate, utils_pdal
+from ctview.main_estimate import main_estimate
+
+INPUT_DIR = Path("data") / "las" / "ground"
+OUTPUT_DIR = Path("tmp") / "main_estimate"
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def get_config(overrides: list = []):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_dir={INPUT_DIR}",
+                "io.tile_geometry.tile_coord_scale=10",
+                "io.tile_geometry.tile_width=50",
+                "buffer.size=10",
+                "density.pixel_size=2",
+            ]
+            + overrides,
+        )
+
+
+def test_main_estimate(monkeypatch):
+    # only the headers are read
+    monkeypatch.setattr(laspy, "read", lambda *args, **kwargs: pytest.fail("points decoded"))
+    output_file = OUTPUT_DIR / "report.json"
+    config = get_config(["estimate.nb_outliers=2", f"estimate.output_file={output_file}"])
+    report = main_estimate(config)
+
+    filenames = utils_pdal.list_tiles(INPUT_DIR)
+    assert report["nb_tiles"] == len(filenames)
+    expected_point_count = 0
+    for filename in filenames:
+        with laspy.open(INPUT_DIR / filename) as reader:
+            expected_point_count += reader.header.point_count
+    assert report["point_count"] == expected_point_count
+    assert report["cpu_hours"] == pytest.approx(sum(report["cpu_hours_by_stage"].values()))
+    assert report["cpu_hours_by_stage"]["dxm"] > 0
+    assert report["default_cost_model"]
+    assert report["peak_memory_mb"] >= report["median_memory_mb"] > 0
+    assert report["output_size_gb"] == pytest.approx(
+        len(filenames) * estimate.estimate_output_size(config) / 1024**3
+    )
+
+    # the most expensive tiles first
+    assert len(report["outliers"]) == 2
+    assert report["outliers"][0]["cpu_seconds"] >= report["outliers"][1]["cpu_seconds"]
+
+    with open(output_file) as f:
+        written_report = json.load(f)
+    assert len(written_report["tiles"]) == len(filenames)
+    assert max(tile["cpu_seconds"] for tile in written_report["tiles"]) == report["outliers"][0]["cpu_seconds"]
+
+
+def test_estimate_output_size():
+    config = get_config(["class_map.output_class_subdir=CLASS"])
+    # density (RGB at 2m), class map (1 band) and pretty class map (RGB) at 0.5m
+    assert estimate.estimate_output_size(config) == 26**2 * 3 + 101**2 * (1 + 3)
+    config_cubes = get_config(["class_map.output_class_subdir=CLASS", "count_cube.output_subdir=COUNTS"])
+    assert estimate.estimate_output_size(config_cubes) > estimate.estimate_output_size(config)
+    config_cog = get_config(["class_map.output_class_subdir=CLASS", "estimate.compression_ratio=0.5"])
+    assert estimate.estimate_output_size(config_cog) == estimate.estimate_output_size(config) / 2
+
+
+def test_main_estimate_cost_model():
+    overrides = ["estimate.cost_model.per_pixel=0", "count_cube.output_subdir=COUNTS"]
+    report = main_estimate(get_config(overrides + ["estimate.cost_model.dxm_per_point=2.0e-6"]))
+    assert not report["default_cost_model"]
+    assert report["cost_model"]["dxm_per_point"] == 2.0e-6
+    default_report = main_estimate(get_config(overrides))
+    assert report["cpu_hours_by_stage"]["dxm"] == pytest.approx(2 * default_report["cpu_hours_by_stage"]["dxm"])
+    # the count cubes have their own coefficient
+    assert report["cpu_hours_by_stage"]["count_cube"] > 0
+    report = main_estimate(get_config(overrides + ["estimate.cost_model.count_cube_per_point=0"]))
+    assert report["cpu_hours_by_stage"]["count_cube"] == 0
+    assert report["cpu_hours_by_stage"]["density"] == default_report["cpu_hours_by_stage"]["density"]
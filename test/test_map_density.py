@@ -66,6 +66,49 @@ def test_generate_raster_of_density():
         assert band1[6, 0] == 0
 
 
+def test_generate_raster_of_density_uint16():
+    output_tif = Path(OUTPUT_DIR) / "output_generate_raster_of_density_uint16.tif"
+    map_density.generate_raster_of_density(
+        input_points=INPUT_POINTS,
+        input_classifs=INPUT_CLASSIFS,
+        output_tif=output_tif,
+        epsg=EPSG,
+        raster_origin=RASTER_ORIGIN,
+        tile_width=50,
+        pixel_size=2,
+        raster_driver="GTiff",
+        output_dtype="uint16",
+    )
+    with rasterio.open(output_tif) as raster:
+        assert raster.dtypes[0] == "uint16"
+        assert raster.nodata == 65535
+        assert raster.scales[0] == 1 / 2**2
+        band1 = raster.read(1)
+        assert band1[0, 0] == 28  # point count
+        assert band1[0, 0] * raster.scales[0] == 28 / 2**2  # density = nb_pt / pixel_size **2 = 28/2**2
+        assert band1[6, 0] == 0
+
+
+def test_generate_raster_of_density_uint8_saturation():
+    output_tif = Path(OUTPUT_DIR) / "output_generate_raster_of_density_uint8.tif"
+    # 300 points in the top left pixel
+    input_points = np.tile([[RASTER_ORIGIN[0] + 1.5, RASTER_ORIGIN[1] - 1.5, 0]], (300, 1))
+    map_density.generate_raster_of_density(
+        input_points=input_points,
+        input_classifs=np.ones(300),
+        output_tif=output_tif,
+        epsg=EPSG,
+        raster_origin=RASTER_ORIGIN,
+        tile_width=50,
+        pixel_size=2,
+        output_dtype="uint8",
+    )
+    with rasterio.open(output_tif) as raster:
+        band1 = raster.read(1)
+        assert band1[0, 0] == 254  # saturated, 255 is the no data value
+        assert band1[1, 1] == 0
+
+
 def test_generate_raster_of_density_multiband():
     output_raster_multi = Path(OUTPUT_DIR) / "multiband_raster.tif"
     map_density.generate_raster_of_density(
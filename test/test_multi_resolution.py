@@ -0,0 +1,207 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+import rasterio
+from hydra import compose, initialize
+from osgeo import gdal
+from pdaltools.las_info import get_tile_origin_using_header_info
+
+import ctview.map_class.classes_mapping as classes_mapping
+import ctview.map_density as map_density
+import ctview.multi_resolution as multi_resolution
+import ctview.utils_raster as utils_raster
+from ctview.main_ctview import main
+
+gdal.UseExceptions()
+
+OUTPUT_DIR = Path("tmp") / "multi_resolution"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+INPUT_FILENAME = "test_data_77055_627755_LA93_IGN69.laz"
+INPUT_LAS = INPUT_DIR / INPUT_FILENAME
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+
+LAS = laspy.read(INPUT_LAS)
+INPUT_POINTS = np.vstack((LAS.x, LAS.y, LAS.z)).transpose()
+INPUT_CLASSIFS = np.copy(LAS.classification)
+TILE_ORIGIN = get_tile_origin_using_header_info(INPUT_LAS, tile_width=TILE_WIDTH)
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+@pytest.mark.parametrize(
+    "base_pixel_size, pixel_size, expected",
+    [
+        (1, 1, 1),
+        (1, 5, 5),
+        (0.5, 2.5, 5),
+        (0.5, 1, None),  # even factor: pixel edges do not match due to the half pixel shift of the origins
+        (2, 5, None),  # not a multiple
+        (1, 3, None),  # tile width is not a multiple of the pixel size
+    ],
+)
+def test_get_nesting_factor(base_pixel_size, pixel_size, expected):
+    assert multi_resolution.get_nesting_factor(base_pixel_size, pixel_size, TILE_WIDTH) == expected
+
+
+def test_group_pixel_sizes_by_base_grid():
+    groups = multi_resolution.group_pixel_sizes_by_base_grid([5, 1, 0.5, 2.5, 1], TILE_WIDTH)
+    assert groups == {0.5: {0.5: 1, 2.5: 5}, 1: {1: 1, 5: 5}}
+
+
+def test_compute_class_counts():
+    pixel_size = 1
+    classes = [1, 2, 3]
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    counts = multi_resolution.compute_class_counts(
+        INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size
+    )
+    assert counts.shape == (3, 50, 50)
+    for ii, c in enumerate(classes):
+        expected = map_density.compute_count(INPUT_POINTS[INPUT_CLASSIFS == c], raster_origin, TILE_WIDTH, pixel_size)
+        assert np.array_equal(counts[ii], expected)
+
+
+def test_compute_class_counts_workers():
+    pixel_size = 1
+    classes = [1, 2, 3]
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    expected = multi_resolution.compute_class_counts(
+        INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size, margin=2
+    )
+    counts = multi_resolution.compute_class_counts(
+        INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size, margin=2, workers=4
+    )
+    assert counts.dtype == expected.dtype
+    assert np.array_equal(counts, expected)
+
+
+def test_compute_class_counts_out():
+    pixel_size = 1
+    classes = [1, 2, 3]
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    expected = multi_resolution.compute_class_counts(
+        INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size
+    )
+    # accumulate the counts of two halves of the points in the same array
+    counts = np.zeros((3, 50, 50), dtype=np.uint32)
+    half = len(INPUT_POINTS) // 2
+    for points, classifs in [
+        (INPUT_POINTS[:half], INPUT_CLASSIFS[:half]),
+        (INPUT_POINTS[half:], INPUT_CLASSIFS[half:]),
+    ]:
+        out = multi_resolution.compute_class_counts(
+            points, classifs, classes, raster_origin, TILE_WIDTH, pixel_size, workers=2, out=counts
+        )
+        assert out is counts
+    assert np.array_equal(counts, expected)
+
+    with pytest.raises(ValueError):
+        multi_resolution.compute_class_counts(
+            INPUT_POINTS, INPUT_CLASSIFS, classes, raster_origin, TILE_WIDTH, pixel_size, out=np.zeros((2, 50, 50))
+        )
+
+
+def test_derive_grid_matches_direct_computation():
+    base_pixel_size = 1
+    pixel_size = 5
+    classes = sorted(np.unique(INPUT_CLASSIFS).tolist())
+    base_counts = multi_resolution.compute_class_counts(
+        INPUT_POINTS,
+        INPUT_CLASSIFS,
+        classes,
+        utils_raster.compute_raster_origin(TILE_ORIGIN, base_pixel_size),
+        TILE_WIDTH,
+        base_pixel_size,
+        margin=2,
+    )
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    # the points on the right/top edges of the derived grid are in the margin of the base grid
+    is_on_edge = (INPUT_POINTS[:, 0] == raster_origin[0] + TILE_WIDTH) | (INPUT_POINTS[:, 1] == raster_origin[1])
+    points = INPUT_POINTS[~is_on_edge]
+    classifs = INPUT_CLASSIFS[~is_on_edge]
+
+    derived_count = multi_resolution.derive_grid(base_counts.sum(axis=0), 2, 5, "sum")
+    expected_count = map_density.compute_count(points, raster_origin, TILE_WIDTH, pixel_size)
+    assert np.array_equal(derived_count, expected_count)
+
+    derived_presence = multi_resolution.derive_grid(base_counts > 0, 2, 5, "or")
+    for ii, c in enumerate(classes):
+        expected_presence = classes_mapping.compute_binary_class(
+            points[classifs == c], raster_origin, TILE_WIDTH, pixel_size
+        )
+        assert np.array_equal(derived_presence[ii], expected_presence)
+
+
+def test_derived_grid_with_edge_points_matches_compute_count():
+    base_pixel_size = 1
+    pixel_size = 5
+    classes = [1, 2]
+    raster_origin = utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size)
+    # add points on the right/top edges and on the top right corner of the derived grid
+    right, top = raster_origin[0] + TILE_WIDTH, raster_origin[1]
+    edge_points = np.array([[right, top - 12.5, 0], [right - 7.5, top, 0], [right, top, 0], [right, top, 0]])
+    points = np.vstack((INPUT_POINTS, edge_points))
+    classifs = np.concatenate((INPUT_CLASSIFS, np.array([1, 2, 1, 2], dtype=INPUT_CLASSIFS.dtype)))
+
+    base_counts = multi_resolution.compute_class_counts(
+        points,
+        classifs,
+        classes,
+        utils_raster.compute_raster_origin(TILE_ORIGIN, base_pixel_size),
+        TILE_WIDTH,
+        base_pixel_size,
+        margin=2,
+    )
+    counts = multi_resolution.derive_grid(base_counts, 2, 5, "sum")
+    assert counts.dtype == np.uint32
+    multi_resolution.count_edge_points(points, classifs, classes, raster_origin, TILE_WIDTH, pixel_size, out=counts)
+    for ii, c in enumerate(classes):
+        expected = map_density.compute_count(points[classifs == c], raster_origin, TILE_WIDTH, pixel_size)
+        assert np.array_equal(counts[ii], expected)
+
+
+def test_derive_grid_wrong_reduction():
+    with pytest.raises(ValueError):
+        multi_resolution.derive_grid(np.ones((5, 5)), 0, 5, "max")
+
+
+def test_main_ctview_multi_resolution():
+    output_dir = OUTPUT_DIR / "main_ctview_multi_resolution"
+    input_tilename = os.path.splitext(INPUT_FILENAME)[0]
+    with initialize(version_base="1.2", config_path="../configs"):
+        cfg = compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_filename={INPUT_FILENAME}",
+                f"io.input_dir={INPUT_DIR}",
+                f"io.output_dir={output_dir}",
+                f"io.tile_geometry.tile_coord_scale={TILE_COORD_SCALE}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                "buffer.size=10",
+                "density.colorize=False",
+                "class_map.output_class_subdir=CLASS",
+                "class_map.output_class_pretty_subdir=null",
+                "multi_resolution.density_pixel_sizes=[1, 5]",
+                "multi_resolution.class_pixel_sizes=[0.5, 2.5]",
+            ],
+        )
+    main(cfg)
+    for subdir, pixel_size in [("1m", 1), ("5m", 5)]:
+        with rasterio.open(output_dir / "DENS_FINAL" / subdir / f"{input_tilename}_density.tif") as raster:
+            assert raster.res == (pixel_size, pixel_size)
+            assert raster.shape == (TILE_WIDTH / pixel_size, TILE_WIDTH / pixel_size)
+    for subdir, pixel_size in [("0.5m", 0.5), ("2.5m", 2.5)]:
+        with rasterio.open(output_dir / "CLASS" / subdir / f"{input_tilename}_class.tif") as raster:
+            assert raster.res == (pixel_size, pixel_size)
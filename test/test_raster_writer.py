@@ -0,0 +1,92 @@
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+import rasterio
+from omegaconf import OmegaConf
+
+from ctview import raster_writer
+from ctview.raster_writer import RasterWriter
+from ctview.utils_raster import write_multiband_raster_to_file
+
+OUTPUT_DIR = os.path.join("tmp", "raster_writer")
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR)
+
+
+def get_config_io(output_dir: str, writer_workers: int = 2, writer_queue_size: int = 2):
+    return OmegaConf.create(
+        {"output_dir": output_dir, "writer_workers": writer_workers, "writer_queue_size": writer_queue_size}
+    )
+
+
+@pytest.mark.parametrize("writer_workers", [0, 2])
+def test_background_writer(writer_workers):
+    output_dir = os.path.join(OUTPUT_DIR, f"background_writer_{writer_workers}")
+    intermediate_dir = os.path.join(OUTPUT_DIR, f"intermediate_{writer_workers}")
+    os.makedirs(output_dir)
+    os.makedirs(intermediate_dir)
+    arrays = [np.full((1, 20, 30), ii, dtype=np.float32) for ii in range(6)]
+
+    with raster_writer.background_writer(get_config_io(output_dir, writer_workers)):
+        for ii, array in enumerate(arrays):
+            write_multiband_raster_to_file(array, (1000, 2000), os.path.join(output_dir, f"raster_{ii}.tif"))
+        # the rasters that are not in the output directory are written right away
+        intermediate_tif = os.path.join(intermediate_dir, "raster.tif")
+        write_multiband_raster_to_file(arrays[0], (1000, 2000), intermediate_tif)
+        assert os.path.isfile(intermediate_tif)
+
+    # all the rasters are written when the context exits
+    for ii, array in enumerate(arrays):
+        with rasterio.open(os.path.join(output_dir, f"raster_{ii}.tif")) as raster:
+            assert np.array_equal(raster.read(), array)
+
+
+def test_background_writer_error():
+    output_dir = os.path.join(OUTPUT_DIR, "background_writer_error")
+    os.makedirs(output_dir)
+    with pytest.raises(rasterio.errors.RasterioIOError):
+        with raster_writer.background_writer(get_config_io(output_dir)):
+            write_multiband_raster_to_file(np.ones((1, 5, 5)), (0, 0), os.path.join(output_dir, "missing", "r.tif"))
+    assert raster_writer.get_active_writer() is None
+
+
+def test_raster_writer_bounded_queue():
+    writer = RasterWriter(OUTPUT_DIR, workers=1, max_pending=2)
+    release = threading.Event()
+    started = []
+
+    def slow_write(ii):
+        started.append(ii)
+        release.wait()
+
+    writer.submit(os.path.join(OUTPUT_DIR, "0.tif"), slow_write, 0)
+    writer.submit(os.path.join(OUTPUT_DIR, "1.tif"), slow_write, 1)
+    # the queue is full: the third raster is submitted once a write is done
+    submitter = threading.Thread(target=writer.submit, args=(os.path.join(OUTPUT_DIR, "2.tif"), slow_write, 2))
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+
+    release.set()
+    submitter.join()
+    writer.flush()
+    writer.shutdown()
+    assert started == [0, 1, 2]
+    assert writer.pending == {}
+
+
+@pytest.mark.parametrize("override", [{"writer_workers": -1}, {"writer_queue_size": 0}])
+def test_background_writer_config_fail(override):
+    config_io = OmegaConf.merge(get_config_io(OUTPUT_DIR), override)
+    with pytest.raises(ValueError):
+        with raster_writer.background_writer(config_io):
+            pass
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from ctview import shared_points
+from ctview.shared_points import SharedPoints
+
+
+def sum_shared_points(name: str) -> float:
+    arrays = shared_points.attach(name)
+    return float(arrays["points"].sum()), int(arrays["classifs"].sum())
+
+
+def test_shared_points():
+    points = np.random.default_rng(0).uniform(0, 100, (1000, 3))
+    classifs = np.arange(1000, dtype=np.uint8)
+    with SharedPoints({"points": points, "classifs": classifs}) as shared:
+        assert os.path.isdir(shared.name)
+        arrays = shared_points.attach(shared.name)
+        assert np.array_equal(arrays["points"], points)
+        assert arrays["classifs"].dtype == np.uint8
+        # the views are read-only memory maps, not copies
+        assert isinstance(arrays["points"], np.memmap)
+        with pytest.raises(ValueError):
+            arrays["points"][0, 0] = 0
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(sum_shared_points, [shared.name] * 2))
+        assert results == [(float(points.sum()), int(classifs.sum()))] * 2
+
+    assert not os.path.exists(shared.name)
+
+
+def test_shared_points_removed_on_error():
+    with pytest.raises(RuntimeError):
+        with SharedPoints({"points": np.zeros((10, 3))}) as shared:
+            raise RuntimeError("worker failed")
+    assert not os.path.exists(shared.name)
+
+
+def test_shared_points_allocate():
+    classifs = np.arange(100, dtype=np.uint8)
+    with SharedPoints() as shared:
+        shared_classifs = shared.allocate("classifs", classifs.shape, classifs.dtype)
+        shared_classifs[:] = classifs  # filled in place: visible from the other processes
+        assert np.array_equal(shared_points.attach(shared.name)["classifs"], classifs)
+
+
+def test_shared_points_removed_when_collected():
+    shared = SharedPoints({"points": np.zeros((10, 3))})
+    name = shared.name
+    del shared
+    assert not os.path.exists(name)
+
+
+def test_shared_points_fallback_when_full(monkeypatch):
+    small_dir = os.path.join("tmp", "shared_points", "small")
+    os.makedirs(small_dir, exist_ok=True)
+    disk_usage = shutil.disk_usage
+
+    # the small directory has room for 1000 bytes only
+    def fake_disk_usage(path):
+        usage = disk_usage(path)
+        return usage._replace(free=1000) if os.path.samefile(path, small_dir) else usage
+
+    monkeypatch.setattr(shared_points.shutil, "disk_usage", fake_disk_usage)
+    assert shared_points.get_shared_memory_dir(1000, small_dir) == small_dir
+    assert shared_points.get_shared_memory_dir(1001, small_dir) == tempfile.gettempdir()
+
+    points = np.zeros((100, 3))
+    with SharedPoints({"points": points}, base_dir=small_dir) as shared:
+        assert os.path.dirname(shared.name) == tempfile.gettempdir()
+        assert np.array_equal(shared_points.attach(shared.name)["points"], points)
+    with SharedPoints(base_dir=small_dir, nbytes=100) as shared:
+        assert os.path.dirname(shared.name) == small_dir
+
+    # no room in the temporary directory either
+    with pytest.raises(OSError):
+        shared_points.get_shared_memory_dir(disk_usage(tempfile.gettempdir()).total + 1, small_dir)
@@ -0,0 +1,101 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+from ctview import block, spatial_index, utils_pdal
+
+OUTPUT_DIR = Path("tmp") / "spatial_index"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+INPUT_LAS = INPUT_DIR / "test_data_77055_627755_LA93_IGN69.laz"
+INPUT_COPC = Path("data") / "las" / "classee" / "test_data_77050_627755_LA93_IGN69.copc.laz"
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+BUFFER_SIZE = 10
+CELL_SIZE = 10
+CHUNK_SIZE = 2000
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def test_build_index():
+    las_file = OUTPUT_DIR / "build_index" / INPUT_LAS.name
+    os.makedirs(las_file.parent)
+    shutil.copy(INPUT_LAS, las_file)
+    assert spatial_index.load_index(las_file) is None
+
+    index = spatial_index.build_index(las_file, CELL_SIZE, CHUNK_SIZE)
+    assert sum(count for _, count in index["chunks"]) == laspy.read(las_file).header.point_count
+    assert spatial_index.load_index(las_file) == index
+    # incremental: the index is not built again
+    index_mtime = os.stat(spatial_index.get_index_path(las_file)).st_mtime_ns
+    spatial_index.build_index(las_file, CELL_SIZE, CHUNK_SIZE)
+    assert os.stat(spatial_index.get_index_path(las_file)).st_mtime_ns == index_mtime
+
+    # the index of a modified file is not used
+    os.utime(las_file, ns=(0, 0))
+    assert spatial_index.load_index(las_file) is None
+
+
+def test_read_chunks_in_bounds():
+    las_file = OUTPUT_DIR / "read_chunks" / INPUT_LAS.name
+    spatial_index.sort_las_points(INPUT_LAS, las_file, CELL_SIZE)
+    index = spatial_index.build_index(las_file, CELL_SIZE, CHUNK_SIZE)
+    las = laspy.read(las_file)
+    xmin, ymin = np.floor(las.x.min()), np.floor(las.y.min())
+    bounds = (xmin, ymin, xmin + BUFFER_SIZE, ymin + TILE_WIDTH)
+
+    chunks = spatial_index.read_chunks_in_bounds(las_file, bounds, index)
+    assert len(chunks.points) < len(las.points) / 2  # only the chunks of the western strip are decoded
+    expected = las.points[block.is_in_bounds(np.vstack((las.x, las.y)).transpose(), bounds)]
+    points = chunks.points[block.is_in_bounds(np.vstack((chunks.x, chunks.y)).transpose(), bounds)]
+    assert np.array_equal(points.array, expected.array)
+
+
+def test_read_block_points_with_index():
+    input_dir = OUTPUT_DIR / "block"
+    for filename in utils_pdal.list_tiles(INPUT_DIR):
+        spatial_index.sort_las_points(INPUT_DIR / filename, input_dir / filename, CELL_SIZE)
+    tiles_by_index = block.get_tiles_by_index(utils_pdal.list_tiles(input_dir), TILE_WIDTH, TILE_COORD_SCALE)
+    tiles = [(15410, 125551)]
+    expected = block.read_block_points(tiles, tiles_by_index, input_dir, TILE_WIDTH, BUFFER_SIZE)
+
+    for filename in utils_pdal.list_tiles(input_dir):
+        spatial_index.build_index(input_dir / filename, CELL_SIZE, CHUNK_SIZE)
+    block_points = block.read_block_points(tiles, tiles_by_index, input_dir, TILE_WIDTH, BUFFER_SIZE)
+    assert np.array_equal(block_points.points, expected.points)
+    assert np.array_equal(block_points.classifs, expected.classifs)
+    assert block_points.nb_decoded_bytes < expected.nb_decoded_bytes
+
+
+def test_is_copc():
+    assert spatial_index.is_copc(INPUT_COPC)
+    assert not spatial_index.is_copc(INPUT_LAS)
+    assert not spatial_index.is_copc(Path("data") / "las" / "test_data_0000_0000_LA93_IGN69_ground.las")
+
+
+def test_read_copc():
+    las = laspy.read(INPUT_COPC)
+    copc, point_count = spatial_index.read_copc(INPUT_COPC)
+    assert len(copc.points) == point_count == len(las.points)
+    assert not any(isinstance(vlr, laspy.copc.CopcInfoVlr) for vlr in copc.header.vlrs)
+
+    xmin, ymin = np.floor(las.x.min()), np.floor(las.y.min())
+    bounds = (xmin, ymin, xmin + BUFFER_SIZE, ymin + TILE_WIDTH)
+    copc, _ = spatial_index.read_copc(INPUT_COPC, bounds)
+    expected = np.count_nonzero(block.is_in_bounds(np.vstack((las.x, las.y)).transpose(), bounds))
+    assert np.count_nonzero(block.is_in_bounds(np.vstack((copc.x, copc.y)).transpose(), bounds)) == expected
+    assert len(copc.points) < len(las.points)
+
+    # low resolution preview: only the coarse levels of the octree
+    copc, _ = spatial_index.read_copc(INPUT_COPC, resolution=5)
+    assert 0 < len(copc.points) < len(las.points)
@@ -0,0 +1,134 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+import rasterio
+from hydra import compose, initialize
+from osgeo import gdal
+
+from ctview import multi_resolution, streaming, utils_raster
+from ctview.main_ctview import main
+
+gdal.UseExceptions()
+
+OUTPUT_DIR = Path("tmp") / "streaming"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+INPUT_FILENAME = "test_data_77055_627755_LA93_IGN69.laz"
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+TILE_ORIGIN = (770550, 6277550)
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def get_config(output_dir: Path, overrides: list = []):
+    with initialize(version_base="1.2", config_path="../configs"):
+        return compose(
+            config_name="config_control",
+            overrides=[
+                f"io.input_filename={INPUT_FILENAME}",
+                f"io.input_dir={INPUT_DIR}",
+                f"io.output_dir={output_dir}",
+                f"io.tile_geometry.tile_coord_scale={TILE_COORD_SCALE}",
+                f"io.tile_geometry.tile_width={TILE_WIDTH}",
+                "buffer.size=10",
+                "density.pixel_size=2",
+                "class_map.output_class_subdir=CLASS",
+            ]
+            + overrides,
+        )
+
+
+def test_get_points_backend():
+    assert streaming.get_points_backend(get_config(OUTPUT_DIR).io) == "memory"
+    with pytest.raises(ValueError):
+        streaming.get_points_backend(get_config(OUTPUT_DIR, ["io.points_backend=chunks"]).io)
+
+
+def test_get_tile_and_neighbor_files():
+    las_files = streaming.get_tile_and_neighbor_files(INPUT_FILENAME, get_config(OUTPUT_DIR).io)
+    assert las_files[0] == os.path.join(INPUT_DIR, INPUT_FILENAME)
+    assert len(las_files) == 6
+
+    with pytest.raises(ValueError):
+        streaming.get_tile_and_neighbor_files("test_data_77100_627760_LA93_IGN69.laz", get_config(OUTPUT_DIR).io)
+
+
+def test_accumulate_class_counts():
+    pixel_sizes = [1, 5]
+
+    def read_chunks():
+        with laspy.open(INPUT_DIR / INPUT_FILENAME) as reader:
+            for points in reader.chunk_iterator(5000):
+                yield np.vstack((points.x, points.y, points.z)).transpose(), np.asarray(points.classification)
+
+    counts_by_pixel_size, classes = streaming.accumulate_class_counts(
+        read_chunks(), TILE_ORIGIN, TILE_WIDTH, pixel_sizes
+    )
+
+    las = laspy.read(INPUT_DIR / INPUT_FILENAME)
+    assert classes == sorted(np.unique(las.classification).tolist())
+    for pixel_size in pixel_sizes:
+        expected = multi_resolution.compute_class_counts(
+            np.vstack((las.x, las.y, las.z)).transpose(),
+            np.asarray(las.classification),
+            classes,
+            utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size=pixel_size),
+            TILE_WIDTH,
+            pixel_size,
+        )
+        assert np.array_equal(counts_by_pixel_size[pixel_size], expected)
+
+
+def test_accumulate_class_counts_new_classes():
+    pixel_size = 5
+    las = laspy.read(INPUT_DIR / INPUT_FILENAME)
+    points = np.vstack((las.x, las.y, las.z)).transpose()
+    classifs = np.asarray(las.classification)
+    classes = sorted(np.unique(classifs).tolist())
+
+    # one chunk per class, in reverse order: each chunk adds a class before the ones already counted
+    chunks = [(points[classifs == c], classifs[classifs == c]) for c in reversed(classes)]
+    counts_by_pixel_size, counted_classes = streaming.accumulate_class_counts(
+        chunks, TILE_ORIGIN, TILE_WIDTH, [pixel_size]
+    )
+
+    assert counted_classes == classes
+    expected = multi_resolution.compute_class_counts(
+        points,
+        classifs,
+        classes,
+        utils_raster.compute_raster_origin(TILE_ORIGIN, pixel_size=pixel_size),
+        TILE_WIDTH,
+        pixel_size,
+    )
+    assert counts_by_pixel_size[pixel_size].dtype == np.uint32
+    assert np.array_equal(counts_by_pixel_size[pixel_size], expected)
+
+
+def test_main_ctview_streaming():
+    tilename = os.path.splitext(INPUT_FILENAME)[0]
+    main(get_config(OUTPUT_DIR / "memory"))
+    main(get_config(OUTPUT_DIR / "stream", ["io.points_backend=stream", "io.stream_chunk_size=5000"]))
+
+    # Same products as the ones computed from the points in memory
+    for product in [
+        Path("DENS_FINAL") / f"{tilename}_density.tif",
+        Path("CLASS") / f"{tilename}_class.tif",
+        Path("CLASS_FINAL") / f"{tilename}.tif",
+    ]:
+        with rasterio.open(OUTPUT_DIR / "memory" / product) as expected, rasterio.open(
+            OUTPUT_DIR / "stream" / product
+        ) as raster:
+            assert raster.transform == expected.transform
+            assert np.array_equal(raster.read(), expected.read())
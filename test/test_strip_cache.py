@@ -0,0 +1,93 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+from ctview import block, utils_pdal
+from ctview.strip_cache import StripCache, get_strip_mask
+
+OUTPUT_DIR = Path("tmp") / "strip_cache"
+
+INPUT_DIR = Path("data") / "las" / "ground"
+INPUT_LAS = INPUT_DIR / "test_data_77055_627755_LA93_IGN69.laz"
+TILE_WIDTH = 50
+TILE_COORD_SCALE = 10
+BUFFER_SIZE = 10
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def get_strip(las_file: Path, buffer_size: float = BUFFER_SIZE) -> laspy.LasData:
+    las = laspy.read(las_file)
+    xy = np.vstack((las.x, las.y)).transpose()
+    bounds = (np.floor(xy.min(axis=0) / TILE_WIDTH) * TILE_WIDTH).tolist()
+    mask = get_strip_mask(xy, (*bounds, bounds[0] + TILE_WIDTH, bounds[1] + TILE_WIDTH), buffer_size)
+    return laspy.LasData(las.header, las.points[mask])
+
+
+def test_get_strip_mask():
+    points = np.array([[5, 5], [10, 10], [15, 12], [25, 25], [40, 25], [49, 49], [51, 25]])
+    mask = get_strip_mask(points, (0, 0, 50, 50), 10)
+    assert np.array_equal(mask, [True, True, False, False, True, True, True])
+
+
+def test_strip_cache_lru():
+    strip = get_strip(INPUT_LAS)
+    strip_size = strip.points.array.nbytes / 1024**2
+    other_las = INPUT_DIR / "test_data_77050_627755_LA93_IGN69.laz"
+
+    cache = StripCache(memory_budget=1.5 * strip_size)
+    assert cache.get(INPUT_LAS, BUFFER_SIZE) is None
+    cache.put(INPUT_LAS, BUFFER_SIZE, strip)
+    assert cache.get(INPUT_LAS, BUFFER_SIZE) is strip
+    assert cache.get(INPUT_LAS, 2 * BUFFER_SIZE) is None  # the buffer size is part of the key
+
+    # the least recently used strip is evicted
+    cache.put(other_las, BUFFER_SIZE, get_strip(other_las))
+    assert cache.get(INPUT_LAS, BUFFER_SIZE) is None
+    assert cache.get(other_las, BUFFER_SIZE) is not None
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (2, 0, 3)
+
+
+def test_strip_cache_on_disk():
+    las_file = OUTPUT_DIR / "on_disk" / INPUT_LAS.name
+    os.makedirs(las_file.parent)
+    shutil.copy(INPUT_LAS, las_file)
+    strip = get_strip(las_file)
+
+    cache = StripCache(memory_budget=0, cache_dir=OUTPUT_DIR / "on_disk" / "cache")
+    cache.put(las_file, BUFFER_SIZE, strip)
+    assert len(cache.strips) == 0  # not in memory (budget), but on disk
+    read_strip = cache.get(las_file, BUFFER_SIZE)
+    assert np.array_equal(read_strip.x, strip.x)
+    assert np.array_equal(read_strip.classification, strip.classification)
+    assert cache.disk_hits == 1
+
+    # a modified file is not served from the cache
+    os.utime(las_file, ns=(0, 0))
+    assert cache.get(las_file, BUFFER_SIZE) is None
+
+
+def test_read_block_points_with_strip_cache():
+    tiles_by_index = block.get_tiles_by_index(utils_pdal.list_tiles(INPUT_DIR), TILE_WIDTH, TILE_COORD_SCALE)
+    cache = StripCache(memory_budget=100)
+    nb_decoded_files = 0
+    for tiles in block.group_tiles_by_block(list(tiles_by_index), 1):
+        expected = block.read_block_points(tiles, tiles_by_index, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE)
+        block_points = block.read_block_points(tiles, tiles_by_index, INPUT_DIR, TILE_WIDTH, BUFFER_SIZE, cache)
+        nb_decoded_files += block_points.nb_decoded_files
+        expected_order = np.lexsort(expected.points.transpose())
+        order = np.lexsort(block_points.points.transpose())
+        assert np.array_equal(block_points.points[order], expected.points[expected_order])
+        assert np.array_equal(block_points.classifs[order], expected.classifs[expected_order])
+
+    assert nb_decoded_files < 28  # number of decoded files without cache
+    assert cache.memory_hits > 0
@@ -0,0 +1,71 @@
+import os
+import shutil
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+
+from ctview import utils_las
+from ctview.utils_las import read_las
+
+LAS_FILE = "data/las/test_data_770500_6277550_LA93_IGN69_ground.las"
+LAZ_FILE = "data/las/ground/test_data_77055_627755_LA93_IGN69.laz"
+EMPTY_LAS_FILE = "data/las/test_data_empty.las"
+OUTPUT_DIR = Path("tmp") / "utils_las"
+EXTRA_BYTES_LAS_FILE = OUTPUT_DIR / "extra_bytes.las"
+PADDED_LAS_FILE = OUTPUT_DIR / "padded.las"
+
+
+def setup_module():
+    try:
+        shutil.rmtree(OUTPUT_DIR)
+    except FileNotFoundError:
+        pass
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    las = laspy.read(LAS_FILE)
+    las.add_extra_dim(laspy.ExtraBytesParams(name="extra", type="f4"))
+    las.extra = np.arange(len(las.points), dtype=np.float32)
+    las.write(EXTRA_BYTES_LAS_FILE)
+
+    # same records without the extra bytes vlr: the extra bytes are an undescribed padding of the records
+    data = bytearray(EXTRA_BYTES_LAS_FILE.read_bytes())
+    user_id = b"LASF_Spec".ljust(16, b"\0")
+    user_id_start = data.index(user_id + (4).to_bytes(2, "little"))
+    user_id_stop = user_id_start + len(user_id)
+    data[user_id_start:user_id_stop] = b"ctview_test".ljust(16, b"\0")
+    PADDED_LAS_FILE.write_bytes(bytes(data))
+
+
+@pytest.mark.parametrize("las_file", [LAS_FILE, LAZ_FILE, EMPTY_LAS_FILE, EXTRA_BYTES_LAS_FILE, PADDED_LAS_FILE])
+def test_read_las(las_file):
+    expected = laspy.read(las_file)
+    las = read_las(las_file)
+    assert las.header.point_count == expected.header.point_count
+    for dimension in ["x", "y", "z", "classification"]:
+        assert np.array_equal(las[dimension], expected[dimension])
+
+
+def test_read_las_mmap():
+    las = read_las(LAS_FILE)
+    # the records of an uncompressed file are memory-mapped, read-only
+    assert isinstance(las.points.array, np.memmap)
+    assert not las.points.array.flags.writeable
+    assert not isinstance(read_las(LAS_FILE, mmap=False).points.array, np.memmap)
+    assert not isinstance(read_las(LAZ_FILE).points.array, np.memmap)
+
+
+def test_read_las_extra_bytes():
+    las = read_las(EXTRA_BYTES_LAS_FILE)
+    assert isinstance(las.points.array, np.memmap)
+    assert np.array_equal(las.extra, np.arange(len(las.points), dtype=np.float32))
+    assert utils_las.read_point_record_length(PADDED_LAS_FILE) == las.header.point_format.size
+
+
+def test_read_las_record_length_mismatch(monkeypatch):
+    # records that do not match the point format are not memory-mapped
+    monkeypatch.setattr(utils_las, "read_point_record_length", lambda las_file: 0)
+    las = read_las(LAS_FILE)
+    assert not isinstance(las.points.array, np.memmap)
+    assert np.array_equal(las.x, laspy.read(LAS_FILE).x)
@@ -2,7 +2,12 @@ import os
 
 import numpy as np
 
-from ctview.utils_pdal import get_bounds_from_las, read_las_file
+from ctview.utils_pdal import (
+    get_bounds_from_las,
+    get_las_metadata,
+    get_tile_index,
+    read_las_file,
+)
 
 path = os.path.join("test", "blue", "jones.tif")
 dir = os.path.join("test", "blue")
@@ -13,7 +18,8 @@ DATA_DIR = os.path.join("data", "las")
 FILE_MUTLI_1_TO_5 = "multiclass_1to5.las"
 FILE_MUTLI_65_TO_66 = "test_data_multiclass_65to66.las"
 
-# Expected : ([minx,maxx],[miny,maxy])
+# Expected : ([minx,maxx],[miny,maxy]), the header bounds are larger than the points bounds for this file
+BoundsExpected_FILE_MUTLI_65_TO_66_HEADER = ([940967, 940972.95], [6538269.82, 6538298.45])
 BoundsExpected_FILE_MUTLI_65_TO_66 = (
     [
         940967,
@@ -31,4 +37,28 @@ def test_read_las_file():
 def test_get_bounds_from_las():
     bounds = get_bounds_from_las(in_las=os.path.join(DATA_DIR, FILE_MUTLI_65_TO_66))
     assert isinstance(bounds, tuple)
+    assert np.allclose(bounds, BoundsExpected_FILE_MUTLI_65_TO_66_HEADER)
+
+
+def test_get_bounds_from_las_exact():
+    bounds = get_bounds_from_las(in_las=os.path.join(DATA_DIR, FILE_MUTLI_65_TO_66), exact=True)
+    assert isinstance(bounds, tuple)
     assert bounds == BoundsExpected_FILE_MUTLI_65_TO_66
+
+
+def test_get_las_metadata():
+    metadata = get_las_metadata(os.path.join(DATA_DIR, "test_data_0000_0000_LA93_IGN69_ground.las"))
+    assert metadata["point_count"] == 21172
+    assert metadata["point_format"] == 3
+    assert metadata["crs"] == "EPSG:2154"
+    metadata = get_las_metadata(os.path.join(DATA_DIR, "ground", "test_data_77055_627755_LA93_IGN69.laz"))
+    assert metadata["crs"].startswith('PROJCS["RGF93 v1 / Lambert-93"')
+    assert get_las_metadata(os.path.join(DATA_DIR, FILE_MUTLI_65_TO_66))["crs"] is None  # user-defined
+
+
+def test_get_tile_index():
+    tile_index = get_tile_index(os.path.join(DATA_DIR, "ground"), workers=2)
+    assert len(tile_index) == 6
+    xmin, ymin, xmax, ymax = tile_index["test_data_77055_627755_LA93_IGN69.laz"]["bounds"]
+    assert 770550 <= xmin < xmax <= 770600
+    assert 6277500 <= ymin < ymax <= 6277550
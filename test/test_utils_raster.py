@@ -6,8 +6,12 @@ import pytest
 import rasterio
 from osgeo import gdal
 
+from ctview.map_density import compute_count
 from ctview.utils_raster import (
     check_colormap_fits_raster_data,
+    compute_raster_origin,
+    get_creation_options,
+    is_in_raster_extent,
     write_single_band_raster_to_file,
 )
 
@@ -107,3 +111,51 @@ def test_check_colormap_fits_raster_data_fail():
     data = np.array([[1, 2], [1, 2]])
     with pytest.raises(ValueError):
         check_colormap_fits_raster_data(colormap, data)
+
+
+def test_write_single_band_raster_to_file_cog():
+    input_array = np.ones([2048, 2048])
+    input_array[:1024, :] = 2
+    colormap = [
+        {"value": 1, "color": [255, 0, 0], "description": "value_1"},
+        {"value": 2, "color": [255, 0, 255], "description": "value_2"},
+    ]
+    output_tif = os.path.join(OUTPUT_DIR, "test_write_single_band_raster_cog.tif")
+    write_single_band_raster_to_file(
+        input_array,
+        [1000, 2000],
+        output_tif,
+        pixel_size=1,
+        epsg=2154,
+        raster_driver="COG",
+        colormap=colormap,
+    )
+
+    with rasterio.open(output_tif) as raster:
+        assert raster.tags(ns="IMAGE_STRUCTURE")["LAYOUT"] == "COG"
+        assert raster.overviews(1)  # overviews have been computed while writing
+        assert np.all(raster.read(1) == input_array)
+
+
+def test_get_creation_options():
+    assert get_creation_options("GTiff", "AVERAGE") == {}
+    assert get_creation_options("COG", "AVERAGE") == {"RESAMPLING": "AVERAGE"}
+
+
+def test_is_in_raster_extent():
+    tile_origin = (1000, 2000)
+    tile_width = 50
+    rng = np.random.default_rng(0)
+    # tile with a 10m buffer, plus points on the tile and rasters edges
+    points = rng.uniform([990, 1940, 0], [1060, 2010, 1], size=(10000, 3))
+    edges = np.array([[1000, 2000, 0], [1050, 1950, 0], [997.5, 2002.5, 0], [1050, 2002.5, 0], [997.4, 1990, 0]])
+    points = np.vstack([points, edges])
+
+    is_kept = is_in_raster_extent(points, tile_origin, tile_width, 5)
+    assert np.array_equal(is_kept[-5:], [True, True, True, True, False])
+    for pixel_size in [0.5, 1, 5]:
+        raster_origin = compute_raster_origin(tile_origin, pixel_size)
+        assert np.array_equal(
+            compute_count(points[is_kept], raster_origin, tile_width, pixel_size),
+            compute_count(points, raster_origin, tile_width, pixel_size),
+        )